@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, send_file, redirect
+from flask import Flask, jsonify, request, send_file, redirect, make_response
 from flask_cors import CORS
 import os
 import uuid
@@ -18,7 +18,20 @@ import tempfile
 from services.pixel_analyzer import PixelAnalyzer
 from services.ai_analyzer import AIAnalyzer
 from services.file_handler import FileHandler
-from services.supabase_storage import SupabaseStorageService
+from services.storage_backends import create_storage_backend
+from services.result_formatter import format_result, parse_page_args
+from services.response_cache import ResponseCache
+from services.stats_aggregator import StatisticsAggregator
+from services.analysis_runner import AnalysisRunner
+from services.job_broker import SQLiteJobBroker
+from services.library_index import LibraryIndexStore
+from services.similarity_graph import SimilarityGraph
+from services.result_cache import ResultCache, get_result_cache_config
+from services.upload_dedup import UploadHashIndex
+from services.chunked_upload import ChunkedUploadManager, ChunkedUploadError
+from services.workspace_reaper import WorkspaceReaper
+from services.fair_share import FairShareScheduler, AdmissionError, get_fair_share_config, estimate_cost
+from services.session_search import SessionEmbeddingStore, get_session_search_config, DEFAULT_SEARCH_K, MAX_SEARCH_K
 
 # Load environment variables
 load_dotenv()
@@ -32,15 +45,219 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 # Enable CORS for all routes
 CORS(app, origins=["http://localhost:3000"], supports_credentials=True)
 
+# 'thread' runs analyses inside this process, 'broker' queues them for `python -m services.worker`
+ANALYSIS_MODE = os.getenv('PICKPERFECT_ANALYSIS_MODE', 'thread')
+
 # Initialize services
 pixel_analyzer = PixelAnalyzer()
-ai_analyzer = AIAnalyzer()
-file_handler = FileHandler()
-supabase_storage = SupabaseStorageService()
+# Web processes in broker mode never run analyses, so they don't load CLIP
+ai_analyzer = AIAnalyzer() if ANALYSIS_MODE != 'broker' else None
+# Content hashes of each user's uploads, so byte-identical files are stored once
+file_handler = FileHandler(hash_index=UploadHashIndex() if os.getenv('PICKPERFECT_UPLOAD_DEDUP', '1') != '0' else None)
+chunked_uploads = ChunkedUploadManager(file_handler)
+# Removes expired sessions and leftover temp directories, and enforces PICKPERFECT_DISK_BUDGET_MB
+workspace_reaper = WorkspaceReaper(file_handler.upload_folder)
+# Supabase, or photos read in place from a local/NFS directory (PICKPERFECT_STORAGE_BACKEND)
+storage = create_storage_backend()
+# Per-user persistent index used to flag duplicates across sessions
+library_store = LibraryIndexStore() if os.getenv('PICKPERFECT_LIBRARY_INDEX', '1') != '0' else None
+# Results keyed by each session's content manifest, shared with the workers
+result_cache = ResultCache() if get_result_cache_config()['enabled'] else None
+# CLIP embeddings of analyzed sessions, searched by /api/search/<session_id>
+session_search_config = get_session_search_config()
+session_embeddings = SessionEmbeddingStore() if session_search_config['enabled'] else None
+analysis_runner = AnalysisRunner(storage, pixel_analyzer, lambda: ai_analyzer, library_store, result_cache,
+                                 session_embeddings, session_search_config['embed_all'])
+job_broker = SQLiteJobBroker() if ANALYSIS_MODE == 'broker' else None
+# In thread mode, analyses wait in per-user queues for one of PICKPERFECT_MAX_CONCURRENT_JOBS threads
+fair_share_config = get_fair_share_config()
+analysis_scheduler = None
+if ANALYSIS_MODE != 'broker' and fair_share_config['enabled']:
+    analysis_scheduler = FairShareScheduler(fair_share_config)
+
+def start_background_services():
+    """Start the reaper and analysis threads (in each worker, when a pre-forking server preloaded the app)"""
+    workspace_reaper.start()
+    if analysis_scheduler is not None:
+        analysis_scheduler.start()
+
+# Set once this process drains; results finished from then on are handed to its replacement
+analyses_draining = False
+
+def drain_analyses(timeout=None):
+    """Refuse new analyses and wait for queued and running ones to finish; False if some were still running"""
+    global analyses_draining
+    analyses_draining = True
+    workspace_reaper.stop()
+    if analysis_scheduler is not None:
+        return analysis_scheduler.stop(drain=True, timeout=timeout)
+    return True
+
+# gunicorn.conf.py loads the app before forking and starts the threads in each worker instead
+if os.getenv('PICKPERFECT_PRELOAD') != '1':
+    start_background_services()
 
 # Store analysis results in memory (in production, use a database)
 analysis_results = {}
 
+# Similarity graphs of finished analyses, used to re-group them at other thresholds
+similarity_graphs = {}
+
+# Profiles of analyses started with "profile": true, served by /api/profile/<session_id>
+job_profiles = {}
+
+# Broker mode: (job id, updated_at) of the broker job each local result was copied from
+broker_versions = {}
+
+# Encodes search queries in broker mode, where this process does not load CLIP for analyses
+search_analyzer = None
+search_analyzer_lock = threading.Lock()
+
+# Serialized result bodies, keyed by result revision for ETag/304 handling
+response_cache = ResponseCache()
+
+# Running statistics, updated once per finished job instead of on every request
+statistics_aggregator = StatisticsAggregator()
+
+def store_analysis_result(session_id, result, timings=None, record='job'):
+    """Store the result of an analysis and invalidate cached responses for it
+    
+    ``record`` is how the statistics count it: 'job' for a finished analysis,
+    'cache_hit' for a result answered from the result cache, or None when it
+    was counted before (e.g. a re-grouping).
+    """
+    if analyses_draining and job_broker is None and result_cache is not None:
+        # This worker no longer serves requests; its replacement picks the result up
+        result_cache.put_session(session_id, result)
+    is_new_session = session_id not in analysis_results
+    # Keep the graph out of API responses; a result without one drops the stale graph
+    graph = result.pop('similarity_graph', None)
+    if graph is not None:
+        similarity_graphs[session_id] = SimilarityGraph.from_dict(graph)
+    else:
+        similarity_graphs.pop(session_id, None)
+    profile = result.pop('profile', None)
+    if profile is not None:
+        job_profiles[session_id] = profile
+    else:
+        job_profiles.pop(session_id, None)
+    analysis_results[session_id] = result
+    response_cache.bump_revision(session_id)
+    statistics_aggregator.record_session_stored(is_new_session)
+    if record == 'job':
+        statistics_aggregator.record_job(result, timings)
+    elif record == 'cache_hit':
+        statistics_aggregator.record_cache_hit(timings)
+
+def discard_analysis_result(session_id):
+    """Drop the local result of a session, with its graph and profile"""
+    if analysis_results.pop(session_id, None) is not None:
+        statistics_aggregator.record_session_removed()
+    similarity_graphs.pop(session_id, None)
+    job_profiles.pop(session_id, None)
+    broker_versions.pop(session_id, None)
+    if job_broker is None and result_cache is not None:
+        result_cache.discard_session(session_id)
+    response_cache.bump_revision(session_id)
+
+def adopt_handed_over_result(session_id):
+    """Thread mode: take over a result a replaced worker finished while draining"""
+    if result_cache is None or session_id in analysis_results:
+        return
+    result = result_cache.take_session(session_id)
+    if result is not None:
+        store_analysis_result(session_id, result, record=None)
+
+def read_result(session_id):
+    """The stored result of a session (or None) and the (revision, broker version) it is served under
+
+    The revision and version are read before the result, so the result is at
+    least as new as they are and an ETag never vouches for an older body.
+    """
+    tag = (response_cache.revision(session_id), broker_versions.get(session_id))
+    return analysis_results.get(session_id), tag
+
+def cached_json_response(session_id, variant, tag, build_payload):
+    """Build a JSON response with ETag, 304 and gzip support
+
+    ``tag`` is the (revision, broker version) pair read_result returned with
+    the result that ``build_payload`` formats. The body is only serialized
+    once per result revision, variant and encoding, so repeated polls of an
+    unchanged result are answered from the cache.
+    """
+    revision, version = tag
+    use_gzip = 'gzip' in request.accept_encodings
+    etag = response_cache.make_etag(session_id, variant, revision, version, use_gzip)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    body, gzipped = response_cache.get_body(session_id, etag, build_payload, use_gzip)
+
+    response = make_response(body)
+    response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def sync_broker_result(session_id):
+    """Bring the local copy of a session's result up to date with its latest broker job
+    
+    Each web worker keeps its own copy, so it is replaced whenever the
+    broker's job or its last update (e.g. a re-grouping written by another
+    worker) differs from the one it was copied from, and dropped while a new
+    analysis is pending or once the session's jobs are gone. In thread mode
+    it picks up a result handed over by a replaced worker instead.
+    """
+    if job_broker is None:
+        adopt_handed_over_result(session_id)
+        return None
+    
+    job = job_broker.get_session_job(session_id, include_result=False)
+    synced = broker_versions.get(session_id)
+    if job is None:
+        if synced is not None:
+            discard_analysis_result(session_id)
+        return None
+    if synced == (job['id'], job['updated_at']):
+        return job
+    
+    if job['status'] in ('completed', 'failed'):
+        job = job_broker.get_job(job['id']) or job
+        result = job.get('result') or {'error': job['error'] or 'Analysis failed'}
+        # A new version of an already copied job is a re-grouping, not another finished analysis
+        record = None
+        if synced is None or synced[0] != job['id']:
+            record = 'cache_hit' if job.get('payload', {}).get('cached') else 'job'
+        store_analysis_result(session_id, result, job.get('timings'), record)
+        broker_versions[session_id] = (job['id'], job['updated_at'])
+    elif synced is not None or session_id in analysis_results:
+        discard_analysis_result(session_id)
+    return job
+
+def get_text_encoder():
+    """The AIAnalyzer used to embed search queries, created on first use in broker mode"""
+    global search_analyzer
+    if ai_analyzer is not None:
+        return ai_analyzer
+    with search_analyzer_lock:
+        if search_analyzer is None:
+            search_analyzer = AIAnalyzer()
+        return search_analyzer
+
+def get_result_format_args():
+    """Read the result format and pagination arguments from the query string"""
+    result_format = request.args.get('format', 'full')
+    if result_format not in ('full', 'compact'):
+        raise ValueError('Invalid format, expected "full" or "compact"')
+    offset, limit = parse_page_args(request.args.get('cursor'), request.args.get('limit'))
+    return result_format, offset, limit
+
 @app.errorhandler(RequestEntityTooLarge)
 def handle_file_too_large(e):
     return jsonify({'error': 'File too large. Maximum size is 100MB.'}), 413
@@ -78,7 +295,8 @@ def upload_images():
         session_id = str(uuid.uuid4())
         
         # Save files using file handler
-        saved_paths = file_handler.save_multiple_files(files, session_id)
+        deduplicated_files = []
+        saved_paths = file_handler.save_multiple_files(files, session_id, user_id, deduplicated_files)
         
         if not saved_paths:
             return jsonify({'error': 'No valid images were uploaded'}), 400
@@ -95,12 +313,93 @@ def upload_images():
             'session_id': session_id,
             'uploaded_files': uploaded_files,
             'count': len(uploaded_files),
+            'deduplicated_files': deduplicated_files,
+            'deduplicated_count': len(deduplicated_files),
             'message': f'Successfully uploaded {len(uploaded_files)} images'
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/upload/chunked', methods=['POST'])
+def init_chunked_upload():
+    """Start a resumable upload of one file"""
+    try:
+        data = request.get_json() or {}
+        user_id = data.get('user_id')
+        filename = data.get('filename')
+        
+        if not user_id:
+            return jsonify({'error': 'User ID is required'}), 400
+        
+        if not filename:
+            return jsonify({'error': 'Filename is required'}), 400
+        
+        # Files of one batch share a session: pass the session_id returned for the first file
+        session_id = data.get('session_id') or str(uuid.uuid4())
+        upload = chunked_uploads.init_upload(session_id, user_id, filename, int(data.get('size', 0)),
+                                             int(data['chunk_size']) if data.get('chunk_size') else None,
+                                             data.get('sha256'))
+        return jsonify({'success': True, **upload})
+        
+    except ChunkedUploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/chunked/<session_id>/<upload_id>', methods=['GET'])
+def get_chunked_upload(session_id, upload_id):
+    """Received and missing chunks of an upload, used to resume it"""
+    try:
+        return jsonify({'success': True, **chunked_uploads.status(session_id, upload_id)})
+    except ChunkedUploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/chunked/<session_id>/<upload_id>/<int:index>', methods=['PUT'])
+def put_upload_chunk(session_id, upload_id, index):
+    """Write one chunk (raw request body) of an upload"""
+    try:
+        # The body is read straight from the socket, never buffered as a whole
+        upload = chunked_uploads.write_chunk(session_id, upload_id, index, request.stream,
+                                             request.headers.get('X-Chunk-SHA256'))
+        return jsonify({'success': True, **upload})
+    except ChunkedUploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/chunked/<session_id>/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(session_id, upload_id):
+    """Finish an upload once all of its chunks arrived"""
+    try:
+        stored = chunked_uploads.complete(session_id, upload_id)
+        file_info = file_handler.get_file_info(stored['path'])
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'uploaded_file': file_info,
+            'sha256': stored['sha256'],
+            'deduplicated': stored['deduplicated']
+        })
+    except ChunkedUploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/chunked/<session_id>/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(session_id, upload_id):
+    """Discard a partial upload"""
+    try:
+        if not chunked_uploads.abort(session_id, upload_id):
+            return jsonify({'error': 'Upload not found'}), 404
+        return jsonify({'success': True})
+    except ChunkedUploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_images():
     """Analyze uploaded images using AI"""
@@ -116,87 +415,73 @@ def analyze_images():
             return jsonify({'error': 'User ID is required'}), 400
         
         # Get session files from Supabase Storage
-        session_files = supabase_storage.get_session_files(user_id, session_id)
+        session_files = storage.get_session_files(user_id, session_id)
         if not session_files:
             return jsonify({'error': 'No files found for this session'}), 404
         
         # Filter valid image files
-        valid_files = [f for f in session_files if supabase_storage.is_valid_image_file(f)]
+        valid_files = [f for f in session_files if storage.is_valid_image_file(f)]
         if not valid_files:
             return jsonify({'error': 'No valid images found in session'}), 400
         
         # Get analysis type from request (default to pixel-based for backward compatibility)
         analysis_type = data.get('analysis_type', 'pixel')
         
-
+        # Run this job under the sampling profiler and tracemalloc (see /api/profile/<session_id>)
+        profile = bool(data.get('profile', False))
+        
+        # Unchanged files analyzed with the same settings before are answered from the result cache
+        lookup_start = time.time()
+        cached_result = analysis_runner.cached_result(user_id, valid_files, analysis_type) if not profile else None
+        if cached_result is not None:
+            timings = {'cache_lookup': time.time() - lookup_start}
+            if job_broker is not None:
+                # Through the broker, so every web worker serves the cached result
+                job_broker.record_completed(session_id, user_id, {'analysis_type': analysis_type, 'cached': True},
+                                            cached_result, timings)
+                sync_broker_result(session_id)
+            else:
+                store_analysis_result(session_id, cached_result, timings, record='cache_hit')
+            return jsonify({
+                'success': True,
+                'session_id': session_id,
+                'message': 'Analysis loaded from cache',
+                'total_images': len(valid_files),
+                'status': 'completed',
+                'cached': True
+            })
         
-        # Start analysis in a separate thread to avoid blocking
-        def run_analysis():
-            try:
-                # Download files to temporary locations for analysis
-                temp_file_paths = supabase_storage.download_session_files(user_id, session_id)
-                
-                if not temp_file_paths:
-                    analysis_results[session_id] = {'error': 'Failed to download files for analysis'}
-                    return
-                
-                # Create mappings for file serving
-                temp_to_supabase_mapping = {}
-                temp_to_original_mapping = {}
-                
-                # Create a mapping by index since temp files and valid files should be in the same order
-                for i, temp_path in enumerate(temp_file_paths):
-                    if i < len(valid_files):
-                        supabase_path = valid_files[i]['name']  # Full path like "user_id/session_id_filename.png"
-                        temp_to_supabase_mapping[temp_path] = supabase_path
-                        
-                        # Extract original filename from Supabase path
-                        supabase_filename = os.path.basename(supabase_path)  # "session_id_filename.png"
-                        if supabase_filename.startswith(f"{session_id}_"):
-                            original_filename = supabase_filename[len(f"{session_id}_"):]  # "filename.png"
-                        else:
-                            original_filename = supabase_filename
-                        
-                        temp_to_original_mapping[original_filename] = temp_path
-                
-                # Run analysis on the downloaded files
-                if analysis_type == 'ai':
-                    result = ai_analyzer.analyze_similar_images(temp_file_paths)
-                else:
-                    result = pixel_analyzer.analyze_exact_duplicates(temp_file_paths)
-                
-                # Convert temporary file paths back to Supabase Storage paths for frontend display
-                if result.get('success') and len(result.get('groups')) > 0:
-                    for group in result['groups']:
-                        for image in group.get('images', []):
-                            # Convert temp path back to Supabase Storage path using mapping
-                            temp_path = image['path']
-                            if temp_path in temp_to_supabase_mapping:
-                                old_path = image['path']
-                                image['path'] = temp_to_supabase_mapping[temp_path]
-                            else:
-                                print(f"Warning: No mapping found for temp path {temp_path}")
-                        
-                        # Update best image path
-                        if 'best_image' in group:
-                            temp_path = group['best_image']['path']
-                            if temp_path in temp_to_supabase_mapping:
-                                old_path = group['best_image']['path']
-                                group['best_image']['path'] = temp_to_supabase_mapping[temp_path]
-                            else:
-                                print(f"Warning: No mapping found for best image temp path {temp_path}")
-                
-                analysis_results[session_id] = result
-                
-                supabase_storage.cleanup_temp_files(temp_file_paths)
-                
-            except Exception as e:
-                print(f"Error in analysis thread: {e}")
-                analysis_results[session_id] = {'error': str(e)}
-        
-        # Start analysis thread
-        analysis_thread = threading.Thread(target=run_analysis)
-        analysis_thread.start()
+        # Jobs are scheduled by their users' recent usage, weighed by this estimate
+        cost = estimate_cost(len(valid_files), analysis_type)
+        
+        if ANALYSIS_MODE == 'broker':
+            # Hand the job to a standalone worker process; drop any stale local
+            # result so status polls pick up the new job from the broker
+            job_broker.enqueue(session_id, user_id, {
+                'analysis_type': analysis_type,
+                'valid_files': valid_files,
+                'profile': profile
+            }, image_count=len(valid_files), cost=cost)
+            discard_analysis_result(session_id)
+        else:
+            # Set once the previous result is dropped, so a job that finishes quickly isn't dropped with it
+            submitted = threading.Event()
+            
+            def run_analysis():
+                result, timings = analysis_runner.run(user_id, session_id, analysis_type, valid_files, profile)
+                submitted.wait()
+                store_analysis_result(session_id, result, timings)
+            
+            if analysis_scheduler is not None:
+                analysis_scheduler.submit(user_id, session_id, len(valid_files), cost, run_analysis)
+                # While the job waits in the queue, status polls must not report the previous result
+                discard_analysis_result(session_id)
+                submitted.set()
+            else:
+                submitted.set()
+                # Start analysis in a separate thread to avoid blocking
+                analysis_thread = threading.Thread(target=run_analysis)
+                analysis_thread.start()
         
         return jsonify({
             'success': True,
@@ -206,6 +491,8 @@ def analyze_images():
             'status': 'processing'
         })
         
+    except AdmissionError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -213,7 +500,22 @@ def analyze_images():
 def get_analysis_status(session_id):
     """Get the status of image analysis"""
     try:
-        if session_id not in analysis_results:
+        job = sync_broker_result(session_id)
+        result, tag = read_result(session_id)
+        
+        if result is None:
+            if job is not None:
+                return jsonify({
+                    'status': 'processing',
+                    'message': 'Analysis queued' if job['status'] == 'queued' else 'Analysis in progress'
+                })
+            
+            if analysis_scheduler is not None and analysis_scheduler.is_queued(session_id):
+                return jsonify({
+                    'status': 'processing',
+                    'message': 'Analysis queued'
+                })
+            
             # Check if session exists in Supabase Storage (analysis might be starting)
             # We need user_id to check, but we don't have it in the URL
             # For now, we'll assume the session exists if it's not in results yet
@@ -222,8 +524,6 @@ def get_analysis_status(session_id):
                 'message': 'Analysis starting up...'
             })
         
-        result = analysis_results[session_id]
-        
         if 'error' in result:
             return jsonify({
                 'status': 'error',
@@ -231,10 +531,20 @@ def get_analysis_status(session_id):
             }), 500
         
         if result.get('success'):
-            return jsonify({
-                'status': 'completed',
-                'result': result
-            })
+            try:
+                result_format, offset, limit = get_result_format_args()
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            return cached_json_response(
+                session_id,
+                ('status', result_format, offset, limit),
+                tag,
+                lambda: {
+                    'status': 'completed',
+                    'result': format_result(result, result_format, offset, limit)
+                }
+            )
         else:
             return jsonify({
                 'status': 'processing',
@@ -248,23 +558,149 @@ def get_analysis_status(session_id):
 def get_analysis_results(session_id):
     """Get analysis results for a session"""
     try:
-        if session_id not in analysis_results:
-            return jsonify({'error': 'Results not found'}), 404
+        sync_broker_result(session_id)
+        result, tag = read_result(session_id)
         
-        result = analysis_results[session_id]
+        if result is None:
+            return jsonify({'error': 'Results not found'}), 404
         
         if 'error' in result:
             return jsonify({'error': result['error']}), 500
         
+        try:
+            result_format, offset, limit = get_result_format_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return cached_json_response(
+            session_id,
+            ('results', result_format, offset, limit),
+            tag,
+            lambda: {
+                'success': True,
+                'session_id': session_id,
+                'result': format_result(result, result_format, offset, limit)
+            }
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/regroup/<session_id>', methods=['POST'])
+def regroup_session(session_id):
+    """Re-group a finished analysis at other thresholds from its cached similarity graph"""
+    try:
+        sync_broker_result(session_id)
+        
+        graph = similarity_graphs.get(session_id)
+        if graph is None:
+            return jsonify({'error': 'No similarity graph for this session, run the analysis again'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        try:
+            pixel_threshold = float(data.get('pixel_threshold', graph.thresholds['pixel']))
+            ai_threshold = float(data.get('ai_threshold', graph.thresholds['ai']))
+            result_format, offset, limit = get_result_format_args()
+            groups = graph.regroup(pixel_threshold, ai_threshold)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Replaces the stored result, so status and results polls see the new grouping
+        result = graph.build_result(groups, pixel_threshold, ai_threshold)
+        analysis_results[session_id] = result
+        response_cache.bump_revision(session_id)
+        if session_id in broker_versions:
+            # Other web workers pick the new grouping up from the broker
+            job_id = broker_versions[session_id][0]
+            stored = {**result, 'similarity_graph': graph.to_dict()}
+            if session_id in job_profiles:
+                stored['profile'] = job_profiles[session_id]
+            updated_at = job_broker.update_result(job_id, stored)
+            if updated_at is not None:
+                broker_versions[session_id] = (job_id, updated_at)
+        
         return jsonify({
             'success': True,
             'session_id': session_id,
-            'result': result
+            'result': format_result(result, result_format, offset, limit)
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/search/<session_id>', methods=['GET'])
+def search_session(session_id):
+    """Find photos in an AI-analyzed session matching a text query (``q``)
+    
+    The query is embedded with the CLIP text tower and looked up in the
+    session's stored image embeddings; ``k`` limits the number of results.
+    """
+    try:
+        if session_embeddings is None:
+            return jsonify({'error': 'Session search is disabled'}), 404
+        
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({'error': 'Search query (q) is required'}), 400
+        try:
+            k = min(max(1, int(request.args.get('k', DEFAULT_SEARCH_K))), MAX_SEARCH_K)
+        except ValueError:
+            return jsonify({'error': 'k must be an integer'}), 400
+        
+        search_start = time.time()
+        matches = session_embeddings.search(session_id, get_text_encoder().embed_texts([query]), k)
+        if matches is None:
+            return jsonify({'error': 'No embeddings for this session, run an AI analysis first'}), 404
+        
+        # Point each match at its group in the stored result
+        sync_broker_result(session_id)
+        group_ids = {}
+        for group in analysis_results.get(session_id, {}).get('groups', []):
+            for image in group.get('images', []):
+                group_ids[image['path']] = group.get('id')
+        for match in matches[0]:
+            match['group_id'] = group_ids.get(match['path'])
+        
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'query': query,
+            'results': matches[0],
+            'search_ms': (time.time() - search_start) * 1000
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/profile/<session_id>', methods=['GET'])
+def get_profile(session_id):
+    """Download the profile of an analysis started with "profile": true
+    
+    ``format=folded`` (default) returns the sampled stacks for flamegraph.pl
+    or speedscope; ``format=json`` returns the whole profile, including the
+    top allocation sites.
+    """
+    try:
+        sync_broker_result(session_id)
+        
+        profile = job_profiles.get(session_id)
+        if profile is None:
+            return jsonify({'error': 'No profile found for this session'}), 404
+        
+        profile_format = request.args.get('format', 'folded')
+        if profile_format == 'json':
+            return jsonify(profile)
+        if profile_format != 'folded':
+            return jsonify({'error': "format must be 'folded' or 'json'"}), 400
+        
+        response = make_response(profile['folded'])
+        response.mimetype = 'text/plain'
+        response.headers['Content-Disposition'] = f'attachment; filename=profile_{session_id}.folded'
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/image/<session_id>/<filename>', methods=['GET'])
 def serve_image(session_id, filename):
     """Serve uploaded images from temporary files or Supabase Storage"""
@@ -291,8 +727,15 @@ def serve_image(session_id, filename):
         # Construct the Supabase Storage path
         file_path = f"{user_id}/{session_id}_{filename}"
         
+        # Backends that keep photos on this host serve them from disk
+        local_path = storage.local_path(file_path)
+        if local_path is not None:
+            if not os.path.isfile(local_path):
+                return jsonify({'error': 'Image not found'}), 404
+            return send_file(local_path)
+        
         # Get the public URL from Supabase Storage
-        public_url = supabase_storage.get_file_url(file_path)
+        public_url = storage.get_file_url(file_path)
         if not public_url:
             return jsonify({'error': 'Image not found'}), 404
         
@@ -312,11 +755,19 @@ def cleanup_session(session_id):
             return jsonify({'error': 'User ID is required'}), 400
         
         # Clean up files from Supabase Storage
-        success = supabase_storage.delete_session_files(user_id, session_id)
+        success = storage.delete_session_files(user_id, session_id)
         
-        # Clean up analysis results
-        if session_id in analysis_results:
-            del analysis_results[session_id]
+        # Deleted photos no longer count as part of the user's library
+        if library_store is not None:
+            library_store.get(user_id).remove_session(session_id)
+        
+        # Clean up analysis results (in broker mode, for every web worker)
+        if job_broker is not None:
+            job_broker.delete_session_jobs(session_id)
+        discard_analysis_result(session_id)
+        if session_embeddings is not None:
+            session_embeddings.remove(session_id)
+        response_cache.forget(session_id)
         
         if success:
             return jsonify({
@@ -336,25 +787,11 @@ def cleanup_session(session_id):
 def get_statistics():
     """Get system statistics"""
     try:
-        # Count total sessions
-        total_sessions = len(analysis_results)
-        
-        # Count completed analyses
-        completed_analyses = sum(1 for result in analysis_results.values() 
-                               if result.get('success') and 'error' not in result)
-        
-        # Count total images analyzed
-        total_images = 0
-        for result in analysis_results.values():
-            if result.get('success') and 'error' not in result:
-                total_images += result.get('result', {}).get('statistics', {}).get('total_images', 0)
-        
-        return jsonify({
-            'total_sessions': total_sessions,
-            'completed_analyses': completed_analyses,
-            'total_images_analyzed': total_images,
-            'active_sessions': total_sessions
-        })
+        statistics = statistics_aggregator.snapshot()
+        statistics['workspace'] = workspace_reaper.last_report
+        if analysis_scheduler is not None:
+            statistics['scheduler'] = analysis_scheduler.stats()
+        return jsonify(statistics)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -415,4 +852,5 @@ def download_selected_photos():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # Development server; see gunicorn.conf.py for production
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""Memory and grouping-accuracy impact of compressed embedding storage
+
+For every storage mode (float32, float16, pq) and re-ranking setting, reports
+the bytes stored per embedding and how many of the exact index's similar pairs
+(similarity >= threshold, the decision used for grouping) are still found.
+Run from the backend directory:
+
+    python -m benchmarks.embedding_storage_benchmark --embeddings benchmark_embeddings.npy
+    python -m benchmarks.embedding_storage_benchmark --images /path/to/benchmark/photos
+    python -m benchmarks.embedding_storage_benchmark --synthetic 50000
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embedding_store import create_codec_index, rerank, DEFAULT_STORAGE_PARAMS
+from benchmarks.index_benchmark import load_image_embeddings, synthetic_embeddings
+
+
+def similar_pairs(similarities: np.ndarray, ids: np.ndarray, query_ids: np.ndarray, threshold: float) -> set:
+    pairs = set()
+    for query_id, row_similarities, row_ids in zip(query_ids, similarities, ids):
+        for similarity, neighbor_id in zip(row_similarities, row_ids):
+            if neighbor_id >= 0 and neighbor_id != query_id and similarity >= threshold:
+                pairs.add((min(query_id, neighbor_id), max(query_id, neighbor_id)))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compressed embedding storage report')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--embeddings', help='.npy file of L2-normalized embeddings')
+    source.add_argument('--images', help='Directory of images to embed with CLIP')
+    source.add_argument('--synthetic', type=int, help='Number of synthetic embeddings')
+    parser.add_argument('--queries', type=int, default=2000, help='Number of query vectors')
+    parser.add_argument('--k', type=int, default=10, help='Neighbors considered per query')
+    parser.add_argument('--threshold', type=float, default=0.9, help='Grouping similarity threshold')
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype('float32')
+    elif args.images:
+        vectors = load_image_embeddings(args.images)
+    else:
+        vectors = synthetic_embeddings(args.synthetic)
+
+    rng = np.random.default_rng(1)
+    query_ids = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    queries = vectors[query_ids]
+    exact_lookup = {vector_id: vector for vector_id, vector in enumerate(vectors)}
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, "
+          f"k={args.k}, threshold={args.threshold}\n")
+
+    exact_index = create_codec_index(vectors.shape[1], 'float32')
+    exact_index.add(vectors)
+    exact_similarities, exact_ids = exact_index.search(queries, args.k)
+    exact_pairs = similar_pairs(exact_similarities, exact_ids, query_ids, args.threshold)
+
+    header = f"{'storage':<10}{'rerank':<16}{'bytes/vec':>10}{'total MB':>10}{'saved':>8}{'pair recall':>13}{'pair precision':>16}"
+    print(header)
+    print('-' * len(header))
+
+    for mode in ('float32', 'float16', 'pq'):
+        index = create_codec_index(vectors.shape[1], mode)
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        code_size = index.sa_code_size()
+        total_mb = code_size * len(vectors) / 2**20
+        saved = 1 - code_size / (vectors.shape[1] * 4)
+
+        settings = [('none', 1)] if mode == 'float32' else [
+            ('none', 1), (f"exact x{DEFAULT_STORAGE_PARAMS['rerank_factor']}", DEFAULT_STORAGE_PARAMS['rerank_factor'])
+        ]
+        for label, factor in settings:
+            similarities, ids = index.search(queries, args.k * factor)
+            if factor > 1:
+                similarities, ids = rerank(queries, similarities, ids, args.k, exact_lookup)
+            else:
+                similarities, ids = similarities[:, :args.k], ids[:, :args.k]
+
+            pairs = similar_pairs(similarities, ids, query_ids, args.threshold)
+            recall = len(pairs & exact_pairs) / max(1, len(exact_pairs))
+            precision = len(pairs & exact_pairs) / max(1, len(pairs))
+            print(f"{mode:<10}{label:<16}{code_size:>10}{total_mb:>10.1f}{saved:>8.0%}{recall:>13.3f}{precision:>16.3f}")
+
+
+if __name__ == '__main__':
+    main()
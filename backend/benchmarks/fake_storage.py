@@ -0,0 +1,261 @@
+"""Local stand-in for Supabase Storage
+
+Implements the part of the Storage REST API that SupabaseStorageService uses
+(list, download, upload, remove and public object URLs), keeping objects in a
+local directory, with configurable per-request latency and bandwidth. Run from
+the backend directory:
+
+    python -m benchmarks.fake_storage --port 54321 --latency-ms 20 --bandwidth-mbps 200
+
+then start the app against it with the URL and service key it prints:
+
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_SERVICE_KEY=<key> python app.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import mimetypes
+import threading
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, unquote
+
+# Shaped like a JWT, which the Supabase client checks keys against
+FAKE_SERVICE_KEY = 'fake-storage.service-role.key'
+STORAGE_PREFIX = '/storage/v1'
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+class FakeStorageServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root: str, port: int = 54321, host: str = '127.0.0.1',
+                 latency_ms: float = 0.0, bandwidth_mbps: float = 0.0):
+        """Storage API stand-in serving objects from ``root``
+
+        Every request waits ``latency_ms`` before it is handled, and object
+        bodies are sent and received at ``bandwidth_mbps`` (megabits per second
+        per request, 0 for unlimited).
+        """
+        self.root = os.path.abspath(root)
+        self.latency = latency_ms / 1000.0
+        self.bytes_per_second = bandwidth_mbps * 1000 * 1000 / 8
+        self.requests = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        super().__init__((host, port), FakeStorageHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, operation: str):
+        with self._lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def object_path(self, bucket: str, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid object key {key}")
+        return path
+
+    def throttle(self, num_bytes: int, started: float):
+        """Sleep until ``num_bytes`` would have taken ``started``..now at the configured bandwidth"""
+        if self.bytes_per_second > 0:
+            remaining = num_bytes / self.bytes_per_second - (time.time() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+def _object_info(name: str, path: str) -> dict:
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        etag = hashlib.md5(f.read()).hexdigest()
+    timestamp = datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()
+    return {
+        'name': name,
+        'id': hashlib.sha1(path.encode('utf-8')).hexdigest(),
+        'created_at': timestamp,
+        'updated_at': timestamp,
+        'last_accessed_at': timestamp,
+        'metadata': {
+            'size': stat.st_size,
+            'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            'eTag': f'"{etag}"',
+            'cacheControl': 'max-age=3600',
+            'lastModified': timestamp,
+            'contentLength': stat.st_size,
+            'httpStatusCode': 200
+        }
+    }
+
+
+class FakeStorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _route(self):
+        path = unquote(urlparse(self.path).path)
+        if path.startswith(STORAGE_PREFIX):
+            path = path[len(STORAGE_PREFIX):]
+        return [part for part in path.split('/') if part]
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        started = time.time()
+        body = self.rfile.read(length) if length else b''
+        self.server.throttle(len(body), started)
+        return body
+
+    def _send_json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json({'statusCode': str(status), 'error': message, 'message': message}, status)
+
+    def _before(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        # object/<bucket>/<key>, object/authenticated/<bucket>/<key>, object/public/<bucket>/<key>
+        self._before()
+        parts = self._route()
+        if len(parts) >= 2 and parts[0] == 'object' and parts[1] in ('authenticated', 'public'):
+            parts = [parts[0]] + parts[2:]
+        if len(parts) < 3 or parts[0] != 'object':
+            return self._send_error(404, 'Not found')
+        self.server.count('download')
+        try:
+            path = self.server.object_path(parts[1], '/'.join(parts[2:]))
+        except ValueError as e:
+            return self._send_error(400, str(e))
+        if not os.path.isfile(path):
+            return self._send_error(404, 'Object not found')
+
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        started = time.time()
+        sent = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(SEND_BLOCK_SIZE), b''):
+                self.wfile.write(block)
+                sent += len(block)
+                self.server.throttle(sent, started)
+
+    def do_POST(self):
+        self._before()
+        parts = self._route()
+        body = self._read_body()
+
+        # object/list/<bucket> with {"prefix": ...}
+        if len(parts) == 3 and parts[:2] == ['object', 'list']:
+            self.server.count('list')
+            prefix = (json.loads(body or b'{}').get('prefix') or '').strip('/')
+            try:
+                directory = self.server.object_path(parts[2], prefix) if prefix else os.path.join(self.server.root, parts[2])
+            except ValueError as e:
+                return self._send_error(400, str(e))
+            listing = []
+            if os.path.isdir(directory):
+                for name in sorted(os.listdir(directory)):
+                    path = os.path.join(directory, name)
+                    if os.path.isfile(path):
+                        listing.append(_object_info(name, path))
+                    else:
+                        listing.append({'name': name, 'id': None, 'metadata': None})
+            return self._send_json(listing)
+
+        # object/<bucket>/<key>, raw or multipart body
+        if len(parts) >= 3 and parts[0] == 'object':
+            self.server.count('upload')
+            content_type = self.headers.get('Content-Type', '')
+            if content_type.startswith('multipart/form-data'):
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body
+                )
+                file_parts = [part for part in message.iter_parts() if part.get_filename() or
+                              part.get_param('name', header='content-disposition') == 'file']
+                body = file_parts[0].get_payload(decode=True) if file_parts else b''
+            key = '/'.join(parts[2:])
+            try:
+                path = self.server.object_path(parts[1], key)
+            except ValueError as e:
+                return self._send_error(400, str(e))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(body)
+            return self._send_json({'Key': f"{parts[1]}/{key}", 'Id': hashlib.sha1(path.encode('utf-8')).hexdigest()})
+
+        self._send_error(404, 'Not found')
+
+    def do_PUT(self):
+        self.do_POST()
+
+    def do_DELETE(self):
+        # object/<bucket> with {"prefixes": [...]}
+        self._before()
+        parts = self._route()
+        body = self._read_body()
+        if len(parts) != 2 or parts[0] != 'object':
+            return self._send_error(404, 'Not found')
+        self.server.count('remove')
+        removed = []
+        for key in json.loads(body or b'{}').get('prefixes', []):
+            try:
+                path = self.server.object_path(parts[1], key)
+            except ValueError:
+                continue
+            if os.path.isfile(path):
+                info = _object_info(key, path)
+                os.remove(path)
+                removed.append(info)
+        self._send_json(removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Supabase Storage stand-in for load tests')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--root', default=None, help='Object directory (default: a temporary directory)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Added latency per request')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0,
+                        help='Per-request transfer rate in megabits per second (0 = unlimited)')
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='fake_storage_')
+    server = FakeStorageServer(root, args.port, args.host, args.latency_ms, args.bandwidth_mbps)
+    print(f"Fake storage serving {root} at {server.url}")
+    print(f"  SUPABASE_URL={server.url}")
+    print(f"  SUPABASE_SERVICE_KEY={FAKE_SERVICE_KEY}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Requests: {server.requests}")
+        if args.root is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
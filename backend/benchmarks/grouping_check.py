@@ -0,0 +1,82 @@
+"""Regression check: the analyzers must group an exact copy
+
+Writes a few synthetic photos, one of them an exact copy of another, and runs
+the pixel analysis (in memory and streaming) and, with ``--ai``, the AI
+analysis on them. Every run must put the copy and its original in one group,
+leave the other photos unique and give every readable photo a non-zero
+quality score. Exits with status 1 otherwise. Run from the backend directory:
+
+    python -m benchmarks.grouping_check [--ai]
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.pixel_analyzer import PixelAnalyzer
+
+
+def write_photos(directory: str, count: int = 3, size: int = 480) -> list:
+    """``count`` distinct photos plus an exact copy of the first; returns their paths"""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        low = rng.integers(0, 256, size=(size // 32, size // 32, 3), dtype=np.uint8)
+        image = cv2.resize(low, (size, size), interpolation=cv2.INTER_CUBIC)
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    copy_path = os.path.join(directory, 'photo_0_copy.jpg')
+    shutil.copyfile(paths[0], copy_path)
+    paths.append(copy_path)
+    return paths
+
+
+def check(name: str, result: dict, paths: list) -> bool:
+    """Whether ``result`` has the original and its copy as the only multi-photo group"""
+    groups = [sorted(image['path'] for image in group['images']) for group in result.get('groups', [])]
+    scores = [image['quality']['overall_score'] for group in result.get('groups', []) for image in group['images']]
+    expected = sorted([paths[0], paths[-1]])
+    ok = (
+        result.get('success', False)
+        and [group for group in groups if len(group) > 1] == [expected]
+        and sum(len(group) for group in groups) == len(paths)
+        and all(score > 0 for score in scores)
+    )
+    print(f"{name:<20}{'ok' if ok else 'FAILED'}  groups={[len(group) for group in groups]}")
+    if not ok and 'error' in result:
+        print(f"  error: {result['error']}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the analyzers group an exact copy')
+    parser.add_argument('--ai', action='store_true', help='Also run the AI analysis (loads CLIP)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='pickperfect_check_')
+    try:
+        paths = write_photos(directory)
+        pixel_analyzer = PixelAnalyzer()
+        results = [
+            ('pixel', pixel_analyzer.analyze_exact_duplicates(paths, streaming=False)),
+            ('pixel streaming', pixel_analyzer.analyze_exact_duplicates(paths, streaming=True))
+        ]
+        if args.ai:
+            from services.ai_analyzer import AIAnalyzer
+            ai_analyzer = AIAnalyzer()
+            results.append(('ai', ai_analyzer.analyze_similar_images(paths, streaming=False, cascade=False)))
+            results.append(('ai cascade', ai_analyzer.analyze_similar_images(paths, streaming=False, cascade=True)))
+        passed = [check(name, result, paths) for name, result in results]
+        return 0 if all(passed) else 1
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
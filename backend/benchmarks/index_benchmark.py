@@ -0,0 +1,129 @@
+"""Recall-versus-latency report for the similarity index options
+
+Compares every approximate index configuration against the exact flat index on
+the same embeddings. Run from the backend directory:
+
+    python -m benchmarks.index_benchmark --embeddings benchmark_embeddings.npy
+    python -m benchmarks.index_benchmark --images /path/to/benchmark/photos
+    python -m benchmarks.index_benchmark --synthetic 100000
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vector_index import create_index, train_and_add, DEFAULT_INDEX_PARAMS
+
+# (index type, tuning parameters) pairs swept by the report
+CONFIGURATIONS = (
+    [('hnsw', {'hnsw_ef_search': ef}) for ef in (16, 32, 64, 128, 256)] +
+    [('ivf', {'ivf_nprobe': nprobe}) for nprobe in (1, 4, 16, 64)] +
+    [('ivfpq', {'ivf_nprobe': nprobe}) for nprobe in (4, 16, 64)]
+)
+
+
+def load_image_embeddings(image_dir: str) -> np.ndarray:
+    from services.ai_analyzer import AIAnalyzer
+
+    extensions = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff')
+    image_paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(image_dir) for name in names
+        if name.lower().endswith(extensions)
+    )
+    print(f"Embedding {len(image_paths)} images from {image_dir}...")
+    embeddings = AIAnalyzer().extract_features_streaming(image_paths)
+    try:
+        return np.array(embeddings.view())
+    finally:
+        embeddings.close()
+
+
+def synthetic_embeddings(count: int, dim: int = 512, clusters: int = 1000) -> np.ndarray:
+    """Clustered unit vectors, roughly mimicking bursts of similar photos"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dim)).astype('float32')
+    vectors = centers[rng.integers(0, clusters, count)] + 0.35 * rng.normal(size=(count, dim)).astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        similarities, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        results.append((similarities[0], ids[0]))
+    return results, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Similarity index recall/latency report')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--embeddings', help='.npy file of L2-normalized embeddings')
+    source.add_argument('--images', help='Directory of images to embed with CLIP')
+    source.add_argument('--synthetic', type=int, help='Number of synthetic embeddings')
+    parser.add_argument('--queries', type=int, default=1000, help='Number of query vectors')
+    parser.add_argument('--k', type=int, default=10, help='Neighbors per query for recall@k')
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help='Similarity threshold for the grouping recall column')
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype('float32')
+    elif args.images:
+        vectors = load_image_embeddings(args.images)
+    else:
+        vectors = synthetic_embeddings(args.synthetic)
+
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}\n")
+
+    exact = train_and_add(create_index(vectors.shape[1], len(vectors), 'flat'), vectors)
+    exact_results, exact_latency = measure(exact, queries, args.k)
+    exact_sets = [set(ids[ids >= 0]) for _, ids in exact_results]
+    threshold_sets = [set(ids[(ids >= 0) & (sims >= args.threshold)]) for sims, ids in exact_results]
+
+    header = f"{'index':<8}{'params':<22}{'build s':>9}{'size MB':>9}{'recall@k':>10}{'recall@thr':>11}{'p50 ms':>9}{'p95 ms':>9}{'speedup':>9}"
+    print(header)
+    print('-' * len(header))
+    print(f"{'flat':<8}{'exact':<22}{0:>9.2f}{vectors.nbytes / 2**20:>9.1f}{1:>10.3f}{1:>11.3f}"
+          f"{np.percentile(exact_latency, 50):>9.3f}{np.percentile(exact_latency, 95):>9.3f}{1:>9.1f}")
+
+    built = {}
+    for index_type, params in CONFIGURATIONS:
+        index_params = {**DEFAULT_INDEX_PARAMS, **params}
+        build_seconds = 0.0
+        if index_type not in built:
+            start = time.perf_counter()
+            built[index_type] = train_and_add(create_index(vectors.shape[1], len(vectors), index_type, index_params),
+                                              vectors, index_params)
+            build_seconds = time.perf_counter() - start
+        index = built[index_type]
+
+        # Search-time parameters can be changed on an already built index
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = index_params['hnsw_ef_search']
+        elif isinstance(index, faiss.IndexIVF):
+            index.nprobe = min(index_params['ivf_nprobe'], index.nlist)
+
+        results, latency = measure(index, queries, args.k)
+        recall = np.mean([len(exact_ids & set(ids[ids >= 0])) / max(1, len(exact_ids))
+                          for exact_ids, (_, ids) in zip(exact_sets, results)])
+        threshold_recall = np.mean([len(expected & set(ids[ids >= 0])) / len(expected)
+                                    for expected, (_, ids) in zip(threshold_sets, results) if expected])
+        size_mb = len(faiss.serialize_index(index)) / 2**20
+        param_text = ', '.join(f"{name}={value}" for name, value in params.items())
+        print(f"{index_type:<8}{param_text:<22}{build_seconds:>9.2f}{size_mb:>9.1f}{recall:>10.3f}{threshold_recall:>11.3f}"
+              f"{np.percentile(latency, 50):>9.3f}{np.percentile(latency, 95):>9.3f}"
+              f"{np.percentile(exact_latency, 50) / max(1e-9, np.percentile(latency, 50)):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
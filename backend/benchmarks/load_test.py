@@ -0,0 +1,175 @@
+"""End-to-end API load test
+
+Simulates concurrent users. In each iteration a user uploads a batch of
+generated photos (some of them near-duplicates) through /api/upload. It
+stores the same photos in storage the way the frontend does, then starts an
+analysis and polls its status until it finishes. Finally it fetches images
+through /api/image and downloads a ZIP through /api/download. The test
+reports p50/p95/p99 latency per endpoint and analysis jobs per minute.
+
+Run it against the app started on the fake storage server (see
+benchmarks/fake_storage.py), from the backend directory:
+
+    python -m benchmarks.load_test --api http://127.0.0.1:5000/api --storage http://127.0.0.1:54321 \\
+        --users 20 --iterations 3 --images 12
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_storage import FAKE_SERVICE_KEY, STORAGE_PREFIX
+
+BUCKET = 'pickperfect-photos'
+
+
+def generate_photos(count: int, rng: np.random.Generator, size: int = 640) -> list:
+    """JPEG-encoded synthetic photos; every third one is a slightly brightened copy of the previous one"""
+    photos = []
+    for i in range(count):
+        if i % 3 == 2:
+            image = np.clip(previous.astype(np.int16) + 6, 0, 255).astype(np.uint8)
+        else:
+            low = rng.integers(0, 256, size=(size // 32, size // 32, 3), dtype=np.uint8)
+            image = cv2.resize(low, (size, size), interpolation=cv2.INTER_CUBIC)
+        previous = image
+        photos.append(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+    return photos
+
+
+class LoadTest:
+    def __init__(self, api_url: str, storage_url: str, analysis_type: str = 'pixel', images_per_session: int = 12,
+                 poll_interval: float = 0.5, job_timeout: float = 600.0, image_fetches: int = 4,
+                 storage_key: str = FAKE_SERVICE_KEY):
+        """Load generator; latencies are collected per endpoint"""
+        self.api_url = api_url.rstrip('/')
+        self.storage_url = storage_url.rstrip('/') + STORAGE_PREFIX
+        self.storage_headers = {'Authorization': f"Bearer {storage_key}", 'apikey': storage_key}
+        self.analysis_type = analysis_type
+        self.images_per_session = images_per_session
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.image_fetches = image_fetches
+        self.latencies = {}
+        self.errors = {}
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self._lock = threading.Lock()
+
+    def _record(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def _timed(self, endpoint: str, session: requests.Session, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=self.job_timeout, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException as e:
+            print(f"{endpoint} failed: {e}")
+            response, ok = None, False
+        self._record(endpoint, time.perf_counter() - start, ok)
+        return response
+
+    def run_user(self, user_index: int, iterations: int, seed: int):
+        rng = np.random.default_rng(seed + user_index)
+        user_id = f"loadtest-user-{user_index}-{uuid.uuid4().hex[:8]}"
+        http = requests.Session()
+
+        for _ in range(iterations):
+            photos = generate_photos(self.images_per_session, rng)
+            names = [f"photo_{i}.jpg" for i in range(len(photos))]
+
+            files = [('files', (name, photo, 'image/jpeg')) for name, photo in zip(names, photos)]
+            response = self._timed('upload', http, 'POST', f"{self.api_url}/upload",
+                                   files=files, data={'user_id': user_id})
+            if response is None or response.status_code >= 400:
+                with self._lock:
+                    self.jobs_failed += 1
+                continue
+            upload = response.json()
+            session_id = upload['session_id']
+            local_paths = [file_info['path'] for file_info in upload.get('uploaded_files', [])]
+
+            for name, photo in zip(names, photos):
+                self._timed('storage_upload', http, 'POST',
+                            f"{self.storage_url}/object/{BUCKET}/{user_id}/{session_id}_{name}",
+                            data=photo, headers={**self.storage_headers, 'Content-Type': 'image/jpeg'})
+
+            job_start = time.perf_counter()
+            response = self._timed('analyze', http, 'POST', f"{self.api_url}/analyze", json={
+                'session_id': session_id, 'user_id': user_id, 'analysis_type': self.analysis_type
+            })
+            status = 'error' if response is None or response.status_code >= 400 else response.json().get('status')
+            while status == 'processing' and time.perf_counter() - job_start < self.job_timeout:
+                time.sleep(self.poll_interval)
+                response = self._timed('analysis_status', http, 'GET',
+                                       f"{self.api_url}/analysis-status/{session_id}")
+                status = 'error' if response is None or response.status_code >= 400 else response.json().get('status')
+            self._record('job', time.perf_counter() - job_start, status == 'completed')
+            with self._lock:
+                if status == 'completed':
+                    self.jobs_completed += 1
+                else:
+                    self.jobs_failed += 1
+
+            for name in names[:self.image_fetches]:
+                self._timed('image', http, 'GET', f"{self.api_url}/image/{session_id}/{name}",
+                            params={'user_id': user_id})
+
+            if local_paths:
+                self._timed('download', http, 'POST', f"{self.api_url}/download", json={
+                    'session_id': session_id, 'photo_paths': local_paths[:max(1, len(local_paths) // 2)]
+                })
+
+    def run(self, users: int, iterations: int, seed: int = 0) -> float:
+        """Run all users concurrently; returns the wall time in seconds"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            futures = [executor.submit(self.run_user, user_index, iterations, seed) for user_index in range(users)]
+            for future in futures:
+                future.result()
+        return time.perf_counter() - start
+
+    def report(self, wall_seconds: float):
+        print(f"{'endpoint':<16}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for endpoint, values in sorted(self.latencies.items()):
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            print(f"{endpoint:<16}{len(values):>7}{self.errors.get(endpoint, 0):>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+        print(f"Wall time:    {wall_seconds:.1f} s")
+        print(f"Jobs:         {self.jobs_completed} completed, {self.jobs_failed} failed")
+        print(f"Throughput:   {self.jobs_completed * 60 / wall_seconds:.1f} jobs/min")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PickPerfect API load test')
+    parser.add_argument('--api', default='http://127.0.0.1:5000/api', help='Backend API base URL')
+    parser.add_argument('--storage', default='http://127.0.0.1:54321', help='Storage URL the backend uses')
+    parser.add_argument('--storage-key', default=FAKE_SERVICE_KEY, help='Storage service key')
+    parser.add_argument('--users', type=int, default=10, help='Concurrent simulated users')
+    parser.add_argument('--iterations', type=int, default=3, help='Sessions per user')
+    parser.add_argument('--images', type=int, default=12, help='Photos per session')
+    parser.add_argument('--analysis-type', choices=['pixel', 'ai'], default='pixel')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds between status polls')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    load_test = LoadTest(args.api, args.storage, args.analysis_type, args.images, args.poll_interval,
+                         storage_key=args.storage_key)
+    wall_seconds = load_test.run(args.users, args.iterations, args.seed)
+    load_test.report(wall_seconds)
+    return 1 if load_test.jobs_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
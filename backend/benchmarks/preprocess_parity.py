@@ -0,0 +1,118 @@
+"""Parity and speed check of the fast CLIP preprocessing paths
+
+Preprocesses the same images with CLIPProcessor, with the vectorized OpenCV
+path and through the feature records' ``clip_crop``, embeds all three with
+the local CLIP model and reports preprocessing time, the largest pixel
+difference and the cosine similarity between the reference embedding of
+every image and each fast one. An EXIF-rotated copy of the first image is
+added so every path must agree on orientation. Exits with status 1 if any
+pair falls below the tolerance. Run from the backend directory:
+
+    python -m benchmarks.preprocess_parity --images /path/to/benchmark/photos
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ai_analyzer import AIAnalyzer, EMBED_BATCH_SIZE
+from services.clip_preprocess import preprocess_paths, normalize_crops
+from services.image_features import extract_features
+
+EXIF_ORIENTATION = 0x0112
+
+
+def write_rotated_copy(image_path: str, directory: str) -> str:
+    """A JPEG copy of ``image_path`` tagged with EXIF orientation 6 (rotate 90° clockwise)"""
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    path = os.path.join(directory, 'exif_rotated.jpg')
+    with Image.open(image_path) as image:
+        image.convert('RGB').save(path, quality=95, exif=exif)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fast CLIP preprocessing parity check')
+    parser.add_argument('--images', required=True, help='Directory of images to compare on')
+    parser.add_argument('--limit', type=int, default=200, help='Maximum number of images')
+    parser.add_argument('--tolerance', type=float, default=0.99,
+                        help='Minimum cosine similarity between the reference and a fast embedding of an image')
+    args = parser.parse_args()
+
+    extensions = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff')
+    image_paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(args.images) for name in names
+        if name.lower().endswith(extensions)
+    )[:args.limit]
+    if not image_paths:
+        print(f"No images found in {args.images}")
+        return 1
+
+    directory = tempfile.mkdtemp(prefix='pickperfect_parity_')
+    try:
+        image_paths.append(write_rotated_copy(image_paths[0], directory))
+
+        os.environ.pop('PICKPERFECT_INFERENCE_SOCKET', None)
+        analyzer = AIAnalyzer()
+        processor_seconds = fast_seconds = record_seconds = 0.0
+        max_pixel_difference = max_record_difference = 0.0
+        similarities = []
+        record_similarities = []
+
+        for start in range(0, len(image_paths), EMBED_BATCH_SIZE):
+            batch_paths = image_paths[start:start + EMBED_BATCH_SIZE]
+
+            stage_start = time.perf_counter()
+            images = [Image.open(image_path).convert('RGB') for image_path in batch_paths]
+            reference = analyzer.processor(images=images, return_tensors="pt")['pixel_values'].numpy()
+            processor_seconds += time.perf_counter() - stage_start
+
+            stage_start = time.perf_counter()
+            fast = preprocess_paths(batch_paths)
+            fast_seconds += time.perf_counter() - stage_start
+
+            stage_start = time.perf_counter()
+            records = extract_features(batch_paths, include_clip=True)
+            from_records = normalize_crops(np.stack([record['clip_crop'] for record in records]))
+            record_seconds += time.perf_counter() - stage_start
+
+            max_pixel_difference = max(max_pixel_difference, float(np.abs(reference - fast).max()))
+            max_record_difference = max(max_record_difference, float(np.abs(reference - from_records).max()))
+            reference_embeddings = analyzer.forward_images(np.ascontiguousarray(reference, dtype=np.float32))
+            fast_embeddings = analyzer.forward_images(fast)
+            record_embeddings = analyzer.forward_images(from_records)
+            similarities.extend(np.sum(reference_embeddings * fast_embeddings, axis=1).tolist())
+            record_similarities.extend(np.sum(reference_embeddings * record_embeddings, axis=1).tolist())
+
+        similarities = np.array(similarities)
+        record_similarities = np.array(record_similarities)
+        print(f"{len(image_paths)} images (including one EXIF-rotated copy)")
+        print(f"CLIPProcessor:     {processor_seconds * 1000 / len(image_paths):8.2f} ms/image")
+        print(f"Fast path:         {fast_seconds * 1000 / len(image_paths):8.2f} ms/image")
+        print(f"Feature records:   {record_seconds * 1000 / len(image_paths):8.2f} ms/image (all features)")
+        print(f"Max pixel diff:    fast {max_pixel_difference:8.4f}  records {max_record_difference:8.4f}")
+        print(f"Embedding cosine:  fast min {similarities.min():.5f}  mean {similarities.mean():.5f}")
+        print(f"                   records min {record_similarities.min():.5f}  mean {record_similarities.mean():.5f}")
+
+        failures = [
+            (name, path)
+            for name, values in (('fast', similarities), ('records', record_similarities))
+            for path, similarity in zip(image_paths, values) if similarity < args.tolerance
+        ]
+        for name, path in failures:
+            print(f"Below tolerance ({name}): {path}")
+        return 1 if failures else 0
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Production server configuration
+
+Run from the backend directory:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app and its services (the CLIP model included, in thread mode) are loaded
+once in the master process and the workers are forked from it, so the model
+weights are shared copy-on-write instead of loaded by every worker. Each
+worker sizes torch's intra-op thread pool so the workers together use the
+host's CPUs once (PICKPERFECT_TORCH_THREADS overrides it).
+
+kill -HUP <master pid> replaces the workers gracefully: an old worker stops
+accepting requests, finishes the analyses it has queued and running (for up
+to PICKPERFECT_DRAIN_TIMEOUT_SECONDS, heartbeating meanwhile so the master
+does not abort it after `timeout`) and then exits. The new workers are
+forked from the same preloaded master, so code changes need USR2 (start a new
+master) followed by TERM to the old one, which drains its workers the same way.
+
+Thread mode keeps results, similarity graphs and profiles in process memory,
+so it always runs one worker process (PICKPERFECT_WEB_WORKERS is ignored) with
+request threads. The analyses a replaced worker finishes while draining are
+handed to its replacement through the result cache directory, so status polls
+see them complete. Broker mode
+(PICKPERFECT_ANALYSIS_MODE=broker) keeps results, graphs and profiles in the
+broker, which every web worker reads them from, so it can run several web
+workers (each reports its own /api/statistics), with the analyses in
+`python -m services.worker --processes N`, which preloads and shares the model
+the same way.
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gunicorn.workers.gthread import ThreadWorker
+
+from services import prefork
+
+# Tells app.py to leave its background threads to post_fork
+os.environ['PICKPERFECT_PRELOAD'] = '1'
+prefork.before_preload()
+
+analysis_mode = os.getenv('PICKPERFECT_ANALYSIS_MODE', 'thread')
+drain_timeout = float(os.getenv('PICKPERFECT_DRAIN_TIMEOUT_SECONDS', 600))
+
+bind = os.getenv('PICKPERFECT_BIND', '0.0.0.0:5000')
+if analysis_mode == 'broker':
+    workers = int(os.getenv('PICKPERFECT_WEB_WORKERS', min(4, prefork.available_cpus())))
+else:
+    # Another worker would not see this one's results
+    if int(os.getenv('PICKPERFECT_WEB_WORKERS', 1)) != 1:
+        print("PICKPERFECT_WEB_WORKERS is ignored in thread mode, which runs one web worker")
+    workers = 1
+
+
+# gthread worker that drains the app's analyses after it stops serving requests.
+# The master aborts workers whose heartbeat is older than `timeout`, and the
+# heartbeat file is closed before worker_exit runs, so the drain happens here
+# and keeps notifying while it waits.
+class DrainingThreadWorker(ThreadWorker):
+    def run(self):
+        super().run()
+        import app
+        drained = []
+        drain = threading.Thread(target=lambda: drained.append(app.drain_analyses(drain_timeout)), daemon=True)
+        drain.start()
+        while drain.is_alive():
+            self.notify()
+            drain.join(1.0)
+        if drained != [True]:
+            self.log.warning("Worker %s exited with analyses still running", self.pid)
+
+
+worker_class = DrainingThreadWorker
+threads = int(os.getenv('PICKPERFECT_WEB_THREADS', 8))
+preload_app = True
+timeout = 120
+# Old workers get this long to finish requests and drain their analyses before they are killed
+graceful_timeout = drain_timeout + 30
+
+
+def pre_fork(server, worker):
+    prefork.before_fork()
+
+
+def post_fork(server, worker):
+    import app
+    prefork.after_fork(workers)
+    app.start_background_services()
+
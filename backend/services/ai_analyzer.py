@@ -2,17 +2,36 @@ import os
 import cv2
 import numpy as np
 from PIL import Image
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Optional
 import json
 from datetime import datetime
 import faiss  
 from transformers import CLIPProcessor, CLIPModel 
 import torch
+import time
 from .pixel_analyzer import PixelAnalyzer  
+from .streaming import SpillArray, get_streaming_threshold, get_memory_budget_mb, rows_for_budget
+from .similarity_cascade import SimilarityCascade, get_cascade_config
+from .inference_client import InferenceClient
+from .micro_batcher import MicroBatcher, get_batching_config
+from .clip_preprocess import preprocess_paths, normalize_crops, load_rgb, CLIP_MODEL_NAME, CLIP_IMAGE_SIZE
+from .image_features import compute_quality, extract_features, feature_quality, load_image
+from .raw_preview import is_preview_format
+from .similarity_graph import SimilarityGraph
+
+# Images preprocessed and embedded per model call
+EMBED_BATCH_SIZE = 16
 
 class AIAnalyzer:
-    def __init__(self):
-        """Initialize the AI-based image analyzer"""
+    def __init__(self, inference_socket: Optional[str] = None):
+        """Initialize the AI-based image analyzer
+        
+        With an ``inference_socket`` (default PICKPERFECT_INFERENCE_SOCKET), the
+        CLIP model is not loaded here: images are embedded by the shared
+        inference server (services.inference_server) listening on that socket.
+        Otherwise concurrent analyses share forward passes through a
+        MicroBatcher (PICKPERFECT_BATCH_MAX_SIZE / PICKPERFECT_BATCH_MAX_WAIT_MS).
+        """
         # Image quality assessment parameters (same as pixel analyzer for consistency)
         self.quality_weights = {
             'resolution': 0.3,
@@ -22,91 +41,172 @@ class AIAnalyzer:
             'noise': 0.1
         }
         
-        self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch16")
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch16", use_fast=True)
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model.to(self.device)
+        self.processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME, use_fast=True)
+        # Vectorized OpenCV preprocessing instead of per-image CLIPProcessor calls
+        self.fast_preprocessing = os.getenv('PICKPERFECT_FAST_PREPROCESSING', '1') != '0'
+        inference_socket = inference_socket or os.getenv('PICKPERFECT_INFERENCE_SOCKET')
+        if inference_socket:
+            self.inference_client = InferenceClient(inference_socket)
+            self.model = None
+            self.device = torch.device("cpu")
+        else:
+            self.inference_client = None
+            self.model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            self.model.to(self.device)
+        
+        batching = get_batching_config()
+        self.batcher = None
+        if self.model is not None and batching['max_batch_size'] > 1:
+            self.batcher = MicroBatcher(self.forward_images, batching['max_batch_size'], batching['max_wait_ms'])
     
     def assess_image_quality(self, image_path: str) -> Dict[str, float]:
         """Assess image quality using multiple metrics (same as pixel analyzer)"""
         try:
-            # Load image
-            image = cv2.imread(image_path)
+            # Load image (the embedded preview for HEIC/RAW)
+            image, original_size = load_image(image_path)
             if image is None:
                 return {'overall_score': 0.0}
             
-            # Convert to grayscale for some calculations
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # 1. Resolution score (normalized by typical photo resolution)
-            height, width = image.shape[:2]
-            resolution_score = min(1.0, (height * width) / (1920 * 1080))
-            
-            # 2. Sharpness score (using Laplacian variance)
-            sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
-            sharpness_score = min(1.0, sharpness / 500)  # Normalize
-            
-            # 3. Brightness score
-            mean_brightness = np.mean(gray)
-            brightness_score = 1.0 - abs(mean_brightness - 127) / 127
-            
-            # 4. Contrast score
-            contrast = np.std(gray)
-            contrast_score = min(1.0, contrast / 50)
-            
-            # 5. Noise assessment (using variance of differences)
-            kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
-            noise = cv2.filter2D(gray, -1, kernel)
-            noise_score = max(0.0, 1.0 - np.var(noise) / 1000)
-            
-            # Calculate weighted overall score
-            overall_score = (
-                self.quality_weights['resolution'] * resolution_score +
-                self.quality_weights['sharpness'] * sharpness_score +
-                self.quality_weights['brightness'] * brightness_score +
-                self.quality_weights['contrast'] * contrast_score +
-                self.quality_weights['noise'] * noise_score
-            )
-            
-            return {
-                'overall_score': overall_score,
-                'resolution_score': resolution_score,
-                'sharpness_score': sharpness_score,
-                'brightness_score': brightness_score,
-                'contrast_score': contrast_score,
-                'noise_score': noise_score,
-                'width': width,
-                'height': height
-            }
+            return compute_quality(image, self.quality_weights, original_size=original_size)
             
         except Exception as e:
             print(f"Error assessing quality for {image_path}: {e}")
             return {'overall_score': 0.0}
     
-    def extract_features_and_store(self, image_paths: List[str]) -> Tuple[faiss.Index, np.ndarray]:
-        """Extract features from images using CLIP model and store in FAISS index"""
+    def forward_images(self, pixel_values: np.ndarray) -> np.ndarray:
+        """Run the local CLIP model on a batch of preprocessed images"""
+        with torch.no_grad():
+            embeddings = self.model.get_image_features(pixel_values=torch.from_numpy(pixel_values).to(self.device))
+            embeddings = embeddings / embeddings.norm(p=2, dim=-1, keepdim=True)
+        return embeddings.cpu().numpy().astype('float32')
+    
+    def image_features(self, pixel_values: torch.Tensor) -> np.ndarray:
+        """Normalized CLIP embeddings of preprocessed images, locally or on the inference server"""
+        if self.inference_client is not None:
+            return self.inference_client.embed_pixel_values(pixel_values.numpy())
+        if self.batcher is not None:
+            return self.batcher.run(pixel_values.numpy())
+        return self.forward_images(pixel_values.numpy())
+    
+    def preprocess_images(self, image_paths: List[str]) -> torch.Tensor:
+        """CLIP pixel values for a batch of images"""
+        if self.fast_preprocessing:
+            return torch.from_numpy(preprocess_paths(image_paths))
+        
+        images = [Image.fromarray(load_rgb(image_path)) if is_preview_format(image_path)
+                  else Image.open(image_path).convert('RGB') for image_path in image_paths]
+        return self.processor(images=images, return_tensors="pt")['pixel_values']
+    
+    def embed_images(self, image_paths: List[str]) -> np.ndarray:
+        """Normalized CLIP embeddings of images, one row per image"""
+        embeddings = []
+        for start in range(0, len(image_paths), EMBED_BATCH_SIZE):
+            pixel_values = self.preprocess_images(image_paths[start:start + EMBED_BATCH_SIZE])
+            embeddings.append(self.image_features(pixel_values))
+        return np.vstack(embeddings).astype('float32')
+    
+    def embed_features(self, records: List[Optional[Dict]], image_paths: Optional[List[str]] = None) -> np.ndarray:
+        """Normalized CLIP embeddings from the CLIP crops of feature records
+        
+        Records that are None (feature extraction failed) are decoded again
+        from the matching entry of ``image_paths``.
+        """
+        embeddings = []
+        for start in range(0, len(records), EMBED_BATCH_SIZE):
+            batch = records[start:start + EMBED_BATCH_SIZE]
+            present = [offset for offset, record in enumerate(batch) if record is not None]
+            missing = [offset for offset, record in enumerate(batch) if record is None]
+            if missing and image_paths is None:
+                raise ValueError('Feature records without a CLIP crop need their image paths')
+            
+            pixel_values = np.empty((len(batch), 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE), dtype=np.float32)
+            if present:
+                pixel_values[present] = normalize_crops(np.stack([batch[offset]['clip_crop'] for offset in present]))
+            if missing:
+                pixel_values[missing] = self.preprocess_images(
+                    [image_paths[start + offset] for offset in missing]).numpy()
+            embeddings.append(self.image_features(torch.from_numpy(pixel_values)))
+        return np.vstack(embeddings).astype('float32')
+    
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Normalized CLIP text embeddings, comparable with the image embeddings"""
+        if self.inference_client is not None:
+            return self.inference_client.embed_texts(texts)
+        
+        inputs = self.processor.tokenizer(texts, padding=True, truncation=True, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            embeddings = self.model.get_text_features(**inputs)
+            embeddings = embeddings / embeddings.norm(p=2, dim=-1, keepdim=True)
+        return embeddings.cpu().numpy().astype('float32')
+    
+    def extract_features_and_store(self, image_paths: List[str]) -> Optional[np.ndarray]:
+        """Extract features from images using CLIP model, one normalized embedding per row
+        
+        Grouping compares the embeddings pairwise, so no index is built here;
+        session search builds the configured index (see vector_index) itself.
+        """
 
         try:
-            embeddings = []
-            for image_path in image_paths:
-                image = Image.open(image_path).convert('RGB')
-                inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-                with torch.no_grad():
-                    embedding = self.model.get_image_features(**inputs)
-                    embedding = embedding / embedding.norm(p=2, dim=-1, keepdim=True)  
-                    embeddings.append(embedding.cpu().numpy().flatten())
-            
-            embeddings_stored = np.vstack(embeddings)
-            index = faiss.IndexFlatIP(embeddings_stored.shape[1])  
-            index.add(embeddings_stored.astype('float32'))
-            return index, embeddings_stored
+            return self.embed_images(image_paths)
 
         except Exception as e:
             print(f"Error extracting features from {image_paths}: {e}")
-            return None, None
+            return None
+    
+    def extract_features_streaming(self, image_paths: List[str], memory_budget_mb: Optional[int] = None) -> Optional[SpillArray]:
+        """Extract CLIP features chunk by chunk into a memory-mapped array
+        
+        Images are embedded in chunks sized from the memory budget; each chunk is
+        spilled to disk before the next one is loaded, so only one chunk of
+        embeddings is in memory at a time. The caller owns the returned
+        SpillArray and must close() it.
+        """
+        memory_budget_mb = memory_budget_mb or get_memory_budget_mb()
+        # A preprocessed 224x224 RGB float tensor is ~600KB; keep a few chunks' worth in flight
+        chunk_size = rows_for_budget(3 * 224 * 224 * 4 * 4, memory_budget_mb, max_rows=64)
+        
+        embeddings = None
+        try:
+            for start in range(0, len(image_paths), chunk_size):
+                chunk_paths = image_paths[start:start + chunk_size]
+                chunk_embeddings = self.image_features(self.preprocess_images(chunk_paths))
+                
+                if embeddings is None:
+                    embeddings = SpillArray(chunk_embeddings.shape[1], np.float32,
+                                            initial_capacity=len(image_paths))
+                embeddings.append(chunk_embeddings)
+            
+            if embeddings is not None:
+                embeddings.flush()
+            return embeddings
+        
+        except Exception as e:
+            print(f"Error extracting features in streaming mode: {e}")
+            if embeddings is not None:
+                embeddings.close()
+            return None
     
-    def merge_similar_groups_ai(self, groups: List[List[int]], image_paths: List[str], similarity_threshold: float = 0.9) -> List[List[int]]:
-        """Merge similar groups using AI by comparing best images from each group"""
+    def merge_similar_groups_ai(self, groups: List[List[int]], image_paths: List[str], similarity_threshold: float = 0.9,
+                                streaming: bool = False, embeddings_out: Optional[Dict[int, np.ndarray]] = None,
+                                blocker=None, features: Optional[List[Optional[Dict]]] = None,
+                                graph: Optional[SimilarityGraph] = None,
+                                qualities: Optional[List[Optional[Dict]]] = None) -> List[List[int]]:
+        """Merge similar groups using AI by comparing best images from each group
+        
+        If ``embeddings_out`` is given, it is filled with the embedding of each
+        compared best image, keyed by image index. With a BurstBlocker, groups
+        are only merged when their best images are burst candidates. With
+        ``features``, quality and CLIP inputs come from the feature records
+        instead of decoding the images again; in streaming mode, ``qualities``
+        holds the scores assessed during pixel grouping. The best images'
+        similarities are recorded in ``graph`` if given.
+        """
+        
+        if streaming:
+            return self.merge_similar_groups_ai_streaming(groups, image_paths, similarity_threshold,
+                                                          embeddings_out=embeddings_out, blocker=blocker,
+                                                          qualities=qualities)
         
         try:
             print("Merging similar groups using AI analysis...")
@@ -122,7 +222,10 @@ class AIAnalyzer:
                 
                 for img_idx in group:
                     image_path = image_paths[img_idx]
-                    quality = self.assess_image_quality(image_path)
+                    if features is not None:
+                        quality = feature_quality(features[img_idx])
+                    else:
+                        quality = self.assess_image_quality(image_path)
                     if quality['overall_score'] > best_score:
                         best_score = quality['overall_score']
                         best_image_idx = img_idx
@@ -134,37 +237,50 @@ class AIAnalyzer:
                     'quality_score': best_score
                 })
             
+            if features is not None:
+                # Images whose features could not be extracted are unreadable; their groups stay as they are
+                best_images = [img for img in best_images if features[img['image_idx']] is not None]
+                if len(best_images) < 2:
+                    return groups
+            
             print(f"Found {len(best_images)} best images to compare")
             
             # Extract features for best images only
             best_image_paths = [img['image_path'] for img in best_images]
-            index, embeddings = self.extract_features_and_store(best_image_paths)
+            if features is not None:
+                embeddings = self.embed_features([features[img['image_idx']] for img in best_images])
+            else:
+                embeddings = self.extract_features_and_store(best_image_paths)
             
-            if index is None or embeddings is None:
+            if embeddings is None:
                 print("Failed to extract features for best images")
                 return groups
             
+            if embeddings_out is not None:
+                for position, best_image in enumerate(best_images):
+                    embeddings_out[best_image['image_idx']] = embeddings[position]
+            if graph is not None:
+                graph.add_ai_scores([best_image['image_idx'] for best_image in best_images], embeddings)
+            
             # Compare best images and merge groups if similar
             merged_groups = groups.copy()
             processed_groups = set()
             
             for i in range(len(best_images)):
-                if i in processed_groups:
-                    continue
-                
                 current_group_idx = best_images[i]['group_idx']
                 if current_group_idx in processed_groups:
                     continue
                 
                 # Find similar groups
                 for j in range(i + 1, len(best_images)):
-                    if j in processed_groups:
-                        continue
-                    
                     target_group_idx = best_images[j]['group_idx']
                     if target_group_idx in processed_groups:
                         continue
                     
+                    if blocker is not None and not blocker.is_candidate(best_images[i]['image_idx'],
+                                                                        best_images[j]['image_idx']):
+                        continue
+                    
                     # Calculate similarity between best images
                     similarity = self.calculate_similarity_between_embeddings(
                         embeddings[i], embeddings[j]
@@ -195,6 +311,156 @@ class AIAnalyzer:
             print(f"Error merging similar groups with AI: {e}")
             return groups
     
+    def merge_similar_groups_ai_streaming(self, groups: List[List[int]], image_paths: List[str],
+                                          similarity_threshold: float = 0.9,
+                                          memory_budget_mb: Optional[int] = None,
+                                          embeddings_out: Optional[Dict[int, np.ndarray]] = None,
+                                          blocker=None,
+                                          qualities: Optional[List[Optional[Dict]]] = None) -> List[List[int]]:
+        """Merge similar groups in bounded memory
+        
+        Embeddings of the best image of each group are spilled to disk, then
+        compared block by block against the memory-mapped embeddings, so memory
+        does not grow with the number of groups. Best images are chosen from
+        ``qualities`` (scores assessed during pixel grouping) where available.
+        Produces the same groups as an exact comparison of every pair.
+        """
+        embeddings = None
+        try:
+            print("Merging similar groups using streaming AI analysis...")
+            
+            if len(groups) < 2:
+                return groups
+            
+            def quality_score(img_idx: int) -> float:
+                if qualities is not None and qualities[img_idx] is not None:
+                    return qualities[img_idx]['overall_score']
+                return self.assess_image_quality(image_paths[img_idx])['overall_score']
+            
+            best_image_indices = [max(group, key=quality_score) for group in groups]
+            best_image_paths = [image_paths[img_idx] for img_idx in best_image_indices]
+            
+            embeddings = self.extract_features_streaming(best_image_paths, memory_budget_mb)
+            if embeddings is None:
+                print("Failed to extract features for best images")
+                return groups
+            
+            if embeddings_out is not None:
+                for position, img_idx in enumerate(best_image_indices):
+                    embeddings_out[img_idx] = np.array(embeddings[position])
+            
+            memory_budget_mb = memory_budget_mb or get_memory_budget_mb()
+            # Query and key blocks plus their similarity matrix stay within the budget
+            block_rows = rows_for_budget(embeddings.dim * 4, memory_budget_mb, max_rows=4096)
+            stored = embeddings.view()
+            num_groups = len(groups)
+            
+            merged_groups = [list(group) for group in groups]
+            processed_groups = set()
+            
+            for start in range(0, num_groups, block_rows):
+                end = min(num_groups, start + block_rows)
+                queries = np.asarray(stored[start:end])
+                matches = [[] for _ in range(end - start)]
+                # Only later groups can be merged into a group, so keys start at the query block
+                for key_start in range(start, num_groups, block_rows):
+                    key_end = min(num_groups, key_start + block_rows)
+                    similarities = queries @ np.asarray(stored[key_start:key_end]).T
+                    rows, columns = np.nonzero(similarities >= similarity_threshold)
+                    for row, column in zip(rows, columns):
+                        if key_start + column > start + row:
+                            matches[row].append(key_start + int(column))
+                
+                for offset, i in enumerate(range(start, end)):
+                    if i in processed_groups:
+                        continue
+                    for j in matches[offset]:
+                        if j in processed_groups:
+                            continue
+                        if blocker is not None and not blocker.is_candidate(best_image_indices[i],
+                                                                            best_image_indices[j]):
+                            continue
+                        merged_groups[i].extend(merged_groups[j])
+                        merged_groups[j] = []
+                        processed_groups.add(j)
+            
+            final_groups = [group for group in merged_groups if group]
+            print(f"Streaming AI merging reduced {len(groups)} groups to {len(final_groups)} groups")
+            return final_groups
+            
+        except Exception as e:
+            print(f"Error merging similar groups with streaming AI: {e}")
+            return groups
+        finally:
+            if embeddings is not None:
+                embeddings.close()
+    
+    def flag_library_duplicates(self, image_paths: List[str], analyzed_groups: List[Dict], library_index,
+                                library_keys: List[str], embeddings: Optional[Dict[int, np.ndarray]] = None,
+                                similarity_threshold: float = 0.9, max_hash_distance: int = 3,
+                                features: Optional[List[Optional[Dict]]] = None) -> int:
+        """Flag photos that duplicate photos already in the user's library, then add this session to it
+        
+        Every image is looked up by perceptual hash and each group's best image by
+        CLIP embedding. Matches are stored under 'library_matches' on the image
+        (hash matches) and on the group (CLIP matches). Returns the number of
+        flagged images. Hashes and missing embeddings come from ``features``
+        when given.
+        """
+        try:
+            embeddings = dict(embeddings or {})
+            path_to_idx = {image_path: img_idx for img_idx, image_path in enumerate(image_paths)}
+            session_keys = set(library_keys)
+            
+            if features is not None:
+                phashes = [record['phash'] if record is not None else None for record in features]
+            else:
+                pixel_analyzer = PixelAnalyzer()
+                phashes = [pixel_analyzer.compute_perceptual_hash(image_path) for image_path in image_paths]
+            phash_matches = library_index.query_phashes(phashes, max_hash_distance, exclude_keys=session_keys)
+            
+            best_indices = [path_to_idx[group['best_image']['path']] for group in analyzed_groups]
+            missing = [img_idx for img_idx in best_indices if img_idx not in embeddings]
+            if missing and features is not None and all(features[img_idx] is not None for img_idx in missing):
+                for img_idx, embedding in zip(missing, self.embed_features([features[img_idx] for img_idx in missing])):
+                    embeddings[img_idx] = embedding
+                missing = []
+            if missing:
+                missing_embeddings = self.extract_features_and_store([image_paths[img_idx] for img_idx in missing])
+                if missing_embeddings is not None:
+                    for img_idx, embedding in zip(missing, missing_embeddings):
+                        embeddings[img_idx] = embedding
+            
+            embedded_best = [img_idx for img_idx in best_indices if img_idx in embeddings]
+            clip_matches = {}
+            if embedded_best:
+                matches = library_index.query_embeddings(
+                    np.vstack([embeddings[img_idx] for img_idx in embedded_best]),
+                    similarity_threshold, exclude_keys=session_keys
+                )
+                clip_matches = dict(zip(embedded_best, matches))
+            
+            flagged_count = 0
+            for group, best_idx in zip(analyzed_groups, best_indices):
+                group_matches = clip_matches.get(best_idx, [])
+                if group_matches:
+                    group['library_matches'] = group_matches
+                
+                for image in group['images']:
+                    image_matches = phash_matches[path_to_idx[image['path']]]
+                    if image_matches:
+                        image['library_matches'] = image_matches
+                    if image_matches or group_matches:
+                        flagged_count += 1
+            
+            library_index.add(library_keys, phashes, {img_idx: embeddings[img_idx] for img_idx in embedded_best})
+            print(f"Flagged {flagged_count} images as duplicates of photos in the user's library")
+            return flagged_count
+            
+        except Exception as e:
+            print(f"Error checking library for duplicates: {e}")
+            return 0
+    
     def calculate_similarity_between_embeddings(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """Calculate cosine similarity between two embeddings"""
         try:
@@ -270,8 +536,26 @@ class AIAnalyzer:
     #         print(f"Error grouping similar images: {e}")
     #         return []
     
-    def analyze_similar_images(self, image_paths: List[str]) -> Dict:
-        """Complete similar image analysis pipeline using hybrid approach (duplicates + AI)"""
+    def analyze_similar_images(self, image_paths: List[str], streaming: Optional[bool] = None,
+                               library_index=None, library_keys: Optional[List[str]] = None,
+                               burst_blocking: Optional[bool] = None, cascade: Optional[bool] = None,
+                               embeddings_out: Optional[Dict[int, np.ndarray]] = None,
+                               embed_all: bool = False) -> Dict:
+        """Complete similar image analysis pipeline using hybrid approach (duplicates + AI)
+        
+        Large sessions (above PICKPERFECT_STREAMING_THRESHOLD images, or when
+        streaming is True) run both stages in bounded memory. When a user's
+        library_index is given, photos are also checked against every photo the
+        user analyzed before; ``library_keys`` are the stable storage paths of
+        ``image_paths`` under which this session is added to the library.
+        With burst_blocking (default PICKPERFECT_BURST_BLOCKING), only photos
+        taken close together are compared. With cascade (default
+        PICKPERFECT_CASCADE), in-memory sessions are grouped by a
+        SimilarityCascade that only runs CLIP on pairs the cheap stages could
+        not decide. If ``embeddings_out`` is given, it is filled with the CLIP
+        embeddings computed along the way, keyed by image index (for session
+        search); with ``embed_all``, the remaining images are embedded too.
+        """
         try:
             print(f"Starting hybrid similar image analysis of {len(image_paths)} images...")
             
@@ -284,14 +568,71 @@ class AIAnalyzer:
             
             # Step 1: Find exact duplicates using pixel analyzer
             print("Step 1: Finding exact duplicates...")
-            pixel_analyzer = PixelAnalyzer()
-            duplicate_groups = pixel_analyzer.group_exact_duplicates(image_paths)
-            print(f"Found {len(duplicate_groups)} duplicate groups")
+            if streaming is None:
+                streaming = len(image_paths) > get_streaming_threshold()
             
-            # Step 2: Merge similar groups using AI
-            print("Step 2: Merging similar groups with AI...")
-            groups = self.merge_similar_groups_ai(duplicate_groups, image_paths)
-            print(f"Final result: {len(groups)} groups after AI merging")
+            stage_start = time.time()
+            pixel_analyzer = PixelAnalyzer()
+            blocker = pixel_analyzer.build_burst_blocker(image_paths, burst_blocking)
+            timings = {'burst_blocking': time.time() - stage_start} if blocker is not None else {}
+            
+            cascade_config = get_cascade_config()
+            if cascade is None:
+                cascade = cascade_config['enabled']
+            
+            # In-memory sessions decode every image once; streaming sessions keep their bounded-memory passes
+            features = None
+            if not streaming:
+                stage_start = time.time()
+                features = extract_features(image_paths, self.quality_weights, include_clip=True)
+                timings['feature_extraction'] = time.time() - stage_start
+            # Scores of the two-step grouping are kept so the session can be re-grouped at other thresholds
+            graph = SimilarityGraph(len(image_paths), 'ai') if features is not None and not cascade else None
+            
+            # Streaming sessions assess quality in the pixel fingerprint pass
+            qualities = [None] * len(image_paths) if streaming else None
+            
+            def quality_of(img_idx: int) -> Dict[str, float]:
+                if features is not None:
+                    return feature_quality(features[img_idx])
+                if qualities is not None and qualities[img_idx] is not None:
+                    return qualities[img_idx]
+                return self.assess_image_quality(image_paths[img_idx])
+            
+            best_embeddings = {}
+            cascade_counts = None
+            if cascade and not streaming:
+                # Steps 1 and 2 as one cascade: cheap stages first, CLIP only for ambiguous pairs
+                path_index = {image_path: img_idx for img_idx, image_path in enumerate(image_paths)}
+                similarity_cascade = SimilarityCascade(cascade_config['params'])
+                groups = similarity_cascade.run(
+                    image_paths,
+                    lambda image_path: quality_of(path_index[image_path]),
+                    lambda paths: self.embed_features([features[path_index[image_path]] for image_path in paths], paths),
+                    blocker=blocker, embeddings_out=best_embeddings, timings=timings, features=features
+                )
+                cascade_counts = similarity_cascade.counts
+                print(f"Final result: {len(groups)} groups after cascaded grouping")
+            else:
+                stage_start = time.time()
+                if streaming:
+                    duplicate_groups = pixel_analyzer.group_exact_duplicates_streaming(image_paths, blocker=blocker,
+                                                                                       qualities_out=qualities)
+                else:
+                    duplicate_groups = pixel_analyzer.group_exact_duplicates(image_paths, blocker=blocker,
+                                                                             features=features, graph=graph)
+                timings['pixel_grouping'] = time.time() - stage_start
+                print(f"Found {len(duplicate_groups)} duplicate groups")
+                
+                # Step 2: Merge similar groups using AI
+                print("Step 2: Merging similar groups with AI...")
+                stage_start = time.time()
+                groups = self.merge_similar_groups_ai(duplicate_groups, image_paths, streaming=streaming,
+                                                      embeddings_out=best_embeddings, blocker=blocker,
+                                                      features=features, graph=graph, qualities=qualities)
+                timings['ai_merging'] = time.time() - stage_start
+                print(f"Final result: {len(groups)} groups after AI merging")
+            stage_start = time.time()
             
             # Analyze each group
             analyzed_groups = []
@@ -301,7 +642,7 @@ class AIAnalyzer:
                 if len(group) == 1:
                     # Single image - unique
                     image_path = image_paths[group[0]]
-                    quality = self.assess_image_quality(image_path)
+                    quality = quality_of(group[0])
                     
                     analyzed_groups.append({
                         'id': f"unique_{group_idx}",
@@ -327,7 +668,7 @@ class AIAnalyzer:
                     
                     for img_idx in group:
                         image_path = image_paths[img_idx]
-                        quality = self.assess_image_quality(image_path)
+                        quality = quality_of(img_idx)
                         file_size = os.path.getsize(image_path)
                         
                         group_images.append({
@@ -356,6 +697,29 @@ class AIAnalyzer:
                         'similarity_score': 0.85  # Typical similarity score for AI-detected similar images
                     })
             
+            timings['quality_assessment'] = time.time() - stage_start
+            
+            if embeddings_out is not None and embed_all:
+                stage_start = time.time()
+                missing = [img_idx for img_idx in range(len(image_paths)) if img_idx not in best_embeddings]
+                if missing:
+                    if features is not None and all(features[img_idx] is not None for img_idx in missing):
+                        missing_embeddings = self.embed_features([features[img_idx] for img_idx in missing])
+                    else:
+                        missing_embeddings = self.extract_features_and_store([image_paths[img_idx] for img_idx in missing])
+                    if missing_embeddings is not None:
+                        best_embeddings.update(zip(missing, missing_embeddings))
+                timings['search_embedding'] = time.time() - stage_start
+            
+            library_duplicate_count = 0
+            if library_index is not None:
+                stage_start = time.time()
+                library_duplicate_count = self.flag_library_duplicates(
+                    image_paths, analyzed_groups, library_index, library_keys or image_paths, best_embeddings,
+                    features=features
+                )
+                timings['library_lookup'] = time.time() - stage_start
+            
             # Calculate statistics
             total_images = len(image_paths)
             total_groups = len(analyzed_groups)
@@ -378,15 +742,26 @@ class AIAnalyzer:
                 'duplicate_count': 0,  # No exact duplicates in AI mode
                 'similar_count': similar_count,
                 'unique_count': unique_count,
+                'library_duplicate_count': library_duplicate_count,
                 'estimated_space_saved_bytes': estimated_space_saved_bytes,
                 'estimated_space_saved_mb': estimated_space_saved_bytes / (1024 * 1024)
             }
             
-            return {
+            result = {
                 'success': True,
                 'groups': analyzed_groups,
-                'statistics': statistics
+                'statistics': statistics,
+                'timings': timings
             }
+            if embeddings_out is not None:
+                embeddings_out.update(best_embeddings)
+            if cascade_counts is not None:
+                # Pairs resolved by each cascade stage
+                result['cascade'] = cascade_counts
+            if graph is not None:
+                graph.set_nodes(analyzed_groups, image_paths)
+                result['similarity_graph'] = graph.to_dict()
+            return result
             
         except Exception as e:
             print(f"Error in AI analysis: {e}")
@@ -0,0 +1,143 @@
+import time
+import numpy as np
+from typing import List, Dict, Tuple, Optional, Callable
+from .job_profiler import JobProfiler
+
+
+class AnalysisRunner:
+    def __init__(self, storage, pixel_analyzer, ai_analyzer_factory: Callable, library_store=None,
+                 result_cache=None, session_embeddings=None, embed_all: bool = False):
+        """Run a complete analysis job: download, analyze and map paths back to storage
+
+        Shared by the in-process analysis threads and the standalone worker.
+        ``ai_analyzer_factory`` returns the AIAnalyzer, so the CLIP model is only
+        loaded by processes that actually run AI analyses. With a
+        ``library_store``, AI analyses also check the user's persistent library.
+        With a ``result_cache``, jobs whose files and settings were analyzed
+        before return the stored result, and new results are stored. With a
+        ``session_embeddings`` store, the CLIP embeddings of AI analyses are
+        kept for text search (every photo's with ``embed_all``).
+        """
+        self.storage = storage
+        self.pixel_analyzer = pixel_analyzer
+        self.ai_analyzer_factory = ai_analyzer_factory
+        self.library_store = library_store
+        self.result_cache = result_cache
+        self.session_embeddings = session_embeddings
+        self.embed_all = embed_all
+
+    def cache_key(self, user_id: str, valid_files: List[Dict], analysis_type: str) -> str:
+        """Result cache key of a job; AI keys include the rest of the user's library, which decides its matches"""
+        library_revision = None
+        if analysis_type == 'ai' and self.library_store is not None:
+            library_revision = self.library_store.get(user_id).content_revision(
+                {file_info['name'] for file_info in valid_files})
+        return self.result_cache.key_for(valid_files, analysis_type, library_revision)
+
+    def cached_result(self, user_id: str, valid_files: List[Dict], analysis_type: str) -> Optional[Dict]:
+        """Stored result for these files and analysis type, if any"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get(self.cache_key(user_id, valid_files, analysis_type))
+
+    def run(self, user_id: str, session_id: str, analysis_type: str,
+            valid_files: List[Dict], profile: bool = False) -> Tuple[Dict, Dict[str, float]]:
+        """Run an analysis job and return (result, per-stage timings)
+
+        With ``profile``, the job bypasses the result cache and runs under a
+        JobProfiler; the profile is returned in ``result['profile']``.
+        """
+        if not profile:
+            return self._run(user_id, session_id, analysis_type, valid_files)
+
+        with JobProfiler() as profiler:
+            result, timings = self._run(user_id, session_id, analysis_type, valid_files, use_cache_lookup=False)
+        result['profile'] = profiler.to_dict()
+        return result, timings
+
+    def _run(self, user_id: str, session_id: str, analysis_type: str, valid_files: List[Dict],
+             use_cache_lookup: bool = True) -> Tuple[Dict, Dict[str, float]]:
+        job_start = time.time()
+        timings = {}
+        temp_file_paths = []
+        try:
+            cache_key = None
+            if self.result_cache is not None:
+                stage_start = time.time()
+                cache_key = self.cache_key(user_id, valid_files, analysis_type)
+                cached = self.result_cache.get(cache_key) if use_cache_lookup else None
+                timings['cache_lookup'] = time.time() - stage_start
+                if cached is not None:
+                    timings['total'] = time.time() - job_start
+                    return cached, timings
+
+            # Download files to temporary locations for analysis
+            stage_start = time.time()
+            temp_file_paths = self.storage.download_session_files(user_id, session_id)
+            timings['download'] = time.time() - stage_start
+
+            if not temp_file_paths:
+                timings['total'] = time.time() - job_start
+                return {'error': 'Failed to download files for analysis'}, timings
+
+            # Create a mapping by index since temp files and valid files should be in the same order
+            temp_to_storage_mapping = {}
+            for i, temp_path in enumerate(temp_file_paths):
+                if i < len(valid_files):
+                    temp_to_storage_mapping[temp_path] = valid_files[i]['name']  # Full path like "user_id/session_id_filename.png"
+
+            # Run analysis on the downloaded files
+            if analysis_type == 'ai':
+                library_index = self.library_store.get(user_id) if self.library_store else None
+                library_keys = [temp_to_storage_mapping.get(temp_path, temp_path) for temp_path in temp_file_paths]
+                embeddings = {} if self.session_embeddings is not None else None
+                result = self.ai_analyzer_factory().analyze_similar_images(
+                    temp_file_paths, library_index=library_index, library_keys=library_keys,
+                    embeddings_out=embeddings, embed_all=self.embed_all
+                )
+                if embeddings and result.get('success'):
+                    positions = sorted(embeddings)
+                    self.session_embeddings.save(session_id, [library_keys[position] for position in positions],
+                                                 np.vstack([embeddings[position] for position in positions]))
+            else:
+                result = self.pixel_analyzer.analyze_exact_duplicates(temp_file_paths)
+
+            # Convert temporary file paths back to storage paths for frontend display
+            if result.get('success') and len(result.get('groups')) > 0:
+                self.map_result_paths(result, temp_to_storage_mapping)
+            for node in result.get('similarity_graph', {}).get('nodes', []):
+                node['path'] = temp_to_storage_mapping.get(node.get('path'), node.get('path'))
+
+            if cache_key is not None:
+                self.result_cache.put(cache_key, result)
+
+            timings.update(result.get('timings', {}))
+            timings['total'] = time.time() - job_start
+            return result, timings
+
+        except Exception as e:
+            print(f"Error running analysis for session {session_id}: {e}")
+            timings['total'] = time.time() - job_start
+            return {'error': str(e)}, timings
+
+        finally:
+            if temp_file_paths:
+                self.storage.cleanup_temp_files(temp_file_paths)
+
+    def map_result_paths(self, result: Dict, path_mapping: Dict[str, str]):
+        """Rewrite image paths in a result using a temp path -> storage path mapping"""
+        for group in result['groups']:
+            for image in group.get('images', []):
+                temp_path = image['path']
+                if temp_path in path_mapping:
+                    image['path'] = path_mapping[temp_path]
+                else:
+                    print(f"Warning: No mapping found for temp path {temp_path}")
+
+            # Update best image path
+            if 'best_image' in group:
+                temp_path = group['best_image']['path']
+                if temp_path in path_mapping:
+                    group['best_image']['path'] = path_mapping[temp_path]
+                else:
+                    print(f"Warning: No mapping found for best image temp path {temp_path}")
@@ -0,0 +1,184 @@
+import os
+import math
+import calendar
+from datetime import datetime
+import numpy as np
+from PIL import Image
+from typing import List, Dict, Optional, Tuple
+
+# EXIF tags read for blocking
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_SUBSEC_TIME_ORIGINAL = 0x9291
+
+DEFAULT_WINDOW_SECONDS = 60
+DEFAULT_MAX_GPS_DISTANCE_M = 1000
+EARTH_RADIUS_M = 6371000
+
+
+def get_burst_blocking_config() -> Dict:
+    """Burst blocking settings from the environment (PICKPERFECT_BURST_*)"""
+    return {
+        'enabled': os.getenv('PICKPERFECT_BURST_BLOCKING', '0') == '1',
+        'window_seconds': float(os.getenv('PICKPERFECT_BURST_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS)),
+        'max_gps_distance_m': float(os.getenv('PICKPERFECT_BURST_MAX_GPS_DISTANCE_M', DEFAULT_MAX_GPS_DISTANCE_M))
+    }
+
+
+def _parse_exif_time(value, subsec=None, offset=None) -> Optional[float]:
+    """Convert an EXIF 'YYYY:MM:DD HH:MM:SS' string to seconds since the epoch"""
+    try:
+        captured = datetime.strptime(str(value).strip('\x00 ')[:19], '%Y:%m:%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+    # Without an offset the time is local to the camera; that is fine for
+    # comparing shots from the same camera
+    timestamp = float(calendar.timegm(captured.timetuple()))
+    if subsec:
+        digits = ''.join(ch for ch in str(subsec) if ch.isdigit())
+        if digits:
+            timestamp += int(digits) / (10 ** len(digits))
+    if offset:
+        try:
+            sign = -1 if str(offset).startswith('-') else 1
+            hours, minutes = str(offset).lstrip('+-').split(':')[:2]
+            timestamp -= sign * (int(hours) * 3600 + int(minutes) * 60)
+        except ValueError:
+            pass
+    return timestamp
+
+
+def _parse_gps(gps_ifd) -> Optional[Tuple[float, float]]:
+    """Decimal (latitude, longitude) from a GPS IFD, if present"""
+    try:
+        def to_degrees(values) -> float:
+            degrees, minutes, seconds = (float(v) for v in values)
+            return degrees + minutes / 60 + seconds / 3600
+
+        latitude = to_degrees(gps_ifd[2])
+        longitude = to_degrees(gps_ifd[4])
+        if str(gps_ifd.get(1, 'N')).upper().startswith('S'):
+            latitude = -latitude
+        if str(gps_ifd.get(3, 'E')).upper().startswith('W'):
+            longitude = -longitude
+        return latitude, longitude
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def read_capture_metadata(image_path: str) -> Dict:
+    """Read capture time, camera model and GPS position from EXIF
+
+    Only the file header is parsed; pixel data is never decoded. Missing
+    values are None.
+    """
+    metadata = {'timestamp': None, 'camera': None, 'gps': None}
+    try:
+        with Image.open(image_path) as image:
+            exif = image.getexif()
+            if not exif:
+                return metadata
+
+            exif_ifd = exif.get_ifd(EXIF_IFD_POINTER)
+            metadata['timestamp'] = _parse_exif_time(
+                exif_ifd.get(TAG_DATETIME_ORIGINAL) or exif.get(TAG_DATETIME),
+                exif_ifd.get(TAG_SUBSEC_TIME_ORIGINAL),
+                exif_ifd.get(TAG_OFFSET_TIME_ORIGINAL)
+            )
+            model = exif.get(TAG_MODEL)
+            if model:
+                metadata['camera'] = str(model).strip('\x00 ') or None
+
+            gps_ifd = exif.get_ifd(GPS_IFD_POINTER)
+            if gps_ifd:
+                metadata['gps'] = _parse_gps(gps_ifd)
+    except Exception as e:
+        print(f"Error reading EXIF metadata from {image_path}: {e}")
+    return metadata
+
+
+def _gps_distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Approximate distance in meters (equirectangular, accurate at burst scale)"""
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    x = (lon2 - lon1) * math.cos((lat1 + lat2) / 2)
+    y = lat2 - lat1
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+class BurstBlocker:
+    def __init__(self, metadata: List[Dict], window_seconds: float = DEFAULT_WINDOW_SECONDS,
+                 max_gps_distance_m: Optional[float] = DEFAULT_MAX_GPS_DISTANCE_M):
+        """Restrict comparisons to photos that could belong to the same burst
+
+        Photos with a capture time are bucketed per camera into windows of
+        ``window_seconds``; a photo is only compared with photos of the same
+        camera in its own and the neighboring windows, and never with photos
+        whose GPS positions are more than ``max_gps_distance_m`` apart. Photos
+        without a capture time are compared with every other photo, so
+        blocking never hides a duplicate that has lost its metadata.
+        """
+        self.window_seconds = window_seconds
+        self.max_gps_distance_m = max_gps_distance_m
+        self.num_images = len(metadata)
+        self._gps = [item.get('gps') for item in metadata]
+        self._keys: List[Optional[Tuple[str, int]]] = []
+        self._windows: Dict[Tuple[str, int], List[int]] = {}
+        self._unblocked: List[int] = []
+
+        for i, item in enumerate(metadata):
+            if item.get('timestamp') is None:
+                self._keys.append(None)
+                self._unblocked.append(i)
+                continue
+            key = (item.get('camera') or '', int(item['timestamp'] // window_seconds))
+            self._keys.append(key)
+            self._windows.setdefault(key, []).append(i)
+
+    @classmethod
+    def from_paths(cls, image_paths: List[str], **options) -> 'BurstBlocker':
+        return cls([read_capture_metadata(image_path) for image_path in image_paths], **options)
+
+    def _gps_compatible(self, i: int, j: int) -> bool:
+        if self.max_gps_distance_m is None or self._gps[i] is None or self._gps[j] is None:
+            return True
+        return _gps_distance_m(self._gps[i], self._gps[j]) <= self.max_gps_distance_m
+
+    def is_candidate(self, i: int, j: int) -> bool:
+        """Whether images ``i`` and ``j`` need to be compared"""
+        key_i, key_j = self._keys[i], self._keys[j]
+        if key_i is not None and key_j is not None:
+            if key_i[0] != key_j[0] or abs(key_i[1] - key_j[1]) > 1:
+                return False
+        return self._gps_compatible(i, j)
+
+    def candidates_after(self, i: int) -> np.ndarray:
+        """Sorted indices ``j > i`` that image ``i`` needs to be compared with"""
+        key = self._keys[i]
+        if key is None:
+            pool = range(i + 1, self.num_images)
+        else:
+            camera, window = key
+            pool = list(self._unblocked)
+            for neighbor in (window - 1, window, window + 1):
+                pool.extend(self._windows.get((camera, neighbor), ()))
+        return np.array(sorted(j for j in pool if j > i and self._gps_compatible(i, j)), dtype=np.int64)
+
+    @property
+    def unblocked_count(self) -> int:
+        """Number of images without a capture time"""
+        return len(self._unblocked)
+
+    def pair_count(self) -> int:
+        """Number of image pairs left to compare, before GPS filtering"""
+        unblocked = len(self._unblocked)
+        pairs = unblocked * (self.num_images - unblocked) + unblocked * (unblocked - 1) // 2
+        for (camera, window), members in self._windows.items():
+            pairs += len(members) * (len(members) - 1) // 2
+            pairs += len(members) * len(self._windows.get((camera, window + 1), ()))
+        return pairs
@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import uuid
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Optional
+from werkzeug.utils import secure_filename
+
+from .upload_dedup import HASH_CHUNK_SIZE
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Partial uploads live in this subdirectory of the session directory until they complete
+PARTIAL_DIR = '.uploads'
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ChunkedUploadError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ChunkedUploadManager:
+    def __init__(self, file_handler, default_chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Resumable uploads of single files in fixed-size chunks
+
+        ``init_upload`` preallocates ``<upload_id>.part`` in the session's
+        partial directory, each chunk is streamed to a temporary file and
+        copied into its offset of that file (so chunks can arrive concurrently
+        and in any order) only after its length and SHA-256 are verified, and
+        ``complete`` moves the finished file into the session directory and
+        hands it to the FileHandler's deduplication. Memory use per request is
+        one read buffer, whatever the file size.
+        Received chunks are tracked in ``<upload_id>.json``, so an interrupted
+        upload resumes by sending only the missing chunks.
+        """
+        self.file_handler = file_handler
+        self.default_chunk_size = default_chunk_size
+
+    def _partial_dir(self, session_id: str) -> str:
+        if not session_id or secure_filename(session_id) != session_id:
+            raise ChunkedUploadError('Invalid session ID')
+        return os.path.join(self.file_handler.upload_folder, session_id, PARTIAL_DIR)
+
+    def _paths(self, session_id: str, upload_id: str):
+        if not _UPLOAD_ID.match(upload_id or ''):
+            raise ChunkedUploadError('Invalid upload ID', 404)
+        partial_dir = self._partial_dir(session_id)
+        base = os.path.join(partial_dir, upload_id)
+        return partial_dir, f"{base}.part", f"{base}.json", f"{base}.lock"
+
+    @staticmethod
+    def _write_state(partial_dir: str, state_path: str, state: Dict):
+        fd, temp_path = tempfile.mkstemp(dir=partial_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, state_path)
+
+    @contextmanager
+    def _locked_state(self, session_id: str, upload_id: str):
+        partial_dir, part_path, state_path, lock_path = self._paths(session_id, upload_id)
+        if not os.path.exists(state_path):
+            raise ChunkedUploadError('Upload not found', 404)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Completed or aborted while we waited for the lock
+                if not os.path.exists(state_path):
+                    raise ChunkedUploadError('Upload not found', 404)
+                with open(state_path, 'r') as f:
+                    state = json.load(f)
+                yield state
+                if os.path.exists(state_path):
+                    self._write_state(partial_dir, state_path, state)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self, session_id: str, upload_id: str) -> Dict:
+        _, _, state_path, _ = self._paths(session_id, upload_id)
+        try:
+            with open(state_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ChunkedUploadError('Upload not found', 404)
+
+    @staticmethod
+    def _chunk_length(state: Dict, index: int) -> int:
+        return min(state['chunk_size'], state['size'] - index * state['chunk_size'])
+
+    @staticmethod
+    def _summary(upload_id: str, state: Dict) -> Dict:
+        received = set(state['received'])
+        return {
+            'upload_id': upload_id,
+            'session_id': state['session_id'],
+            'filename': state['filename'],
+            'size': state['size'],
+            'chunk_size': state['chunk_size'],
+            'chunk_count': state['chunk_count'],
+            'received_chunks': sorted(received),
+            'missing_chunks': [index for index in range(state['chunk_count']) if index not in received]
+        }
+
+    def init_upload(self, session_id: str, user_id: str, filename: str, size: int,
+                    chunk_size: Optional[int] = None, sha256: Optional[str] = None) -> Dict:
+        """Start an upload of ``size`` bytes and return its ID and chunk layout"""
+        if not self.file_handler.is_valid_image(filename):
+            raise ChunkedUploadError('Invalid file type')
+        if size <= 0 or size > self.file_handler.max_file_size:
+            raise ChunkedUploadError(f"File size must be between 1 and {self.file_handler.max_file_size} bytes")
+        chunk_size = chunk_size or self.default_chunk_size
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ChunkedUploadError(f"Chunk size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes")
+
+        upload_id = uuid.uuid4().hex
+        partial_dir, part_path, state_path, _ = self._paths(session_id, upload_id)
+        os.makedirs(partial_dir, exist_ok=True)
+
+        # Preallocate (sparsely) so chunks can be written at their offsets in any order
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+
+        state = {
+            'session_id': session_id,
+            'user_id': user_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': chunk_size,
+            'chunk_count': (size + chunk_size - 1) // chunk_size,
+            'sha256': sha256.lower() if sha256 else None,
+            'received': []
+        }
+        self._write_state(partial_dir, state_path, state)
+        return self._summary(upload_id, state)
+
+    def write_chunk(self, session_id: str, upload_id: str, index: int, stream, checksum: str) -> Dict:
+        """Write one chunk into place and record it once its SHA-256 matches ``checksum``"""
+        state = self._read_state(session_id, upload_id)
+        if not 0 <= index < state['chunk_count']:
+            raise ChunkedUploadError(f"Chunk index must be between 0 and {state['chunk_count'] - 1}")
+        if not checksum:
+            raise ChunkedUploadError('Chunk checksum is required')
+
+        partial_dir, part_path, _, _ = self._paths(session_id, upload_id)
+        expected_length = self._chunk_length(state, index)
+        digest = hashlib.sha256()
+        length = 0
+        # Spool to a temporary file first: a rejected retry of an already
+        # received chunk must not overwrite the good bytes at its offset
+        try:
+            spool = tempfile.TemporaryFile(dir=partial_dir)
+        except FileNotFoundError:
+            raise ChunkedUploadError('Upload not found', 404)
+        with spool:
+            while length <= expected_length:
+                block = stream.read(min(HASH_CHUNK_SIZE, expected_length + 1 - length))
+                if not block:
+                    break
+                length += len(block)
+                if length > expected_length:
+                    break
+                digest.update(block)
+                spool.write(block)
+
+            # A rejected chunk is not recorded, so the client simply sends it again
+            if length != expected_length:
+                raise ChunkedUploadError(f"Chunk {index} must be {expected_length} bytes")
+            if digest.hexdigest() != checksum.lower():
+                raise ChunkedUploadError(f"Checksum mismatch for chunk {index}")
+
+            spool.seek(0)
+            try:
+                part_file = open(part_path, 'r+b')
+            except FileNotFoundError:
+                raise ChunkedUploadError('Upload not found', 404)
+            with part_file as f:
+                f.seek(index * state['chunk_size'])
+                shutil.copyfileobj(spool, f, HASH_CHUNK_SIZE)
+
+        with self._locked_state(session_id, upload_id) as locked_state:
+            if index not in locked_state['received']:
+                locked_state['received'].append(index)
+            return self._summary(upload_id, locked_state)
+
+    def status(self, session_id: str, upload_id: str) -> Dict:
+        return self._summary(upload_id, self._read_state(session_id, upload_id))
+
+    def complete(self, session_id: str, upload_id: str) -> Dict:
+        """Move a fully received upload into the session directory
+
+        Returns the FileHandler's stored-file record plus the original filename.
+        """
+        partial_dir, part_path, state_path, lock_path = self._paths(session_id, upload_id)
+        with self._locked_state(session_id, upload_id) as state:
+            summary = self._summary(upload_id, state)
+            if summary['missing_chunks']:
+                raise ChunkedUploadError(f"{len(summary['missing_chunks'])} chunks are missing", 409)
+
+            digest = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(block)
+            if state['sha256'] and digest.hexdigest() != state['sha256']:
+                raise ChunkedUploadError('Checksum mismatch for the complete file', 422)
+
+            file_ext = os.path.splitext(state['filename'])[1]
+            file_path = os.path.join(os.path.dirname(partial_dir), f"{uuid.uuid4()}{file_ext}")
+            os.replace(part_path, file_path)
+            os.remove(state_path)
+        os.remove(lock_path)
+
+        stored = self.file_handler.register_file(file_path, digest.hexdigest(), state['size'],
+                                                 session_id, state['user_id'])
+        stored['filename'] = state['filename']
+        return stored
+
+    def abort(self, session_id: str, upload_id: str) -> bool:
+        """Discard a partial upload"""
+        removed = False
+        for path in self._paths(session_id, upload_id)[1:]:
+            if os.path.exists(path):
+                os.remove(path)
+                removed = True
+        return removed
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+from PIL import Image
+from typing import List, Optional
+from .raw_preview import is_preview_format, load_preview
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch16"
+
+# Preprocessing constants of CLIP_MODEL_NAME (see its preprocessor_config.json)
+CLIP_IMAGE_SIZE = 224
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+# Normalization folded into one multiply-add: (pixel / 255 - mean) / std
+_SCALE = (1.0 / (255.0 * CLIP_STD)).reshape(1, 3, 1, 1)
+_OFFSET = (-CLIP_MEAN / CLIP_STD).reshape(1, 3, 1, 1)
+
+
+def load_rgb(image_path: str) -> np.ndarray:
+    """Decode an image into an RGB uint8 array, falling back to PIL for formats OpenCV cannot read
+
+    HEIC and RAW photos are represented by their embedded preview.
+    """
+    if is_preview_format(image_path):
+        preview = load_preview(image_path)
+        if preview is None:
+            raise ValueError(f"No readable preview in {image_path}")
+        return cv2.cvtColor(preview[0], cv2.COLOR_BGR2RGB)
+    # Like PIL (and CLIPProcessor), keep the stored orientation instead of applying EXIF rotation
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is not None:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with Image.open(image_path) as pil_image:
+        return np.asarray(pil_image.convert('RGB'))
+
+
+def resize_and_crop(image: np.ndarray, size: int = CLIP_IMAGE_SIZE) -> np.ndarray:
+    """Resize the shortest side to ``size`` and center-crop to ``size`` x ``size``
+
+    Mirrors CLIPProcessor's geometry. Downscaling uses area interpolation,
+    which like PIL's bicubic filter averages over the source pixels instead
+    of aliasing.
+    """
+    height, width = image.shape[:2]
+    if height <= width:
+        new_height, new_width = size, int(size * width / height)
+    else:
+        new_height, new_width = int(size * height / width), size
+
+    interpolation = cv2.INTER_AREA if new_height < height else cv2.INTER_CUBIC
+    resized = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+
+    top = (new_height - size) // 2
+    left = (new_width - size) // 2
+    return resized[top:top + size, left:left + size]
+
+
+def normalize_crops(crops: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Normalize (N, size, size, 3) uint8 crops into CLIP pixel values (N, 3, size, size)
+
+    One vectorized multiply-add written directly into ``out`` (allocated if not given).
+    """
+    if out is None:
+        out = np.empty((crops.shape[0], 3, crops.shape[1], crops.shape[2]), dtype=np.float32)
+    np.multiply(crops.transpose(0, 3, 1, 2), _SCALE, out=out)
+    np.add(out, _OFFSET, out=out)
+    return out
+
+
+def preprocess_batch(images: List[np.ndarray], size: int = CLIP_IMAGE_SIZE,
+                     out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Turn decoded RGB arrays into CLIP pixel values (N, 3, size, size)"""
+    crops = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    for i, image in enumerate(images):
+        crops[i] = resize_and_crop(image, size)
+    return normalize_crops(crops, out)
+
+
+def preprocess_paths(image_paths: List[str], size: int = CLIP_IMAGE_SIZE) -> np.ndarray:
+    """Decode and preprocess images for CLIP, keeping only one full-size image in memory at a time"""
+    crops = np.empty((len(image_paths), size, size, 3), dtype=np.uint8)
+    for i, image_path in enumerate(image_paths):
+        crops[i] = resize_and_crop(load_rgb(image_path), size)
+    return normalize_crops(crops)
@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import faiss
+from typing import Dict, List, Optional, Tuple
+
+STORAGE_MODES = ('float32', 'float16', 'pq')
+
+DEFAULT_STORAGE_PARAMS = {
+    # Sub-quantizers and bits per code for 'pq' (64 x 8 bits = 64 bytes per vector)
+    'pq_m': 64,
+    'pq_nbits': 8,
+    # Compressed searches fetch rerank_factor * k candidates before exact re-ranking
+    'rerank_factor': 4
+}
+
+
+def get_storage_config() -> Dict:
+    """Embedding storage mode and parameters from the environment"""
+    params = dict(DEFAULT_STORAGE_PARAMS)
+    for name in DEFAULT_STORAGE_PARAMS:
+        value = os.getenv(f"PICKPERFECT_EMBEDDING_{name.upper()}")
+        if value:
+            params[name] = int(value)
+    return {'mode': os.getenv('PICKPERFECT_EMBEDDING_STORAGE', 'float32'), 'params': params}
+
+
+def create_codec_index(dim: int, mode: str = 'float32', params: Optional[Dict] = None) -> faiss.Index:
+    """Create a flat inner-product index whose vectors are stored in ``mode``
+
+    'float32' stores exact vectors (4 bytes per dimension), 'float16' halves
+    that, and 'pq' stores pq_m * pq_nbits bits per vector. The 'pq' index must
+    be trained before vectors are added.
+    """
+    params = {**DEFAULT_STORAGE_PARAMS, **(params or {})}
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown embedding storage mode '{mode}', expected one of {', '.join(STORAGE_MODES)}")
+
+    if mode == 'float16':
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    if mode == 'pq':
+        pq_m = params['pq_m']
+        while dim % pq_m:
+            pq_m -= 1
+        return faiss.IndexPQ(dim, pq_m, params['pq_nbits'], faiss.METRIC_INNER_PRODUCT)
+    return faiss.IndexFlatIP(dim)
+
+
+def create_ivf_codec_index(dim: int, nlist: int, mode: str = 'float32', params: Optional[Dict] = None) -> faiss.Index:
+    """IVF counterpart of create_codec_index for large collections"""
+    params = {**DEFAULT_STORAGE_PARAMS, **(params or {})}
+    quantizer = faiss.IndexFlatIP(dim)
+
+    if mode == 'float16':
+        return faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_fp16,
+                                             faiss.METRIC_INNER_PRODUCT)
+    if mode == 'pq':
+        pq_m = params['pq_m']
+        while dim % pq_m:
+            pq_m -= 1
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, params['pq_nbits'], faiss.METRIC_INNER_PRODUCT)
+    return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+
+
+def bytes_per_vector(index: faiss.Index) -> int:
+    """Storage cost of one vector in a codec index"""
+    return index.sa_code_size()
+
+
+def rerank(queries: np.ndarray, candidate_scores: np.ndarray, candidate_ids: np.ndarray, k: int,
+           exact_vectors) -> Tuple[np.ndarray, np.ndarray]:
+    """Re-score approximate candidates with exact vectors and keep the best ``k``
+
+    ``exact_vectors`` is anything with a ``get(id)`` returning the exact vector
+    or None (a dict or an ExactVectorStore). Candidates without an exact vector
+    keep their approximate score.
+    """
+    num_queries = len(queries)
+    scores = np.full((num_queries, k), -np.inf, dtype='float32')
+    ids = np.full((num_queries, k), -1, dtype=np.int64)
+
+    for row, (query, row_scores, row_ids) in enumerate(zip(queries, candidate_scores, candidate_ids)):
+        rescored = []
+        for approximate_score, candidate_id in zip(row_scores, row_ids):
+            if candidate_id < 0:
+                continue
+            vector = exact_vectors.get(int(candidate_id))
+            similarity = float(np.dot(query, vector)) if vector is not None else float(approximate_score)
+            rescored.append((similarity, int(candidate_id)))
+
+        rescored.sort(key=lambda item: item[0], reverse=True)
+        for column, (similarity, candidate_id) in enumerate(rescored[:k]):
+            scores[row, column] = similarity
+            ids[row, column] = candidate_id
+
+    return scores, ids
+
+
+class ExactVectorStore:
+    def __init__(self, path: str, dim: int):
+        """Exact float32 vectors kept on disk next to a compressed index
+
+        Vectors live in a memory-mapped file so re-ranking only pages in the
+        candidates it touches.
+        """
+        self.path = path
+        self.ids_path = path + '.ids.npy'
+        self.dim = dim
+        self._vectors = None
+        self._row_of: Dict[int, int] = {}
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path) and os.path.exists(self.ids_path):
+            self._vectors = np.load(self.path, mmap_mode='r')
+            ids = np.load(self.ids_path)
+            self._row_of = {int(vector_id): row for row, vector_id in enumerate(ids) if vector_id >= 0}
+        else:
+            self._vectors = np.zeros((0, self.dim), dtype='float32')
+            self._row_of = {}
+
+    def get(self, vector_id: int) -> Optional[np.ndarray]:
+        row = self._row_of.get(vector_id)
+        return None if row is None else self._vectors[row]
+
+    def save(self, vectors_by_id: Dict[int, np.ndarray], removed_ids: List[int] = ()):
+        """Add vectors and drop removed ids, rewriting the files atomically"""
+        dropped = set(removed_ids) | set(vectors_by_id)
+        kept = [(vector_id, row) for vector_id, row in self._row_of.items() if vector_id not in dropped]
+        kept_vectors = np.asarray(self._vectors[[row for _, row in kept]], dtype='float32').reshape(-1, self.dim)
+
+        new_ids = list(vectors_by_id)
+        new_vectors = (np.vstack([vectors_by_id[vector_id] for vector_id in new_ids]).astype('float32')
+                       if new_ids else np.zeros((0, self.dim), dtype='float32'))
+
+        with open(self.path + '.tmp', 'wb') as f:
+            np.save(f, np.vstack([kept_vectors, new_vectors]))
+        with open(self.ids_path + '.tmp', 'wb') as f:
+            np.save(f, np.asarray([vector_id for vector_id, _ in kept] + new_ids, dtype=np.int64))
+        os.replace(self.path + '.tmp', self.path)
+        os.replace(self.ids_path + '.tmp', self.ids_path)
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._row_of)
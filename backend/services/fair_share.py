@@ -0,0 +1,221 @@
+import os
+import time
+import itertools
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional
+
+# Relative cost of analyzing one image; AI analyses also run CLIP
+ANALYSIS_COSTS = {'pixel': 1.0, 'ai': 4.0}
+
+DEFAULT_MAX_CONCURRENT_JOBS = 4
+DEFAULT_USER_MAX_CONCURRENT = 2
+DEFAULT_USER_MAX_QUEUED = 10
+DEFAULT_HALF_LIFE_SECONDS = 600
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Per-user shares from 'user_a=2,user_b=0.5'; unlisted users have weight 1"""
+    weights = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        user_id, _, weight = entry.rpartition('=')
+        if not user_id or float(weight) <= 0:
+            raise ValueError(f"Invalid user weight '{entry}', expected user_id=<positive number>")
+        weights[user_id.strip()] = float(weight)
+    return weights
+
+
+def get_fair_share_config() -> Dict:
+    """Scheduling and admission settings from the environment (PICKPERFECT_FAIR_SHARE*, PICKPERFECT_USER_*)"""
+    return {
+        'enabled': os.getenv('PICKPERFECT_FAIR_SHARE', '1') != '0',
+        # Analyses run at once in thread mode (broker mode runs one per worker)
+        'max_concurrent_jobs': int(os.getenv('PICKPERFECT_MAX_CONCURRENT_JOBS', DEFAULT_MAX_CONCURRENT_JOBS)),
+        'user_max_concurrent': int(os.getenv('PICKPERFECT_USER_MAX_CONCURRENT', DEFAULT_USER_MAX_CONCURRENT)),
+        'user_max_queued': int(os.getenv('PICKPERFECT_USER_MAX_QUEUED', DEFAULT_USER_MAX_QUEUED)),
+        # Images a user may have queued or running at once, 0 for no quota
+        'user_image_quota': int(os.getenv('PICKPERFECT_USER_IMAGE_QUOTA', 0)),
+        'half_life_seconds': float(os.getenv('PICKPERFECT_FAIR_SHARE_HALF_LIFE_SECONDS', DEFAULT_HALF_LIFE_SECONDS)),
+        'weights': parse_weights(os.getenv('PICKPERFECT_USER_WEIGHTS', ''))
+    }
+
+
+def estimate_cost(image_count: int, analysis_type: str) -> float:
+    """Estimated work of an analysis, in pixel-image units"""
+    return image_count * ANALYSIS_COSTS.get(analysis_type, ANALYSIS_COSTS['ai'])
+
+
+def decayed_usage(usage: float, updated_at: float, now: float, half_life_seconds: float) -> float:
+    """Usage halves every ``half_life_seconds``, so past jobs count less over time"""
+    return usage * 0.5 ** (max(0.0, now - updated_at) / max(half_life_seconds, 1e-6))
+
+
+class AdmissionError(Exception):
+    def __init__(self, message: str, status_code: int = 429):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def check_admission(queued_jobs: int, outstanding_images: int, image_count: int, config: Dict):
+    """Raise AdmissionError if a user may not submit another job of ``image_count`` images
+
+    ``queued_jobs`` counts the user's jobs waiting to run and
+    ``outstanding_images`` the images in their queued and running jobs.
+    """
+    quota = config['user_image_quota']
+    if quota and image_count > quota:
+        raise AdmissionError(f"Session has {image_count} images, more than the per-user limit of {quota}", 413)
+    if config['user_max_queued'] and queued_jobs >= config['user_max_queued']:
+        raise AdmissionError(f"Too many queued analyses ({queued_jobs}), wait for some to finish")
+    if quota and outstanding_images + image_count > quota:
+        raise AdmissionError(f"Analyses in progress already cover {outstanding_images} of "
+                             f"{quota} images, wait for them to finish")
+
+
+def select_user(waiting_users: Iterable[str], running: Dict[str, int], usage: Dict[str, float],
+                config: Dict) -> Optional[str]:
+    """The user whose job runs next: the lowest weighted recent usage among users below their concurrency limit
+
+    Users who used little capacity lately (e.g. with a small session) go ahead
+    of users whose large jobs were just charged to them. Ties keep the order
+    of ``waiting_users``, which callers pass oldest job first.
+    """
+    user_max_concurrent = config['user_max_concurrent']
+    best_user, best_priority = None, None
+    for user_id in waiting_users:
+        if user_max_concurrent and running.get(user_id, 0) >= user_max_concurrent:
+            continue
+        priority = usage.get(user_id, 0.0) / config['weights'].get(user_id, 1.0)
+        if best_priority is None or priority < best_priority:
+            best_user, best_priority = user_id, priority
+    return best_user
+
+
+class FairShareScheduler:
+    def __init__(self, config: Optional[Dict] = None):
+        """Fair-share queue for analyses run in this process
+
+        Jobs wait in a queue per user and ``max_concurrent_jobs`` threads run
+        them. When a thread frees up, it picks the oldest job of the user with
+        the least weighted recent usage (see select_user); starting a job
+        charges its estimated cost to its user. ``submit`` applies the
+        per-user admission limits.
+        """
+        self.config = config or get_fair_share_config()
+        self._pending: Dict[str, deque] = {}
+        self._running: Dict[str, int] = {}
+        self._outstanding_images: Dict[str, int] = {}
+        self._usage: Dict[str, tuple] = {}
+        self._queued_sessions: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._draining = False
+
+    def start(self):
+        for worker_index in range(max(1, self.config['max_concurrent_jobs'])):
+            thread = threading.Thread(target=self._run_worker, name=f"analysis-{worker_index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain: bool = False, timeout: Optional[float] = None) -> bool:
+        """Stop accepting jobs and stop the threads once the running jobs finish
+
+        With ``drain``, queued jobs are run first. Returns False if the
+        threads were still busy after ``timeout`` seconds.
+        """
+        with self._condition:
+            self._stopping = True
+            self._draining = drain
+            self._condition.notify_all()
+        deadline = time.time() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.time()))
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        return not self._threads
+
+    def submit(self, user_id: str, session_id: str, image_count: int, cost: float, run: Callable[[], None]):
+        """Queue ``run`` as an analysis of ``image_count`` images, or raise AdmissionError"""
+        with self._condition:
+            if self._stopping:
+                raise AdmissionError('Server is shutting down, retry shortly', 503)
+            pending = self._pending.get(user_id, deque())
+            check_admission(len(pending), self._outstanding_images.get(user_id, 0), image_count, self.config)
+            self._pending[user_id] = pending
+            pending.append({
+                'sequence': next(self._sequence),
+                'session_id': session_id,
+                'image_count': image_count,
+                'cost': cost,
+                'run': run
+            })
+            self._outstanding_images[user_id] = self._outstanding_images.get(user_id, 0) + image_count
+            self._queued_sessions[session_id] = self._queued_sessions.get(session_id, 0) + 1
+            self._condition.notify()
+
+    def is_queued(self, session_id: str) -> bool:
+        """Whether an analysis of the session is waiting for a free thread"""
+        with self._condition:
+            return session_id in self._queued_sessions
+
+    def _usage_of(self, user_id: str, now: float) -> float:
+        usage, updated_at = self._usage.get(user_id, (0.0, now))
+        return decayed_usage(usage, updated_at, now, self.config['half_life_seconds'])
+
+    def _next_job(self):
+        """Pop the next job to run (caller holds the condition), or return None"""
+        now = time.time()
+        waiting = sorted((queue[0]['sequence'], user_id) for user_id, queue in self._pending.items() if queue)
+        waiting_users = [user_id for _, user_id in waiting]
+        usage = {user_id: self._usage_of(user_id, now) for user_id in waiting_users}
+        user_id = select_user(waiting_users, self._running, usage, self.config)
+        if user_id is None:
+            return None
+
+        job = self._pending[user_id].popleft()
+        if not self._pending[user_id]:
+            del self._pending[user_id]
+        self._queued_sessions[job['session_id']] -= 1
+        if not self._queued_sessions[job['session_id']]:
+            del self._queued_sessions[job['session_id']]
+        self._running[user_id] = self._running.get(user_id, 0) + 1
+        self._usage[user_id] = (usage[user_id] + job['cost'], now)
+        return user_id, job
+
+    def _run_worker(self):
+        while True:
+            with self._condition:
+                next_job = None
+                while not self._stopping or (self._draining and (self._pending or self._running)):
+                    next_job = self._next_job()
+                    if next_job is not None:
+                        break
+                    self._condition.wait()
+                if next_job is None:
+                    return
+            user_id, job = next_job
+
+            try:
+                job['run']()
+            except Exception as e:
+                print(f"Error running analysis for session {job['session_id']}: {e}")
+            finally:
+                with self._condition:
+                    self._running[user_id] -= 1
+                    if not self._running[user_id]:
+                        del self._running[user_id]
+                    self._outstanding_images[user_id] -= job['image_count']
+                    if not self._outstanding_images[user_id]:
+                        del self._outstanding_images[user_id]
+                    # A user at their concurrency limit may have jobs that can run now
+                    self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'queued_jobs': sum(len(queue) for queue in self._pending.values()),
+                'running_jobs': sum(self._running.values()),
+                'active_users': len(set(self._pending) | set(self._running)),
+                'max_concurrent_jobs': self.config['max_concurrent_jobs']
+            }
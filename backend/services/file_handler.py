@@ -5,13 +5,24 @@ from typing import List, Dict, Optional
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import mimetypes
+from .upload_dedup import stream_to_file
+from .raw_preview import SUPPORTED_PREVIEW_EXTENSIONS
 
 class FileHandler:
-    def __init__(self, upload_folder: str = "uploads", max_file_size: int = 50 * 1024 * 1024):
-        """Initialize file handler"""
+    def __init__(self, upload_folder: str = "uploads", max_file_size: int = 50 * 1024 * 1024,
+                 hash_index=None):
+        """Initialize file handler
+        
+        With a ``hash_index`` (UploadHashIndex), uploads whose bytes the user
+        already stored are not kept twice: a duplicate within the session is
+        dropped and a duplicate of another session's file becomes a hard link
+        to the existing copy.
+        """
         self.upload_folder = upload_folder
         self.max_file_size = max_file_size  # 50MB default
-        self.allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
+        self.hash_index = hash_index
+        # HEIC and camera RAW files are analyzed through their embedded previews, when the decoder is installed
+        self.allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'} | SUPPORTED_PREVIEW_EXTENSIONS
         
         # Create upload directory if it doesn't exist
         os.makedirs(upload_folder, exist_ok=True)
@@ -28,8 +39,21 @@ class FileHandler:
         
         return True
     
-    def save_uploaded_file(self, file, session_id: str) -> Optional[str]:
+    def save_uploaded_file(self, file, session_id: str, user_id: Optional[str] = None) -> Optional[str]:
         """Save uploaded file and return the file path"""
+        stored = self.store_upload(file, session_id, user_id)
+        return stored['path'] if stored else None
+    
+    def store_upload(self, file, session_id: str, user_id: Optional[str] = None) -> Optional[Dict]:
+        """Save an uploaded file, hashing it while it is written
+        
+        Returns {'path', 'sha256', 'size', 'deduplicated'}, where
+        ``deduplicated`` is None for a new copy, or {'duplicate_of', 'scope'}
+        when the content was already stored in this session ('session') or
+        another of the user's sessions ('library'). Returns None for invalid
+        or oversized files.
+        """
+        file_path = None
         try:
             if not file or not file.filename:
                 return None
@@ -38,14 +62,6 @@ class FileHandler:
             if not self.is_valid_image(file.filename):
                 return None
             
-            # Check file size
-            file.seek(0, os.SEEK_END)
-            file_size = file.tell()
-            file.seek(0)
-            
-            if file_size > self.max_file_size:
-                return None
-            
             # Generate unique filename
             file_ext = os.path.splitext(file.filename)[1]
             unique_filename = f"{uuid.uuid4()}{file_ext}"
@@ -54,25 +70,73 @@ class FileHandler:
             session_dir = os.path.join(self.upload_folder, session_id)
             os.makedirs(session_dir, exist_ok=True)
             
-            # Save file
+            # Save file, checking its size as it streams in
             file_path = os.path.join(session_dir, unique_filename)
-            file.save(file_path)
+            hashed = stream_to_file(file.stream, file_path, self.max_file_size)
+            if hashed is None:
+                return None
+            digest, file_size = hashed
             
-            return file_path
+            return self.register_file(file_path, digest, file_size, session_id, user_id)
             
         except Exception as e:
             print(f"Error saving file: {e}")
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
             return None
     
-    def save_multiple_files(self, files, session_id: str) -> List[str]:
-        """Save multiple uploaded files"""
+    def register_file(self, file_path: str, digest: str, file_size: int, session_id: str,
+                      user_id: Optional[str] = None) -> Dict:
+        """Check a file just written to the session directory against the user's hash index
+        
+        Returns the same record as ``store_upload``.
+        """
+        stored = {'path': file_path, 'sha256': digest, 'size': file_size, 'deduplicated': None}
+        if self.hash_index is None or not user_id:
+            return stored
+        
+        existing_path = self.hash_index.claim(user_id, digest, file_path)
+        if existing_path is None:
+            return stored
+        
+        if os.path.dirname(existing_path) == os.path.join(self.upload_folder, session_id):
+            os.remove(file_path)
+            stored['path'] = existing_path
+            stored['deduplicated'] = {'duplicate_of': existing_path, 'scope': 'session'}
+            return stored
+        
+        # Replace the new copy with a reference to the existing one; keep the copy if linking fails
+        link_path = f"{file_path}.link"
+        try:
+            os.link(existing_path, link_path)
+            os.replace(link_path, file_path)
+            stored['deduplicated'] = {'duplicate_of': existing_path, 'scope': 'library'}
+        except OSError as link_error:
+            print(f"Could not link {file_path} to {existing_path}: {link_error}")
+            if os.path.exists(link_path):
+                os.remove(link_path)
+        return stored
+    
+    def save_multiple_files(self, files, session_id: str, user_id: Optional[str] = None,
+                            deduplicated: Optional[List[Dict]] = None) -> List[str]:
+        """Save multiple uploaded files
+        
+        Files recognized as duplicates are reported in ``deduplicated`` (if
+        given) with their original filename; a duplicate within the session
+        is only returned once.
+        """
         saved_paths = []
         
         for file in files:
             if file and file.filename:
-                file_path = self.save_uploaded_file(file, session_id)
-                if file_path:
-                    saved_paths.append(file_path)
+                stored = self.store_upload(file, session_id, user_id)
+                if not stored:
+                    continue
+                if stored['deduplicated'] and deduplicated is not None:
+                    deduplicated.append({'filename': file.filename, 'path': stored['path'],
+                                         **stored['deduplicated']})
+                if stored['path'] not in saved_paths:
+                    saved_paths.append(stored['path'])
         
         return saved_paths
     
@@ -0,0 +1,156 @@
+import cv2
+import numpy as np
+from PIL import Image
+from typing import List, Dict, Optional, Tuple
+from .clip_preprocess import resize_and_crop, CLIP_IMAGE_SIZE
+from .raw_preview import is_preview_format, load_preview
+
+# Same weights both analyzers use for their overall quality score
+DEFAULT_QUALITY_WEIGHTS = {
+    'resolution': 0.3,
+    'sharpness': 0.25,
+    'brightness': 0.2,
+    'contrast': 0.15,
+    'noise': 0.1
+}
+
+NOISE_KERNEL = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
+
+
+def load_image(image_path: str) -> Tuple[Optional[np.ndarray], Optional[Tuple[int, int]]]:
+    """Decode an image for analysis into (BGR array, original (width, height))
+
+    HEIC and RAW photos are represented by their embedded preview, so the
+    array can be smaller than the original; the second value always holds
+    the original dimensions. Like clip_preprocess.load_rgb (and PIL), the
+    stored orientation is kept and EXIF rotation is not applied, so every
+    path sees the same pixels and embeds the same photo the same way.
+    """
+    if is_preview_format(image_path):
+        preview = load_preview(image_path)
+        return preview if preview is not None else (None, None)
+
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        try:
+            with Image.open(image_path) as pil_image:
+                image = cv2.cvtColor(np.asarray(pil_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        except Exception:
+            return None, None
+    return image, (image.shape[1], image.shape[0])
+
+
+def decode_image(image_path: str) -> Optional[np.ndarray]:
+    """Decode an image into a BGR uint8 array, falling back to PIL for formats OpenCV cannot read"""
+    return load_image(image_path)[0]
+
+
+def compute_quality(image: np.ndarray, quality_weights: Optional[Dict[str, float]] = None,
+                    gray: Optional[np.ndarray] = None,
+                    original_size: Optional[Tuple[int, int]] = None) -> Dict[str, float]:
+    """Quality metrics of a decoded BGR image
+
+    ``original_size`` is the (width, height) of the photo when ``image`` is a
+    smaller embedded preview; resolution is scored and reported from it.
+    """
+    quality_weights = quality_weights or DEFAULT_QUALITY_WEIGHTS
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # 1. Resolution score (normalized by typical photo resolution)
+    if original_size is not None:
+        width, height = original_size
+    else:
+        height, width = image.shape[:2]
+    resolution_score = min(1.0, (height * width) / (1920 * 1080))
+
+    # 2. Sharpness score (using Laplacian variance)
+    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+    sharpness_score = min(1.0, sharpness / 500)  # Normalize
+
+    # 3. Brightness score
+    mean_brightness = np.mean(gray)
+    brightness_score = 1.0 - abs(mean_brightness - 127) / 127
+
+    # 4. Contrast score
+    contrast = np.std(gray)
+    contrast_score = min(1.0, contrast / 50)
+
+    # 5. Noise assessment (using variance of differences)
+    noise = cv2.filter2D(gray, -1, NOISE_KERNEL)
+    noise_score = max(0.0, 1.0 - np.var(noise) / 1000)
+
+    # Calculate weighted overall score
+    overall_score = (
+        quality_weights['resolution'] * resolution_score +
+        quality_weights['sharpness'] * sharpness_score +
+        quality_weights['brightness'] * brightness_score +
+        quality_weights['contrast'] * contrast_score +
+        quality_weights['noise'] * noise_score
+    )
+
+    return {
+        'overall_score': overall_score,
+        'resolution_score': resolution_score,
+        'sharpness_score': sharpness_score,
+        'brightness_score': brightness_score,
+        'contrast_score': contrast_score,
+        'noise_score': noise_score,
+        'width': width,
+        'height': height
+    }
+
+
+def extract_image_features(image_path: str, quality_weights: Optional[Dict[str, float]] = None,
+                           include_clip: bool = True, thumbnail_size: tuple = (64, 64), hash_size: int = 8,
+                           histogram_bins: tuple = (16, 4)) -> Optional[Dict]:
+    """Decode an image once and derive every per-image feature the analyzers use
+
+    The record holds the image dimensions, the grayscale thumbnail used for
+    pixel comparisons (flattened), a packed dHash, a normalized
+    hue/saturation histogram, the quality metrics and, with ``include_clip``,
+    the 224x224 RGB crop CLIP embeds. Returns None if the image cannot be read.
+    """
+    image, original_size = load_image(image_path)
+    if image is None:
+        return None
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(image, thumbnail_size)
+
+    hash_input = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(resized, cv2.COLOR_BGR2HSV)
+    histogram = cv2.calcHist([hsv], [0, 1], None, list(histogram_bins), [0, 180, 0, 256]).flatten()
+    histogram /= max(float(histogram.sum()), 1.0)
+
+    features = {
+        'path': image_path,
+        'width': original_size[0],
+        'height': original_size[1],
+        'thumbnail': cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY).reshape(-1),
+        'phash': np.packbits((hash_input[:, 1:] > hash_input[:, :-1]).flatten()),
+        'histogram': histogram.astype('float32'),
+        'quality': compute_quality(image, quality_weights, gray, original_size),
+        'clip_crop': None
+    }
+    if include_clip:
+        features['clip_crop'] = cv2.cvtColor(resize_and_crop(image, CLIP_IMAGE_SIZE), cv2.COLOR_BGR2RGB)
+    return features
+
+
+def extract_features(image_paths: List[str], quality_weights: Optional[Dict[str, float]] = None,
+                     include_clip: bool = True) -> List[Optional[Dict]]:
+    """Feature records for ``image_paths`` (None for unreadable images)"""
+    records = []
+    for image_path in image_paths:
+        try:
+            records.append(extract_image_features(image_path, quality_weights, include_clip))
+        except Exception as e:
+            print(f"Error extracting features from {image_path}: {e}")
+            records.append(None)
+    return records
+
+
+def feature_quality(record: Optional[Dict]) -> Dict[str, float]:
+    """Quality metrics of a feature record, with the analyzers' fallback for unreadable images"""
+    return record['quality'] if record is not None else {'overall_score': 0.0}
@@ -0,0 +1,105 @@
+import json
+import socket
+import struct
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from typing import Dict, List
+
+# Each message is a 4-byte big-endian length followed by a JSON body
+HEADER = struct.Struct('!I')
+DEFAULT_TIMEOUT = 300
+
+
+class InferenceError(RuntimeError):
+    """Raised when the inference server rejects or fails a request"""
+
+
+def send_message(sock: socket.socket, message: Dict):
+    body = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(body)) + body)
+
+
+def recv_message(sock: socket.socket):
+    """Read one message, or return None if the peer closed the connection"""
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    body = _recv_exact(sock, HEADER.unpack(header)[0])
+    if body is None:
+        return None
+    return json.loads(body.decode('utf-8'))
+
+
+def _recv_exact(sock: socket.socket, size: int):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to a segment owned by another process
+
+    The creating process unlinks the segment; untracking it here keeps this
+    process's resource tracker from unlinking it a second time at exit.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class InferenceClient:
+    def __init__(self, socket_path: str, timeout: float = DEFAULT_TIMEOUT):
+        """Client for the shared CLIP inference server (services.inference_server)
+
+        Tensors are passed through a shared-memory segment; only a small JSON
+        header travels over the Unix socket.
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, message: Dict) -> Dict:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            send_message(sock, message)
+            reply = recv_message(sock)
+
+        if reply is None:
+            raise InferenceError('Inference server closed the connection')
+        if not reply.get('ok'):
+            raise InferenceError(reply.get('error', 'Inference request failed'))
+        return reply
+
+    def info(self) -> Dict:
+        """Model name and embedding dimension served by the server"""
+        return self._request({'op': 'info'})
+
+    def embed_pixel_values(self, pixel_values: np.ndarray) -> np.ndarray:
+        """Normalized image embeddings for a batch of preprocessed images (N, 3, H, W)"""
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, pixel_values.nbytes))
+        try:
+            staged = np.ndarray(pixel_values.shape, dtype=np.float32, buffer=shm.buf)
+            staged[:] = pixel_values
+            del staged
+
+            # The server writes the embeddings back into the same segment
+            reply = self._request({'op': 'embed_images', 'shm': shm.name, 'shape': list(pixel_values.shape)})
+            rows, dim = reply['shape']
+            result = np.ndarray((rows, dim), dtype=np.float32, buffer=shm.buf)
+            embeddings = result.copy()
+            del result
+            return embeddings
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Normalized text embeddings; queries are short, so they travel in the JSON messages"""
+        reply = self._request({'op': 'embed_texts', 'texts': list(texts)})
+        return np.asarray(reply['embeddings'], dtype=np.float32)
@@ -0,0 +1,129 @@
+"""Shared CLIP inference server
+
+Loads the CLIP model once and serves image (and search query) embeddings to every AIAnalyzer on
+the host, so web and worker processes no longer each hold a copy of the
+weights. Run from the backend directory:
+
+    python -m services.inference_server [--socket /tmp/pickperfect-inference.sock]
+
+and start the web app and workers with PICKPERFECT_INFERENCE_SOCKET set to the
+same path. Clients preprocess images themselves and pass the pixel tensors
+through shared memory.
+"""
+import os
+import signal
+import argparse
+import threading
+import socketserver
+import numpy as np
+import torch
+from dotenv import load_dotenv
+from transformers import CLIPModel, CLIPTokenizerFast
+
+from .ai_analyzer import CLIP_MODEL_NAME
+from .inference_client import send_message, recv_message, attach_shared_memory
+from .micro_batcher import MicroBatcher, get_batching_config
+
+DEFAULT_SOCKET_PATH = '/tmp/pickperfect-inference.sock'
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, model_name: str = CLIP_MODEL_NAME):
+        """Serve CLIP image and text embeddings over a Unix socket"""
+        self.model_name = model_name
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = CLIPModel.from_pretrained(model_name)
+        self.model.to(self.device)
+        self.model.eval()
+        self.tokenizer = CLIPTokenizerFast.from_pretrained(model_name)
+        self.embedding_dim = self.model.config.projection_dim
+        # Requests from all clients are combined into shared forward passes
+        batching = get_batching_config()
+        self.batcher = MicroBatcher(self.forward_images, max(1, batching['max_batch_size']), batching['max_wait_ms'])
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, InferenceRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def forward_images(self, pixel_values: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            features = self.model.get_image_features(pixel_values=torch.from_numpy(pixel_values).to(self.device))
+            features = features / features.norm(p=2, dim=-1, keepdim=True)
+        return features.cpu().numpy().astype(np.float32)
+
+    def embed_images(self, request):
+        shape = tuple(request['shape'])
+        shm = attach_shared_memory(request['shm'])
+        try:
+            # Copy out of the segment so the batcher never holds a view of it
+            pixel_values = np.array(np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+            embeddings = self.batcher.run(pixel_values)
+
+            if embeddings.nbytes > shm.size:
+                raise ValueError('Shared memory segment too small for the embeddings')
+            result = np.ndarray(embeddings.shape, dtype=np.float32, buffer=shm.buf)
+            result[:] = embeddings
+            del result
+            return {'ok': True, 'shape': list(embeddings.shape)}
+        finally:
+            shm.close()
+
+    def embed_texts(self, request):
+        inputs = self.tokenizer(request['texts'], padding=True, truncation=True, return_tensors='pt').to(self.device)
+        with torch.no_grad():
+            features = self.model.get_text_features(**inputs)
+            features = features / features.norm(p=2, dim=-1, keepdim=True)
+        return {'ok': True, 'embeddings': features.cpu().numpy().astype(np.float32).tolist()}
+
+    def handle_request(self, request):
+        op = request.get('op')
+        if op == 'info':
+            return {'ok': True, 'model': self.model_name, 'dim': self.embedding_dim, 'batching': self.batcher.stats()}
+        if op == 'embed_images':
+            return self.embed_images(request)
+        if op == 'embed_texts':
+            return self.embed_texts(request)
+        return {'ok': False, 'error': f"Unknown operation '{op}'"}
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            request = recv_message(self.request)
+            if request is None:
+                return
+            try:
+                reply = self.server.handle_request(request)
+            except Exception as e:
+                print(f"Error handling inference request: {e}")
+                reply = {'ok': False, 'error': str(e)}
+            send_message(self.request, reply)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PickPerfect shared CLIP inference server')
+    parser.add_argument('--socket', default=None, help='Unix socket path (defaults to PICKPERFECT_INFERENCE_SOCKET)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    socket_path = args.socket or os.getenv('PICKPERFECT_INFERENCE_SOCKET', DEFAULT_SOCKET_PATH)
+
+    server = InferenceServer(socket_path)
+    signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=server.shutdown).start())
+    print(f"Inference server for {server.model_name} listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        print("Inference server stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Dict, Optional
+from .fair_share import get_fair_share_config, check_admission, select_user, decayed_usage
+
+DEFAULT_BROKER_DB = os.path.join('pickperfect', 'jobs.db')
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    image_count INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    result TEXT,
+    timings TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs (user_id, status);
+CREATE TABLE IF NOT EXISTS user_usage (
+    user_id TEXT PRIMARY KEY,
+    usage REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first release, for databases created before them
+_MIGRATIONS = {
+    'image_count': "ALTER TABLE jobs ADD COLUMN image_count INTEGER NOT NULL DEFAULT 0",
+    'cost': "ALTER TABLE jobs ADD COLUMN cost REAL NOT NULL DEFAULT 0"
+}
+
+
+class SQLiteJobBroker:
+    def __init__(self, db_path: Optional[str] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 fair_share: Optional[Dict] = None):
+        """Analysis job queue shared by the web tier and worker processes
+
+        Jobs are leased to one worker at a time. Workers extend their lease with
+        heartbeats; a job whose lease expires (e.g. because the worker died) is
+        handed to another worker until it runs out of attempts. Several workers
+        and web processes on one host can use the broker concurrently. The
+        database file must be on a local filesystem: SQLite's locking is not
+        reliable over network filesystems, so hosts cannot share it. With fair
+        sharing (see services.fair_share), jobs are leased by the users'
+        weighted recent usage instead of in arrival order, and ``enqueue``
+        applies the per-user admission limits.
+        """
+        self.db_path = db_path or os.getenv('PICKPERFECT_BROKER_DB', DEFAULT_BROKER_DB)
+        self.max_attempts = max_attempts
+        self.fair_share = fair_share or get_fair_share_config()
+        self._local = threading.local()
+        # SQLite connections must not be used across fork; forked children open their own
+        os.register_at_fork(after_in_child=self._reset_connections)
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        connection = self._connection()
+        columns = {row['name'] for row in connection.execute("PRAGMA table_info(jobs)")}
+        for column, statement in _MIGRATIONS.items():
+            if columns and column not in columns:
+                connection.execute(statement)
+        connection.executescript(_SCHEMA)
+
+    def _reset_connections(self):
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA busy_timeout = 30000')
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self, session_id: str, user_id: str, payload: Dict, image_count: int = 0, cost: float = 0.0) -> str:
+        """Add an analysis job to the queue and return its id
+
+        Raises AdmissionError if fair sharing is on and the user is over
+        their queue or image limits.
+        """
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if self.fair_share['enabled']:
+                load = self._user_load(connection, user_id, now)
+                check_admission(load['queued'], load['images'], image_count, self.fair_share)
+            connection.execute(
+                "INSERT INTO jobs (id, session_id, user_id, payload, status, image_count, cost, max_attempts, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, session_id, user_id, json.dumps(payload), image_count, cost, self.max_attempts, now, now)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return job_id
+
+    def _user_load(self, connection: sqlite3.Connection, user_id: str, now: float) -> Dict:
+        """A user's waiting jobs and the images in their waiting and running jobs"""
+        row = connection.execute(
+            "SELECT SUM(status = 'queued' OR lease_expires_at < ?) AS queued, SUM(image_count) AS images "
+            "FROM jobs WHERE user_id = ? AND status IN ('queued', 'leased')",
+            (now, user_id)
+        ).fetchone()
+        return {'queued': row['queued'] or 0, 'images': row['images'] or 0}
+
+    def _select_fair_share(self, connection: sqlite3.Connection, now: float) -> Optional[sqlite3.Row]:
+        """Oldest runnable job of the user chosen by select_user"""
+        oldest = connection.execute(
+            "SELECT user_id, MIN(created_at) AS created_at FROM jobs "
+            "WHERE status = 'queued' OR (status = 'leased' AND lease_expires_at < ?) "
+            "GROUP BY user_id ORDER BY created_at",
+            (now,)
+        ).fetchall()
+        if not oldest:
+            return None
+        waiting_users = [row['user_id'] for row in oldest]
+
+        running = {
+            row['user_id']: row['running'] for row in connection.execute(
+                "SELECT user_id, COUNT(*) AS running FROM jobs "
+                "WHERE status = 'leased' AND lease_expires_at >= ? GROUP BY user_id",
+                (now,)
+            )
+        }
+        placeholders = ','.join('?' * len(waiting_users))
+        usage = {
+            row['user_id']: decayed_usage(row['usage'], row['updated_at'], now, self.fair_share['half_life_seconds'])
+            for row in connection.execute(
+                f"SELECT * FROM user_usage WHERE user_id IN ({placeholders})", waiting_users
+            )
+        }
+
+        user_id = select_user(waiting_users, running, usage, self.fair_share)
+        if user_id is None:
+            return None
+
+        row = connection.execute(
+            "SELECT * FROM jobs WHERE user_id = ? AND (status = 'queued' "
+            "OR (status = 'leased' AND lease_expires_at < ?)) ORDER BY created_at LIMIT 1",
+            (user_id, now)
+        ).fetchone()
+        # Starting a job charges its estimated cost to the user
+        connection.execute(
+            "INSERT INTO user_usage (user_id, usage, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET usage = excluded.usage, updated_at = excluded.updated_at",
+            (user_id, usage.get(user_id, 0.0) + row['cost'], now)
+        )
+        return row
+
+    def lease(self, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[Dict]:
+        """Lease the next runnable job, or return None if there is none
+
+        Runnable jobs are queued jobs and leased jobs whose lease has expired.
+        Without fair sharing, the oldest runnable job is leased.
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose worker died too many times are given up on
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease expired after maximum attempts', "
+                "worker_id = NULL, updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+
+            if self.fair_share['enabled']:
+                row = self._select_fair_share(connection, now)
+            else:
+                row = connection.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'leased' AND lease_expires_at < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', worker_id = ?, attempts = attempts + 1, "
+                "lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row['id'])
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        job = self._row_to_job(row)
+        job['attempts'] += 1
+        return job
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extend a lease; returns False if the worker no longer holds it"""
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = 'leased'",
+            (now + lease_seconds, now, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Dict, timings: Optional[Dict] = None) -> bool:
+        """Store the result of a leased job"""
+        status = 'failed' if 'error' in result else 'completed'
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, timings = ?, error = ?, lease_expires_at = NULL, updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = 'leased'",
+            (status, json.dumps(result), json.dumps(timings or {}), result.get('error'), time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """Release a leased job after an error, re-queueing it if attempts remain"""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+            "error = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = 'leased'",
+            (error, time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def record_completed(self, session_id: str, user_id: str, payload: Dict, result: Dict,
+                         timings: Optional[Dict] = None) -> str:
+        """Add a job that is already finished (e.g. answered from the result cache) and return its id"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (id, session_id, user_id, payload, status, max_attempts, result, timings, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, 'completed', ?, ?, ?, ?, ?)",
+            (job_id, session_id, user_id, json.dumps(payload), self.max_attempts, json.dumps(result),
+             json.dumps(timings or {}), now, now)
+        )
+        return job_id
+
+    def update_result(self, job_id: str, result: Dict) -> Optional[float]:
+        """Replace the result of a completed job (e.g. after re-grouping)
+
+        Returns the job's new updated_at, or None if the job is gone or not completed.
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET result = ?, updated_at = ? WHERE id = ? AND status = 'completed'",
+            (json.dumps(result), now, job_id)
+        )
+        return now if cursor.rowcount == 1 else None
+
+    def delete_session_jobs(self, session_id: str) -> int:
+        """Remove every job of a session, queued and finished; returns how many were removed"""
+        cursor = self._connection().execute("DELETE FROM jobs WHERE session_id = ?", (session_id,))
+        return cursor.rowcount
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def get_session_job(self, session_id: str, include_result: bool = True) -> Optional[Dict]:
+        """Return the most recent job for a session, including its result once finished
+
+        Without ``include_result``, only the job's id, status, error and
+        updated_at are read, which is cheap enough to check on every poll.
+        """
+        columns = '*' if include_result else 'id, session_id, user_id, status, error, created_at, updated_at'
+        row = self._connection().execute(
+            f"SELECT {columns} FROM jobs WHERE session_id = ? ORDER BY created_at DESC LIMIT 1",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._row_to_job(row) if include_result else dict(row)
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['timings'] = json.loads(job['timings']) if job['timings'] else {}
+        return job
@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Dict, Optional
+
+DEFAULT_INTERVAL_MS = 5
+DEFAULT_TOP_ALLOCATIONS = 25
+MAX_STACK_DEPTH = 128
+
+# Leaf frames in these modules mean the thread is idle (waiting on a lock, queue or socket)
+_IDLE_MODULES = ('threading.py', 'queue.py', 'selectors.py', 'socketserver.py', 'socket.py')
+
+_SERVICES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# tracemalloc is process-wide, so only one job traces allocations at a time
+_tracemalloc_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class JobProfiler:
+    def __init__(self, interval_ms: float = DEFAULT_INTERVAL_MS, top_allocations: int = DEFAULT_TOP_ALLOCATIONS,
+                 trace_allocations: bool = True):
+        """Sampling profiler plus tracemalloc for one analysis job
+
+        Used as a context manager around the job. A background thread samples
+        the stacks of the job thread every ``interval_ms``, and of other busy
+        threads running analysis code (e.g. the CLIP micro-batcher), and counts
+        them in the folded format that flamegraph.pl, speedscope and similar
+        tools read; each stack is rooted at its thread name. With
+        ``trace_allocations``, tracemalloc records where memory was allocated
+        while the job ran. Sampling only reads frames, so the job itself runs
+        at full speed; tracing allocations slows every thread in the process.
+        """
+        self.interval = interval_ms / 1000.0
+        self.top_allocations = top_allocations
+        self.trace_allocations = trace_allocations
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.allocations = None
+        self._target_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._tracing = False
+        self._started_tracemalloc = False
+        self._start_time = 0.0
+        self._duration = 0.0
+
+    def _sample(self):
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        sampler_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id:
+                continue
+            is_target = thread_id == self._target_thread_id
+            if not is_target and os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+                continue
+            labels = []
+            in_services = False
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame))
+                in_services = in_services or frame.f_code.co_filename.startswith(_SERVICES_DIR)
+                frame = frame.f_back
+            # Other busy threads only count when they run analysis code
+            if not is_target and not in_services:
+                continue
+            labels.append(threads.get(thread_id, f"thread-{thread_id}").replace(';', ','))
+            self.stacks[';'.join(reversed(labels))] += 1
+        self.samples += 1
+
+    def _run_sampler(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> 'JobProfiler':
+        self._target_thread_id = threading.get_ident()
+        if self.trace_allocations and _tracemalloc_lock.acquire(blocking=False):
+            self._tracing = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            tracemalloc.clear_traces()
+            tracemalloc.reset_peak()
+        self._start_time = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run_sampler, name='job-profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        self._sampler.join()
+        self._duration = time.perf_counter() - self._start_time
+        if self._tracing:
+            try:
+                snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__),
+                    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                ])
+                _, peak = tracemalloc.get_traced_memory()
+                self.allocations = {
+                    'peak_traced_bytes': peak,
+                    'top': [
+                        {
+                            'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                            'size_bytes': stat.size,
+                            'count': stat.count
+                        }
+                        for stat in snapshot.statistics('lineno')[:self.top_allocations]
+                    ]
+                }
+            finally:
+                if self._started_tracemalloc:
+                    tracemalloc.stop()
+                _tracemalloc_lock.release()
+        return False
+
+    def folded(self) -> str:
+        """Samples as ``frame;frame;frame count`` lines"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def to_dict(self) -> Dict:
+        return {
+            'duration_seconds': self._duration,
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'folded': self.folded(),
+            'allocations': self.allocations,
+            'allocations_skipped': self.trace_allocations and not self._tracing
+        }
@@ -0,0 +1,410 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import numpy as np
+import faiss
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+from werkzeug.utils import secure_filename
+from .vector_index import train_and_add, default_nlist, MIN_POINTS_PER_CENTROID
+from .embedding_store import (get_storage_config, create_codec_index, create_ivf_codec_index,
+                              rerank, ExactVectorStore)
+
+DEFAULT_LIBRARY_ROOT = os.path.join('pickperfect', 'library')
+# Libraries larger than this use an IVF index so queries stay sublinear
+DEFAULT_IVF_THRESHOLD = 20000
+# Perceptual hashes are split into this many bands for multi-index hashing
+DEFAULT_PHASH_BANDS = 4
+# Order in which the CLIP index is rebuilt as the library grows
+INDEX_KINDS = ('flat', 'pq', 'ivf')
+
+
+class PerceptualHashIndex:
+    def __init__(self, bands: int = DEFAULT_PHASH_BANDS):
+        """Multi-index hash table over 64-bit perceptual hashes
+
+        Each hash is split into ``bands`` bands. Two hashes within Hamming distance
+        ``bands - 1`` share at least one band exactly, so a query only has to
+        verify the entries in its own band buckets instead of the whole library.
+        """
+        self.bands = bands
+        self.hashes = np.zeros((0, 8), dtype=np.uint8)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self._buckets: List[Dict[bytes, List[int]]] = []
+        self._rebuild()
+
+    def _band_keys(self, phash: np.ndarray) -> List[bytes]:
+        band_bytes = 8 // self.bands
+        return [phash[band * band_bytes:(band + 1) * band_bytes].tobytes() for band in range(self.bands)]
+
+    def _rebuild(self):
+        self._buckets = [{} for _ in range(self.bands)]
+        for row, phash in enumerate(self.hashes):
+            for band, key in enumerate(self._band_keys(phash)):
+                self._buckets[band].setdefault(key, []).append(row)
+
+    def load(self, hashes: np.ndarray, ids: np.ndarray):
+        self.hashes = np.asarray(hashes, dtype=np.uint8).reshape(-1, 8)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._rebuild()
+
+    def add(self, hashes: np.ndarray, ids: np.ndarray):
+        start = len(self.ids)
+        self.hashes = np.vstack([self.hashes, np.asarray(hashes, dtype=np.uint8).reshape(-1, 8)])
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        for row in range(start, len(self.ids)):
+            for band, key in enumerate(self._band_keys(self.hashes[row])):
+                self._buckets[band].setdefault(key, []).append(row)
+
+    def remove(self, ids: np.ndarray):
+        keep = ~np.isin(self.ids, ids)
+        self.hashes = self.hashes[keep]
+        self.ids = self.ids[keep]
+        self._rebuild()
+
+    def search(self, phash: np.ndarray, max_distance: int) -> List[Dict]:
+        """Return ids within ``max_distance`` bits (exact for max_distance < bands)"""
+        candidates = set()
+        for band, key in enumerate(self._band_keys(phash)):
+            candidates.update(self._buckets[band].get(key, []))
+        if not candidates:
+            return []
+
+        rows = np.fromiter(candidates, dtype=np.int64)
+        distances = np.unpackbits(np.bitwise_xor(self.hashes[rows], phash), axis=1).sum(axis=1)
+        return [
+            {'id': int(self.ids[row]), 'distance': int(distance)}
+            for row, distance in zip(rows, distances) if distance <= max_distance
+        ]
+
+
+class UserLibraryIndex:
+    def __init__(self, user_id: str, root: Optional[str] = None, dim: int = 512,
+                 ivf_threshold: int = DEFAULT_IVF_THRESHOLD, nprobe: int = 16,
+                 phash_bands: int = DEFAULT_PHASH_BANDS, storage_mode: Optional[str] = None,
+                 storage_params: Optional[Dict] = None, keep_exact_vectors: Optional[bool] = None):
+        """Persistent index of a user's whole photo library
+
+        Holds the CLIP embeddings and perceptual hashes of every photo the user
+        analyzed, keyed by storage path. The CLIP index is memory-mapped on load
+        and becomes an IVF index once the library outgrows ``ivf_threshold``.
+        Embeddings are stored as ``storage_mode`` (float32, float16 or pq, see
+        PICKPERFECT_EMBEDDING_STORAGE); with ``keep_exact_vectors``, exact
+        vectors are also kept on disk to re-rank compressed search results.
+        Writers on several processes are serialized with a file lock.
+        """
+        storage_config = get_storage_config()
+        self.user_id = user_id
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.storage_mode = storage_mode or storage_config['mode']
+        self.storage_params = {**storage_config['params'], **(storage_params or {})}
+        if keep_exact_vectors is None:
+            keep_exact_vectors = os.getenv('PICKPERFECT_EMBEDDING_KEEP_EXACT', '0') == '1'
+        self.directory = os.path.join(root or os.getenv('PICKPERFECT_LIBRARY_ROOT', DEFAULT_LIBRARY_ROOT),
+                                      secure_filename(user_id) or 'anonymous')
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.clip_index_path = os.path.join(self.directory, 'clip.index')
+        self.phash_path = os.path.join(self.directory, 'phash.npy')
+        self.phash_ids_path = os.path.join(self.directory, 'phash_ids.npy')
+        self.meta_path = os.path.join(self.directory, 'meta.json')
+        self.lock_path = os.path.join(self.directory, '.lock')
+        self.exact_vectors = ExactVectorStore(os.path.join(self.directory, 'exact.npy'), dim) if keep_exact_vectors else None
+
+        self.clip_index: Optional[faiss.Index] = None
+        self.phash_index = PerceptualHashIndex(phash_bands)
+        self.entries: Dict[int, str] = {}
+        self.next_id = 0
+        self._loaded_version = None
+        self._is_mmapped = False
+        self._removed_vector_ids: List[int] = []
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _disk_version(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.meta_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def load(self, mmap: bool = True):
+        """(Re)load the library from disk if it changed since the last load"""
+        with self._lock:
+            version = self._disk_version()
+            if version is None:
+                self.clip_index = self._new_flat_index()
+                return
+            if version == self._loaded_version and (mmap or not self._is_mmapped):
+                return
+
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.entries = {int(entry_id): key for entry_id, key in meta['entries'].items()}
+            self.next_id = meta['next_id']
+
+            if os.path.exists(self.clip_index_path):
+                io_flags = faiss.IO_FLAG_MMAP if mmap else 0
+                self.clip_index = faiss.read_index(self.clip_index_path, io_flags)
+                self._configure_search(self.clip_index)
+            else:
+                self.clip_index = self._new_flat_index()
+            self._is_mmapped = mmap
+
+            if os.path.exists(self.phash_path):
+                self.phash_index.load(np.load(self.phash_path), np.load(self.phash_ids_path))
+            if self.exact_vectors is not None:
+                self.exact_vectors.load()
+
+            self._loaded_version = version
+
+    def _new_flat_index(self) -> faiss.Index:
+        self._is_mmapped = False
+        # pq needs training data, so small pq libraries start out as float16
+        mode = 'float16' if self.storage_mode == 'pq' else self.storage_mode
+        return faiss.IndexIDMap2(create_codec_index(self.dim, mode, self.storage_params))
+
+    def _index_kind(self, index: faiss.Index) -> str:
+        if isinstance(index, faiss.IndexIVF):
+            return 'ivf'
+        if isinstance(index, faiss.IndexIDMap2) and isinstance(faiss.downcast_index(index.index), faiss.IndexPQ):
+            return 'pq'
+        return 'flat'
+
+    def _target_kind(self, count: int) -> str:
+        if count >= self.ivf_threshold:
+            return 'ivf'
+        pq_min_train = (2 ** self.storage_params['pq_nbits']) * MIN_POINTS_PER_CENTROID
+        if self.storage_mode == 'pq' and count >= pq_min_train:
+            return 'pq'
+        return 'flat'
+
+    def _configure_search(self, index: faiss.Index):
+        if isinstance(index, faiss.IndexIVF):
+            index.nprobe = min(self.nprobe, index.nlist)
+
+    def _maybe_rebuild(self):
+        """Rebuild the index as pq or IVF once the library is large enough to train it"""
+        index = self.clip_index
+        current_kind = self._index_kind(index)
+        target_kind = self._target_kind(index.ntotal)
+        if INDEX_KINDS.index(target_kind) <= INDEX_KINDS.index(current_kind):
+            return
+
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        vectors = index.index.reconstruct_n(0, index.ntotal)
+        if self.exact_vectors is not None:
+            # Train on exact vectors where we have them rather than decoded codes
+            for row, vector_id in enumerate(ids):
+                exact = self.exact_vectors.get(int(vector_id))
+                if exact is not None:
+                    vectors[row] = exact
+
+        if target_kind == 'ivf':
+            rebuilt = create_ivf_codec_index(self.dim, default_nlist(len(ids)), self.storage_mode, self.storage_params)
+            # A hashtable direct map keeps remove_ids and reconstruct working with our ids
+            rebuilt.set_direct_map_type(faiss.DirectMap.Hashtable)
+            train_and_add(rebuilt, vectors, ids=ids)
+            self._configure_search(rebuilt)
+        else:
+            codec = create_codec_index(self.dim, 'pq', self.storage_params)
+            codec.train(vectors)
+            rebuilt = faiss.IndexIDMap2(codec)
+            rebuilt.add_with_ids(vectors, ids)
+
+        print(f"Library index for user {self.user_id} rebuilt as {target_kind} "
+              f"({self.storage_mode} storage, {len(ids)} vectors)")
+        self.clip_index = rebuilt
+
+    def _save(self, new_vectors: Optional[Dict[int, np.ndarray]] = None):
+        if self.exact_vectors is not None:
+            self.exact_vectors.save(new_vectors or {}, self._removed_vector_ids)
+        self._removed_vector_ids = []
+
+        faiss.write_index(self.clip_index, self.clip_index_path + '.tmp')
+        os.replace(self.clip_index_path + '.tmp', self.clip_index_path)
+
+        with open(self.phash_path + '.tmp', 'wb') as f:
+            np.save(f, self.phash_index.hashes)
+        os.replace(self.phash_path + '.tmp', self.phash_path)
+        with open(self.phash_ids_path + '.tmp', 'wb') as f:
+            np.save(f, self.phash_index.ids)
+        os.replace(self.phash_ids_path + '.tmp', self.phash_ids_path)
+
+        # meta.json is written last; its mtime is the version readers reload on
+        with open(self.meta_path + '.tmp', 'w') as f:
+            json.dump({'next_id': self.next_id, 'entries': self.entries}, f)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+        self._loaded_version = self._disk_version()
+
+    def _remove_ids(self, ids: List[int]):
+        if not ids:
+            return
+        id_array = np.asarray(ids, dtype=np.int64)
+        self.clip_index.remove_ids(id_array)
+        self.phash_index.remove(id_array)
+        self._removed_vector_ids.extend(ids)
+        for entry_id in ids:
+            self.entries.pop(entry_id, None)
+
+    def add(self, keys: List[str], phashes: List[Optional[np.ndarray]],
+            embeddings: Optional[Dict[int, np.ndarray]] = None) -> List[int]:
+        """Add photos to the library, replacing earlier entries with the same keys
+
+        ``phashes`` is parallel to ``keys``; ``embeddings`` maps positions in
+        ``keys`` to CLIP embeddings for the photos that have one.
+        """
+        embeddings = embeddings or {}
+        with self._lock, self._file_lock():
+            # Mutations need a writable (non memory-mapped) copy of the latest index
+            self.load(mmap=False)
+
+            key_set = set(keys)
+            self._remove_ids([entry_id for entry_id, key in self.entries.items() if key in key_set])
+
+            ids = list(range(self.next_id, self.next_id + len(keys)))
+            self.next_id += len(keys)
+            for entry_id, key in zip(ids, keys):
+                self.entries[entry_id] = key
+
+            hash_rows = [(entry_id, phash) for entry_id, phash in zip(ids, phashes) if phash is not None]
+            if hash_rows:
+                self.phash_index.add(np.vstack([phash for _, phash in hash_rows]),
+                                     np.asarray([entry_id for entry_id, _ in hash_rows], dtype=np.int64))
+
+            new_vectors = {}
+            if embeddings:
+                positions = sorted(embeddings)
+                vectors = np.vstack([embeddings[position] for position in positions]).astype('float32')
+                vector_ids = [ids[position] for position in positions]
+                self.clip_index.add_with_ids(vectors, np.asarray(vector_ids, dtype=np.int64))
+                new_vectors = dict(zip(vector_ids, vectors))
+                self._maybe_rebuild()
+
+            self._save(new_vectors)
+            return ids
+
+    def remove_keys(self, keys: List[str]) -> int:
+        """Remove photos from the library by storage key"""
+        key_set = set(keys)
+        with self._lock, self._file_lock():
+            self.load(mmap=False)
+            ids = [entry_id for entry_id, key in self.entries.items() if key in key_set]
+            if ids:
+                self._remove_ids(ids)
+                self._save()
+            return len(ids)
+
+    def remove_session(self, session_id: str) -> int:
+        """Remove all photos of a session (keys look like 'user_id/session_id_filename')"""
+        with self._lock:
+            self.load()
+            keys = [key for key in self.entries.values() if os.path.basename(key).startswith(f"{session_id}_")]
+        return self.remove_keys(keys) if keys else 0
+
+    def query_embeddings(self, embeddings: np.ndarray, similarity_threshold: float = 0.9,
+                         k: int = 5, exclude_keys: Optional[set] = None) -> List[List[Dict]]:
+        """Find up to ``k`` library photos per query whose CLIP embedding is at least ``similarity_threshold`` similar
+
+        Photos under ``exclude_keys`` (e.g. the session being re-analyzed) are
+        skipped; the search fetches that many extra candidates so they do not
+        crowd out other matches.
+        """
+        exclude_keys = exclude_keys or set()
+        with self._lock:
+            self.load()
+            if self.clip_index is None or self.clip_index.ntotal == 0 or len(embeddings) == 0:
+                return [[] for _ in range(len(embeddings))]
+
+            search_k = k + sum(1 for key in self.entries.values() if key in exclude_keys)
+            queries = np.asarray(embeddings, dtype='float32')
+            if self.storage_mode == 'float32':
+                similarities, ids = self.clip_index.search(queries, search_k)
+            else:
+                # Compressed scores are approximate: fetch extra candidates and re-rank them
+                candidate_similarities, candidate_ids = self.clip_index.search(
+                    queries, search_k * self.storage_params['rerank_factor'])
+                if self.exact_vectors is not None:
+                    similarities, ids = rerank(queries, candidate_similarities, candidate_ids, search_k,
+                                               self.exact_vectors)
+                else:
+                    similarities, ids = candidate_similarities[:, :search_k], candidate_ids[:, :search_k]
+
+            return [
+                [
+                    {'path': self.entries[int(entry_id)], 'similarity': float(similarity), 'match_type': 'clip'}
+                    for similarity, entry_id in zip(row_similarities, row_ids)
+                    if entry_id != -1 and similarity >= similarity_threshold
+                    and int(entry_id) in self.entries
+                    and self.entries[int(entry_id)] not in exclude_keys
+                ][:k]
+                for row_similarities, row_ids in zip(similarities, ids)
+            ]
+
+    def query_phashes(self, phashes: List[Optional[np.ndarray]], max_distance: int = 3,
+                      exclude_keys: Optional[set] = None) -> List[List[Dict]]:
+        """Find library photos whose perceptual hash is within ``max_distance`` bits"""
+        with self._lock:
+            self.load()
+            results = []
+            for phash in phashes:
+                if phash is None:
+                    results.append([])
+                    continue
+                results.append([
+                    {'path': self.entries[match['id']], 'similarity': 1.0 - match['distance'] / 64, 'match_type': 'phash'}
+                    for match in self.phash_index.search(phash, max_distance)
+                    if match['id'] in self.entries and self.entries[match['id']] not in (exclude_keys or set())
+                ])
+            return results
+
+    def content_revision(self, exclude_keys: Optional[set] = None) -> str:
+        """Digest of the library's photos other than ``exclude_keys``
+
+        Entry ids are never reused, so the digest changes whenever one of
+        those photos is added, replaced or removed, while re-adding the
+        excluded photos (e.g. re-analyzing the same session) leaves it as is.
+        """
+        with self._lock:
+            self.load()
+            ids = sorted(entry_id for entry_id, key in self.entries.items() if key not in (exclude_keys or set()))
+        return hashlib.sha256(np.asarray(ids, dtype=np.int64).tobytes()).hexdigest()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.load()
+            return len(self.entries)
+
+
+class LibraryIndexStore:
+    def __init__(self, root: Optional[str] = None, max_loaded: int = 32, **index_options):
+        """Keeps recently used per-user library indexes loaded"""
+        self.root = root
+        self.max_loaded = max_loaded
+        self.index_options = index_options
+        self._indexes: "OrderedDict[str, UserLibraryIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> UserLibraryIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = UserLibraryIndex(user_id, self.root, **self.index_options)
+                self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_loaded:
+                self._indexes.popitem(last=False)
+            return index
@@ -0,0 +1,129 @@
+import os
+import time
+import queue
+import threading
+import weakref
+import numpy as np
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 10
+
+# Queued by close() to stop the batching thread
+_STOP = object()
+
+
+def get_batching_config() -> Dict:
+    """Micro-batching limits from the environment (PICKPERFECT_BATCH_*); a max size of 1 disables batching"""
+    return {
+        'max_batch_size': int(os.getenv('PICKPERFECT_BATCH_MAX_SIZE', DEFAULT_MAX_BATCH_SIZE)),
+        'max_wait_ms': float(os.getenv('PICKPERFECT_BATCH_MAX_WAIT_MS', DEFAULT_MAX_WAIT_MS))
+    }
+
+
+class MicroBatcher:
+    def __init__(self, forward_fn: Callable[[np.ndarray], np.ndarray], max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS, name: str = 'embedding'):
+        """Combine concurrent model calls into shared forward passes
+
+        Callers submit arrays of inputs (one row per item). A single thread
+        collects pending requests until ``max_batch_size`` rows are queued or
+        ``max_wait_ms`` has passed since the first one, runs ``forward_fn`` once
+        on the concatenated rows and hands each caller its slice of the output.
+        Requests larger than ``max_batch_size`` run as a batch of their own.
+        A process forked after the batcher was created (e.g. a pre-forked
+        server worker) gets its own batching thread.
+        """
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._stats_lock = threading.Lock()
+        self._batches_run = 0
+        self._rows_run = 0
+        self._requests_run = 0
+        self._start()
+
+        # Threads do not survive fork; the child starts a fresh one with an empty queue
+        batcher_ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: batcher_ref() is not None and batcher_ref()._start())
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._pending = None
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, inputs: np.ndarray) -> Future:
+        """Queue ``inputs``; the future resolves to the matching output rows"""
+        future = Future()
+        self._queue.put((inputs, future))
+        return future
+
+    def run(self, inputs: np.ndarray) -> np.ndarray:
+        """Queue ``inputs`` and wait for their outputs"""
+        return self.submit(inputs).result()
+
+    def close(self):
+        """Stop the batching thread once queued requests are done"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                'batches': self._batches_run,
+                'requests': self._requests_run,
+                'rows': self._rows_run,
+                'average_batch_rows': self._rows_run / self._batches_run if self._batches_run else 0.0
+            }
+
+    def _next_batch(self):
+        first = self._pending if self._pending is not None else self._queue.get()
+        self._pending = None
+        if first is _STOP:
+            return None
+
+        batch = [first]
+        rows = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            # Carry over the stop marker and requests that would overflow the batch
+            if item is _STOP or rows + len(item[0]) > self.max_batch_size:
+                self._pending = item
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            inputs = batch[0][0] if len(batch) == 1 else np.concatenate([item for item, _ in batch])
+            try:
+                outputs = self.forward_fn(inputs)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for item, future in batch:
+                future.set_result(outputs[offset:offset + len(item)])
+                offset += len(item)
+
+            with self._stats_lock:
+                self._batches_run += 1
+                self._requests_run += len(batch)
+                self._rows_run += len(inputs)
@@ -6,6 +6,12 @@ from typing import List, Dict, Tuple, Optional
 import json
 from datetime import datetime
 import hashlib
+import time
+from .streaming import SpillArray, get_streaming_threshold, get_memory_budget_mb, rows_for_budget
+from .burst_blocking import BurstBlocker, get_burst_blocking_config
+from .image_features import compute_quality, extract_features, feature_quality, load_image, decode_image
+from .raw_preview import is_preview_format
+from .similarity_graph import SimilarityGraph
 
 class PixelAnalyzer:
     def __init__(self):
@@ -22,65 +28,27 @@ class PixelAnalyzer:
     def assess_image_quality(self, image_path: str) -> Dict[str, float]:
         """Assess image quality using multiple metrics"""
         try:
-            # Load image
-            image = cv2.imread(image_path)
+            # Load image (the embedded preview for HEIC/RAW)
+            image, original_size = load_image(image_path)
             if image is None:
                 return {'overall_score': 0.0}
             
-            # Convert to grayscale for some calculations
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # 1. Resolution score (normalized by typical photo resolution)
-            height, width = image.shape[:2]
-            resolution_score = min(1.0, (height * width) / (1920 * 1080))
-            
-            # 2. Sharpness score (using Laplacian variance)
-            sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
-            sharpness_score = min(1.0, sharpness / 500)  # Normalize
-            
-            # 3. Brightness score
-            mean_brightness = np.mean(gray)
-            brightness_score = 1.0 - abs(mean_brightness - 127) / 127
-            
-            # 4. Contrast score
-            contrast = np.std(gray)
-            contrast_score = min(1.0, contrast / 50)
-            
-            # 5. Noise assessment (using variance of differences)
-            kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
-            noise = cv2.filter2D(gray, -1, kernel)
-            noise_score = max(0.0, 1.0 - np.var(noise) / 1000)
-            
-            # Calculate weighted overall score
-            overall_score = (
-                self.quality_weights['resolution'] * resolution_score +
-                self.quality_weights['sharpness'] * sharpness_score +
-                self.quality_weights['brightness'] * brightness_score +
-                self.quality_weights['contrast'] * contrast_score +
-                self.quality_weights['noise'] * noise_score
-            )
-            
-            return {
-                'overall_score': overall_score,
-                'resolution_score': resolution_score,
-                'sharpness_score': sharpness_score,
-                'brightness_score': brightness_score,
-                'contrast_score': contrast_score,
-                'noise_score': noise_score,
-                'width': width,
-                'height': height
-            }
+            return compute_quality(image, self.quality_weights, original_size=original_size)
             
         except Exception as e:
             print(f"Error assessing quality for {image_path}: {e}")
             return {'overall_score': 0.0}
     
+    def extract_features(self, image_paths: List[str], include_clip: bool = False) -> List[Optional[Dict]]:
+        """Decode every image once into a feature record (thumbnail, hash, quality, ...)"""
+        return extract_features(image_paths, self.quality_weights, include_clip)
+    
     def calculate_pixel_similarity(self, image_path1: str, image_path2: str, resize_to: tuple = (64, 64)) -> float:
         """Calculate pixel-by-pixel similarity between two images"""
         try:
             # Load images
-            img1 = cv2.imread(image_path1)
-            img2 = cv2.imread(image_path2)
+            img1 = decode_image(image_path1)
+            img2 = decode_image(image_path2)
             
             if img1 is None or img2 is None:
                 return 0.0
@@ -107,14 +75,173 @@ class PixelAnalyzer:
             print(f"Error calculating pixel similarity: {e}")
             return 0.0
     
-    def group_exact_duplicates(self, image_paths: List[str], similarity_threshold: float = 0.96) -> List[List[int]]:
-        """Group exact duplicate images using pixel-by-pixel comparison"""
+    def compute_fingerprint(self, image_path: str, resize_to: tuple = (64, 64)) -> Optional[np.ndarray]:
+        """Compute the grayscale thumbnail used for pixel comparisons"""
+        image = decode_image(image_path)
+        if image is None:
+            return None
+        
+        resized = cv2.resize(image, resize_to)
+        return cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+    
+    def compute_perceptual_hash(self, image_path: str, hash_size: int = 8) -> Optional[np.ndarray]:
+        """Compute a 64-bit difference hash (dHash), packed into 8 bytes"""
+        if is_preview_format(image_path):
+            preview = decode_image(image_path)
+            image = cv2.cvtColor(preview, cv2.COLOR_BGR2GRAY) if preview is not None else None
+        else:
+            # Stored orientation, like the feature records' hashes
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is None:
+            return None
+        
+        resized = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+        differences = resized[:, 1:] > resized[:, :-1]
+        return np.packbits(differences.flatten())
+    
+    def _group_fingerprints(self, stored: np.ndarray, valid: np.ndarray, similarity_threshold: float,
+                            block_rows: int, blocker: Optional[BurstBlocker] = None,
+                            graph: Optional[SimilarityGraph] = None) -> List[List[int]]:
+        """Greedy grouping over flattened grayscale thumbnails, compared block by block
+        
+        With a ``graph``, every candidate pair is scored (not only pairs of
+        still ungrouped images) and the scores are recorded as pixel edges.
+        """
+        num_images = len(valid)
+        max_mse = 255 ** 2
+        processed = np.zeros(num_images, dtype=bool)
+        groups = []
+        
+        for i in range(num_images):
+            starts_group = not processed[i]
+            if not starts_group and graph is None:
+                continue
+            
+            current_group = [i]
+            processed[i] = True
+            
+            if valid[i]:
+                reference = stored[i].astype(np.float64)
+                candidates = np.arange(i + 1, num_images) if blocker is None else blocker.candidates_after(i)
+                candidates = candidates[valid[candidates]]
+                if graph is None:
+                    candidates = candidates[~processed[candidates]]
+                
+                for start in range(0, len(candidates), block_rows):
+                    block_candidates = candidates[start:start + block_rows]
+                    block = stored[block_candidates].astype(np.float64)
+                    mse = np.mean((block - reference) ** 2, axis=1)
+                    similarity = 1.0 - mse / max_mse
+                    if graph is not None:
+                        graph.add_pixel_edges(i, block_candidates, similarity)
+                    if not starts_group:
+                        continue
+                    
+                    for j in block_candidates[(similarity >= similarity_threshold) & ~processed[block_candidates]]:
+                        current_group.append(int(j))
+                        processed[j] = True
+            
+            if not starts_group:
+                continue
+            if len(current_group) > 1:
+                print(f"Image {i} grouped with {len(current_group) - 1} exact duplicates")
+            groups.append(current_group)
+        return groups
+    
+    def group_exact_duplicates_streaming(self, image_paths: List[str], similarity_threshold: float = 0.96,
+                                         memory_budget_mb: Optional[int] = None,
+                                         resize_to: tuple = (64, 64),
+                                         blocker: Optional[BurstBlocker] = None,
+                                         qualities_out: Optional[List[Optional[Dict]]] = None) -> List[List[int]]:
+        """Group exact duplicates in bounded memory
+        
+        Each image is decoded once into a 64x64 fingerprint that is spilled to a
+        memory-mapped file. Comparisons then read the fingerprints back in blocks
+        sized from the memory budget, so peak memory does not grow with image count.
+        Produces the same groups as group_exact_duplicates. With a ``blocker``,
+        each image is only compared with its burst candidates. If
+        ``qualities_out`` (a list with one slot per image) is given, the quality
+        of each image is assessed from the same decode and stored in it.
+        """
+        try:
+            print("Grouping exact duplicates using streaming pixel comparison...")
+            
+            if len(image_paths) < 2:
+                return []
+            
+            memory_budget_mb = memory_budget_mb or get_memory_budget_mb()
+            fingerprint_dim = resize_to[0] * resize_to[1]
+            num_images = len(image_paths)
+            
+            # Pass 1: decode each image once and spill its fingerprint to disk
+            valid = np.zeros(num_images, dtype=bool)
+            fingerprints = SpillArray(fingerprint_dim, np.uint8, initial_capacity=min(num_images, 4096))
+            try:
+                for i, image_path in enumerate(image_paths):
+                    image, original_size, fingerprint = None, None, None
+                    try:
+                        image, original_size = load_image(image_path)
+                        if image is not None:
+                            fingerprint = cv2.cvtColor(cv2.resize(image, resize_to), cv2.COLOR_BGR2GRAY)
+                    except Exception as e:
+                        print(f"Error fingerprinting {image_path}: {e}")
+                    if qualities_out is not None:
+                        qualities_out[i] = {'overall_score': 0.0}
+                        if image is not None:
+                            try:
+                                qualities_out[i] = compute_quality(image, self.quality_weights,
+                                                                   original_size=original_size)
+                            except Exception as e:
+                                print(f"Error assessing quality for {image_path}: {e}")
+                    
+                    if fingerprint is None:
+                        fingerprints.append(np.zeros(fingerprint_dim, dtype=np.uint8))
+                    else:
+                        fingerprints.append(fingerprint.reshape(-1))
+                        valid[i] = True
+                fingerprints.flush()
+                
+                # Pass 2: compare block-wise against the memory-mapped fingerprints
+                block_rows = rows_for_budget(fingerprint_dim * 8, memory_budget_mb)
+                groups = self._group_fingerprints(fingerprints.view(), valid, similarity_threshold, block_rows, blocker)
+            finally:
+                fingerprints.close()
+            
+            print(f"Streaming pixel comparison created {len(groups)} groups")
+            return groups
+            
+        except Exception as e:
+            print(f"Error grouping exact duplicates in streaming mode: {e}")
+            return []
+    
+    def group_exact_duplicates(self, image_paths: List[str], similarity_threshold: float = 0.96,
+                               blocker: Optional[BurstBlocker] = None,
+                               features: Optional[List[Optional[Dict]]] = None,
+                               graph: Optional[SimilarityGraph] = None) -> List[List[int]]:
+        """Group exact duplicate images using pixel-by-pixel comparison
+        
+        With a ``blocker``, each image is only compared with its burst candidates.
+        With ``features`` (from extract_features), the thumbnails already decoded
+        there are compared instead of decoding both images of every pair, and
+        the pair scores are recorded in ``graph`` if given.
+        """
         try:
             print("Grouping exact duplicates using pixel-by-pixel comparison...")
             
             if len(image_paths) < 2:
                 return []
             
+            if features is not None:
+                valid = np.array([record is not None for record in features], dtype=bool)
+                if not valid.any():
+                    return [[i] for i in range(len(image_paths))]
+                fingerprint_dim = next(record['thumbnail'].size for record in features if record is not None)
+                stored = np.stack([record['thumbnail'] if record is not None
+                                   else np.zeros(fingerprint_dim, dtype=np.uint8) for record in features])
+                groups = self._group_fingerprints(stored, valid, similarity_threshold, len(image_paths), blocker, graph)
+                print(f"Pixel comparison created {len(groups)} groups")
+                return groups
+            
             # Initialize groups
             groups = []
             processed = set()
@@ -128,8 +255,9 @@ class PixelAnalyzer:
                 current_group = [i]
                 processed.add(i)
                 
-                # Compare with all remaining images
-                for j in range(i + 1, len(image_paths)):
+                # Compare with all remaining images (or only burst candidates)
+                remaining = range(i + 1, len(image_paths)) if blocker is None else blocker.candidates_after(i)
+                for j in remaining:
                     if j in processed:
                         continue
                     
@@ -158,8 +286,33 @@ class PixelAnalyzer:
             print(f"Error grouping exact duplicates: {e}")
             return []
     
-    def analyze_exact_duplicates(self, image_paths: List[str]) -> Dict:
-        """Complete exact duplicate analysis pipeline"""
+    def build_burst_blocker(self, image_paths: List[str], burst_blocking: Optional[bool] = None) -> Optional[BurstBlocker]:
+        """Read capture metadata and build a BurstBlocker, if blocking is enabled
+        
+        ``burst_blocking`` defaults to PICKPERFECT_BURST_BLOCKING.
+        """
+        config = get_burst_blocking_config()
+        if burst_blocking is None:
+            burst_blocking = config['enabled']
+        if not burst_blocking or len(image_paths) < 2:
+            return None
+        
+        blocker = BurstBlocker.from_paths(image_paths, window_seconds=config['window_seconds'],
+                                          max_gps_distance_m=config['max_gps_distance_m'])
+        total_pairs = len(image_paths) * (len(image_paths) - 1) // 2
+        print(f"Burst blocking kept {blocker.pair_count()} of {total_pairs} image pairs "
+              f"({blocker.unblocked_count} images without capture time)")
+        return blocker
+    
+    def analyze_exact_duplicates(self, image_paths: List[str], streaming: Optional[bool] = None,
+                                 burst_blocking: Optional[bool] = None) -> Dict:
+        """Complete exact duplicate analysis pipeline
+        
+        Large sessions (above PICKPERFECT_STREAMING_THRESHOLD images, or when
+        streaming is True) are grouped in bounded memory. With burst_blocking
+        (default PICKPERFECT_BURST_BLOCKING), only photos taken close together
+        are compared.
+        """
         try:
             print(f"Starting exact duplicate analysis of {len(image_paths)} images...")
             
@@ -171,7 +324,40 @@ class PixelAnalyzer:
                 }
             
             # Group exact duplicates
-            groups = self.group_exact_duplicates(image_paths)
+            if streaming is None:
+                streaming = len(image_paths) > get_streaming_threshold()
+            
+            stage_start = time.time()
+            blocker = self.build_burst_blocker(image_paths, burst_blocking)
+            timings = {'burst_blocking': time.time() - stage_start} if blocker is not None else {}
+            
+            # In-memory sessions decode every image once up front; streaming keeps its own spilled pass
+            features = None
+            graph = None
+            if not streaming:
+                stage_start = time.time()
+                features = self.extract_features(image_paths)
+                timings['feature_extraction'] = time.time() - stage_start
+                # Scores are kept so the session can be re-grouped at other thresholds
+                graph = SimilarityGraph(len(image_paths), 'pixel')
+            
+            # Streaming sessions assess quality in the fingerprint pass
+            qualities = [None] * len(image_paths) if streaming else None
+            
+            def quality_of(img_idx: int) -> Dict[str, float]:
+                if features is not None:
+                    return feature_quality(features[img_idx])
+                if qualities is not None and qualities[img_idx] is not None:
+                    return qualities[img_idx]
+                return self.assess_image_quality(image_paths[img_idx])
+            
+            stage_start = time.time()
+            if streaming:
+                groups = self.group_exact_duplicates_streaming(image_paths, blocker=blocker, qualities_out=qualities)
+            else:
+                groups = self.group_exact_duplicates(image_paths, blocker=blocker, features=features, graph=graph)
+            timings['pixel_grouping'] = time.time() - stage_start
+            stage_start = time.time()
             
             # Track which images have been processed
             processed_indices = set()
@@ -184,7 +370,7 @@ class PixelAnalyzer:
                 if len(group) == 1:
                     # Single image - no duplicates
                     image_path = image_paths[group[0]]
-                    quality = self.assess_image_quality(image_path)
+                    quality = quality_of(group[0])
                     
                     analyzed_groups.append({
                         'id': f"unique_{group_idx}",
@@ -210,7 +396,7 @@ class PixelAnalyzer:
                     
                     for img_idx in group:
                         image_path = image_paths[img_idx]
-                        quality = self.assess_image_quality(image_path)
+                        quality = quality_of(img_idx)
                         file_size = os.path.getsize(image_path)
                         
                         group_images.append({
@@ -241,6 +427,8 @@ class PixelAnalyzer:
                         'similarity_score': 0.98  # High similarity for exact duplicates
                     })
             
+            timings['quality_assessment'] = time.time() - stage_start
+            
             # Calculate statistics
             total_images = len(image_paths)
             total_groups = len(analyzed_groups)
@@ -267,11 +455,16 @@ class PixelAnalyzer:
                 'estimated_space_saved_mb': estimated_space_saved_bytes / (1024 * 1024)
             }
             
-            return {
+            result = {
                 'success': True,
                 'groups': analyzed_groups,
-                'statistics': statistics
+                'statistics': statistics,
+                'timings': timings
             }
+            if graph is not None:
+                graph.set_nodes(analyzed_groups, image_paths)
+                result['similarity_graph'] = graph.to_dict()
+            return result
             
         except Exception as e:
             print(f"Error in exact duplicate analysis: {e}")
@@ -0,0 +1,46 @@
+import os
+import gc
+from typing import Optional
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (the affinity mask, so container CPU limits set by cpuset count)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_torch_threads(processes: int) -> int:
+    """Intra-op threads per process: PICKPERFECT_TORCH_THREADS, or the CPUs split between the processes"""
+    threads = os.getenv('PICKPERFECT_TORCH_THREADS')
+    if threads:
+        return max(1, int(threads))
+    return max(1, available_cpus() // max(1, processes))
+
+
+def before_preload():
+    """Call in the parent before loading the model
+
+    Loading with a single intra-op thread keeps the parent from starting an
+    OpenMP thread pool, which forked children could not use.
+    """
+    import torch
+    torch.set_num_threads(1)
+
+
+def before_fork():
+    """Call in the parent right before forking
+
+    Moves every object the parent created (the model included) into the
+    permanent GC generation, so the children's garbage collections never
+    write to those pages and they stay shared copy-on-write.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork(processes: int, torch_threads: Optional[int] = None):
+    """Call in each child: size torch's thread pool for ``processes`` processes sharing the host"""
+    import torch
+    torch.set_num_threads(torch_threads or get_torch_threads(processes))
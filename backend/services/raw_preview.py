@@ -0,0 +1,108 @@
+import os
+import cv2
+import numpy as np
+from PIL import Image
+from typing import Optional, Tuple
+
+# Optional decoders: rawpy (LibRaw) for camera RAW, pillow-heif for HEIC/HEIF
+try:
+    import rawpy
+except ImportError:
+    rawpy = None
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pillow_heif = None
+
+RAW_EXTENSIONS = {'.dng', '.cr2', '.cr3', '.nef', '.nrw', '.arw', '.raf', '.orf', '.rw2', '.pef', '.srw'}
+HEIF_EXTENSIONS = {'.heic', '.heif'}
+PREVIEW_EXTENSIONS = RAW_EXTENSIONS | HEIF_EXTENSIONS
+# Formats whose decoder is installed, accepted at upload
+SUPPORTED_PREVIEW_EXTENSIONS = (RAW_EXTENSIONS if rawpy is not None else set()) | \
+    (HEIF_EXTENSIONS if pillow_heif is not None else set())
+
+RAW_MIME_TYPES = {
+    'image/heic', 'image/heif', 'image/x-adobe-dng', 'image/x-canon-cr2', 'image/x-canon-cr3',
+    'image/x-nikon-nef', 'image/x-nikon-nrw', 'image/x-sony-arw', 'image/x-fuji-raf', 'image/x-olympus-orf',
+    'image/x-panasonic-rw2', 'image/x-pentax-pef', 'image/x-samsung-srw'
+}
+
+# Previews need at least this many pixels on the short side to serve CLIP's 224x224 crop
+MIN_PREVIEW_SIDE = 256
+# Embedded JPEGs tried when scanning a RAW file without rawpy (thumbnail, preview, ...)
+MAX_SCANNED_JPEGS = 8
+# Bytes read from the start of a RAW file when scanning; previews precede the sensor data
+MAX_SCANNED_BYTES = 8 * 1024 * 1024
+
+_JPEG_SOI = b'\xff\xd8\xff'
+
+
+def is_preview_format(image_path: str) -> bool:
+    """HEIC/HEIF or camera RAW file, analyzed through its embedded preview"""
+    return os.path.splitext(image_path.lower())[1] in PREVIEW_EXTENSIONS
+
+
+def _largest_embedded_jpeg(data: bytes) -> Optional[np.ndarray]:
+    """Decode the largest JPEG embedded in the first bytes of a RAW file (RAWs store previews as plain JPEG)"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    best = None
+    start = data.find(_JPEG_SOI)
+    for _ in range(MAX_SCANNED_JPEGS):
+        if start < 0:
+            break
+        # The decoder stops at the JPEG's end marker, so the rest of the file can follow
+        image = cv2.imdecode(buffer[start:], cv2.IMREAD_COLOR)
+        if image is not None and (best is None or image.size > best.size):
+            best = image
+        start = data.find(_JPEG_SOI, start + len(_JPEG_SOI))
+    return best
+
+
+def _raw_preview(image_path: str) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+    if rawpy is None:
+        with open(image_path, 'rb') as f:
+            preview = _largest_embedded_jpeg(f.read(MAX_SCANNED_BYTES))
+        return (preview, (preview.shape[1], preview.shape[0])) if preview is not None else None
+
+    with rawpy.imread(image_path) as raw:
+        original_size = (raw.sizes.width, raw.sizes.height)
+        try:
+            thumb = raw.extract_thumb()
+            if thumb.format == rawpy.ThumbFormat.JPEG:
+                preview = cv2.imdecode(np.frombuffer(thumb.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            else:
+                preview = cv2.cvtColor(np.ascontiguousarray(thumb.data), cv2.COLOR_RGB2BGR)
+        except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+            preview = None
+
+    # Sensor data is never demosaiced here; a RAW without an embedded thumbnail is unreadable for analysis
+    if preview is None:
+        return None
+    return preview, original_size
+
+
+def _heif_preview(image_path: str) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+    if pillow_heif is None:
+        return None
+    with Image.open(image_path) as image:
+        original_size = image.size
+        # The smallest stored thumbnail that still covers MIN_PREVIEW_SIDE, or the image itself
+        preview = pillow_heif.thumbnail(image, min_box=MIN_PREVIEW_SIDE)
+        return cv2.cvtColor(np.asarray(preview.convert('RGB')), cv2.COLOR_RGB2BGR), original_size
+
+
+def load_preview(image_path: str) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+    """Embedded preview of a HEIC or RAW photo as a BGR array, with the original (width, height)
+
+    Returns None if the format's decoder is not installed or the file has no
+    readable preview.
+    """
+    try:
+        if os.path.splitext(image_path.lower())[1] in HEIF_EXTENSIONS:
+            return _heif_preview(image_path)
+        return _raw_preview(image_path)
+    except Exception as e:
+        print(f"Error reading preview of {image_path}: {e}")
+        return None
@@ -0,0 +1,107 @@
+import os
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256, gzip_min_size: int = 1024, gzip_level: int = 6):
+        """Cache of serialized (and optionally gzipped) JSON response bodies
+
+        Entries are keyed by session and response variant and tagged with the
+        session's result revision, so a new result invalidates them implicitly.
+        Revisions come from one counter per process, so a session that is
+        forgotten and analyzed again never reuses an earlier revision.
+        """
+        self.max_entries = max_entries
+        self.gzip_min_size = gzip_min_size
+        self.gzip_level = gzip_level
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._revisions: Dict[str, int] = {}
+        self._counter = 0
+        self._pid = None
+        self._nonce = None
+        self._lock = threading.Lock()
+
+    def _process_nonce(self) -> str:
+        # Drawn per process (also after a fork from a preloading master), so
+        # a restarted server never repeats the ETags of the previous one
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._nonce = os.urandom(8).hex()
+        return self._nonce
+
+    def bump_revision(self, session_id: str) -> int:
+        """Mark the result of a session as changed and drop its cached bodies"""
+        with self._lock:
+            self._counter += 1
+            self._revisions[session_id] = self._counter
+            self._drop_session(session_id)
+            return self._counter
+
+    def revision(self, session_id: str) -> int:
+        """Current result revision of a session (0 before its first result)
+
+        Read it before the result itself: the result is then at least as new
+        as the revision, so an ETag never vouches for an older body.
+        """
+        with self._lock:
+            return self._revisions.get(session_id, 0)
+
+    def forget(self, session_id: str):
+        """Forget a session entirely (e.g. after cleanup)"""
+        with self._lock:
+            self._revisions.pop(session_id, None)
+            self._drop_session(session_id)
+
+    def _drop_session(self, session_id: str):
+        for key in [key for key in self._entries if key[0] == session_id]:
+            del self._entries[key]
+
+    def make_etag(self, session_id: str, variant: Tuple, revision: int, version=None,
+                  use_gzip: bool = False) -> str:
+        """Compute a strong ETag from the session revision, response variant and encoding
+
+        Revisions are counted per process and combined with a per-process
+        nonce; ``version`` identifies the result across processes (e.g. its
+        broker job and update time) and replaces both, so ETags of different
+        web workers only match for the same result. Gzipped and identity
+        bodies differ byte for byte, so they get different tags.
+        """
+        with self._lock:
+            origin = self._process_nonce() if version is None else None
+        identity = f"{origin}:{revision}" if version is None else repr(version)
+        encoding = 'gzip' if use_gzip else 'identity'
+        seed = f"{session_id}:{identity}:{variant!r}:{encoding}".encode('utf-8')
+        return hashlib.sha1(seed).hexdigest()
+
+    def get_body(self, session_id: str, etag: str, build_payload: Callable[[], Dict],
+                 use_gzip: bool) -> Tuple[bytes, bool]:
+        """Return the serialized body for an ETag, building it on a cache miss
+
+        Returns a tuple of (body, is_gzipped).
+        """
+        key = (session_id, etag, use_gzip)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry['body'], entry['gzipped']
+
+        body = json.dumps(build_payload(), separators=(',', ':')).encode('utf-8')
+        gzipped = False
+        if use_gzip and len(body) >= self.gzip_min_size:
+            body = gzip.compress(body, compresslevel=self.gzip_level)
+            gzipped = True
+
+        with self._lock:
+            self._entries[key] = {'body': body, 'gzipped': gzipped}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return body, gzipped
@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import tempfile
+from typing import List, Dict, Optional
+from werkzeug.utils import secure_filename
+
+from .clip_preprocess import CLIP_MODEL_NAME
+from .similarity_graph import DEFAULT_PIXEL_THRESHOLD, DEFAULT_AI_THRESHOLD
+from .burst_blocking import get_burst_blocking_config
+from .similarity_cascade import get_cascade_config
+from .streaming import get_streaming_threshold
+
+# Bump when the analyzers' result format or grouping changes, so older entries are not served
+RESULT_CACHE_VERSION = 1
+
+DEFAULT_RESULT_CACHE_ROOT = os.path.join('pickperfect', 'results')
+DEFAULT_MAX_ENTRIES = 1000
+
+# Results handed over by a draining web worker, keyed by session (see put_session)
+SESSION_DIR = 'sessions'
+
+
+def get_result_cache_config() -> Dict:
+    """Result cache settings from the environment (PICKPERFECT_RESULT_CACHE*)"""
+    return {
+        'enabled': os.getenv('PICKPERFECT_RESULT_CACHE', '1') != '0',
+        'root': os.getenv('PICKPERFECT_RESULT_CACHE_ROOT', DEFAULT_RESULT_CACHE_ROOT),
+        'max_entries': int(os.getenv('PICKPERFECT_RESULT_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    }
+
+
+def analysis_settings(analysis_type: str) -> Dict:
+    """Everything besides the files that decides an analysis result"""
+    settings = {
+        'version': RESULT_CACHE_VERSION,
+        'analysis_type': analysis_type,
+        'thresholds': {'pixel': DEFAULT_PIXEL_THRESHOLD, 'ai': DEFAULT_AI_THRESHOLD},
+        'burst_blocking': get_burst_blocking_config(),
+        'streaming_threshold': get_streaming_threshold()
+    }
+    if analysis_type == 'ai':
+        settings.update({
+            'model': CLIP_MODEL_NAME,
+            'fast_preprocessing': os.getenv('PICKPERFECT_FAST_PREPROCESSING', '1') != '0',
+            'cascade': get_cascade_config(),
+            'library_index': os.getenv('PICKPERFECT_LIBRARY_INDEX', '1') != '0'
+        })
+    return settings
+
+
+def build_manifest(session_files: List[Dict], analysis_type: str, library_revision: Optional[str] = None) -> Dict:
+    """Content manifest of a session: one (name, size, hash) entry per file plus the analysis settings
+
+    Files are identified by the storage eTag (an MD5 of the content), falling
+    back to the last modification time when the listing has none. Adding,
+    removing or replacing a file changes the manifest. AI results also flag
+    matches in the user's library, so ``library_revision`` (see
+    UserLibraryIndex.content_revision) is part of their manifest.
+    """
+    files = sorted(
+        [file_info['name'], int(file_info.get('size') or 0), file_info.get('etag') or file_info.get('updated_at', '')]
+        for file_info in session_files
+    )
+    manifest = {'files': files, 'settings': analysis_settings(analysis_type)}
+    if library_revision is not None:
+        manifest['library'] = library_revision
+    return manifest
+
+
+def manifest_key(manifest: Dict) -> str:
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root: Optional[str] = None, max_entries: Optional[int] = None):
+        """Analysis results on disk, keyed by the session's content manifest
+
+        Shared by the web server and the workers: whoever finishes an analysis
+        stores it, and a repeat request for the same files and settings is
+        answered from disk without downloading or analyzing anything. Entries
+        are replaced atomically; the least recently used ones are removed once
+        there are more than ``max_entries``.
+        """
+        config = get_result_cache_config()
+        self.root = root or config['root']
+        self.max_entries = max_entries or config['max_entries']
+        os.makedirs(self.root, exist_ok=True)
+
+    def key_for(self, session_files: List[Dict], analysis_type: str, library_revision: Optional[str] = None) -> str:
+        return manifest_key(build_manifest(session_files, analysis_type, library_revision))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Stored result for ``key`` (a fresh copy), or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                result = json.load(f)
+            os.utime(path)
+            return result
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading cached result {key}: {e}")
+            return None
+
+    def put(self, key: str, result: Dict):
+        """Store a successful result; failures are not cached"""
+        if not result.get('success'):
+            return
+        if self._write(self.root, self._path(key), result):
+            self._evict(self.root)
+
+    def _session_path(self, session_id: str) -> Optional[str]:
+        if not session_id or secure_filename(session_id) != session_id:
+            return None
+        return os.path.join(self.root, SESSION_DIR, f"{session_id}.json")
+
+    def put_session(self, session_id: str, result: Dict):
+        """Hand the result of a session (failures included) to the next process serving it
+
+        A thread-mode web worker that is replaced stores the analyses it
+        finishes while draining here, so its replacement can answer status
+        polls for them (see ``take_session``).
+        """
+        path = self._session_path(session_id)
+        if path is None:
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if self._write(directory, path, result):
+            self._evict(directory)
+
+    def take_session(self, session_id: str) -> Optional[Dict]:
+        """Remove and return the result handed over for a session, or None"""
+        path = self._session_path(session_id)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r') as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading handed over result of session {session_id}: {e}")
+            return None
+        self.discard_session(session_id)
+        return result
+
+    def discard_session(self, session_id: str):
+        path = self._session_path(session_id)
+        if path is not None and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _write(directory: str, path: str, result: Dict) -> bool:
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(result, f)
+            os.replace(temp_path, path)
+            return True
+        except Exception as e:
+            print(f"Error writing result {path}: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+    def _evict(self, directory: str):
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(directory, name)), name))
+                except OSError:
+                    continue
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, name in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
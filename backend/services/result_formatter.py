@@ -0,0 +1,139 @@
+from typing import List, Dict, Optional, Tuple
+
+# Quality metrics stored as columns in the compact result format
+QUALITY_FIELDS = [
+    'overall_score',
+    'resolution_score',
+    'sharpness_score',
+    'brightness_score',
+    'contrast_score',
+    'noise_score',
+    'width',
+    'height'
+]
+
+COMPACT_FORMAT_VERSION = 1
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def compact_groups(groups: List[Dict]) -> Dict:
+    """Convert legacy analysis groups into the compact columnar format
+
+    Every image is stored once in the ``images`` table: ``path`` and ``file_size``
+    are lists and each quality metric is a column. Groups reference images by index
+    and the best image is referenced by index instead of being repeated.
+    """
+    paths = []
+    file_sizes = []
+    quality_columns = {field: [] for field in QUALITY_FIELDS}
+    library_matches = []
+    path_to_index = {}
+
+    def add_image(image: Dict) -> int:
+        path = image.get('path')
+        if path in path_to_index:
+            return path_to_index[path]
+
+        index = len(paths)
+        path_to_index[path] = index
+        paths.append(path)
+        file_sizes.append(image.get('file_size', 0))
+
+        quality = image.get('quality') or {}
+        for field in QUALITY_FIELDS:
+            quality_columns[field].append(quality.get(field))
+        library_matches.append(image.get('library_matches'))
+        return index
+
+    compact = []
+    for group in groups:
+        image_indices = [add_image(image) for image in group.get('images', [])]
+
+        best_index = None
+        best_image = group.get('best_image')
+        if best_image:
+            best_index = add_image(best_image)
+
+        compact_group = {
+            'id': group.get('id'),
+            'type': group.get('type'),
+            'count': group.get('count', len(image_indices)),
+            'similarity_score': group.get('similarity_score'),
+            'images': image_indices,
+            'best_image': best_index
+        }
+        if group.get('library_matches'):
+            compact_group['library_matches'] = group['library_matches']
+        compact.append(compact_group)
+
+    images = {
+        'path': paths,
+        'file_size': file_sizes,
+        'quality': quality_columns
+    }
+    # Only sent when some image duplicates a photo from the user's library
+    if any(library_matches):
+        images['library_matches'] = library_matches
+
+    return {
+        'images': images,
+        'groups': compact
+    }
+
+
+def parse_page_args(cursor: Optional[str], limit: Optional[str]) -> Tuple[int, Optional[int]]:
+    """Parse cursor/limit query arguments into (offset, limit)
+
+    Returns a ``None`` limit when pagination was not requested.
+    """
+    try:
+        offset = max(0, int(cursor)) if cursor else 0
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    if limit is None and cursor is None:
+        return 0, None
+
+    try:
+        page_size = int(limit) if limit else DEFAULT_PAGE_SIZE
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+
+    return offset, max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def format_result(result: Dict, result_format: str = 'full', offset: int = 0, limit: Optional[int] = None) -> Dict:
+    """Format an analysis result for the API, optionally paginated over groups"""
+    groups = result.get('groups', [])
+    total_groups = len(groups)
+
+    if limit is not None:
+        page_groups = groups[offset:offset + limit]
+        next_offset = offset + limit
+        next_cursor = str(next_offset) if next_offset < total_groups else None
+    else:
+        page_groups = groups
+        next_cursor = None
+
+    if result_format == 'compact':
+        formatted = {
+            'success': result.get('success', False),
+            'format': 'compact',
+            'version': COMPACT_FORMAT_VERSION,
+            'statistics': result.get('statistics', {})
+        }
+        formatted.update(compact_groups(page_groups))
+    else:
+        formatted = dict(result)
+        formatted['groups'] = page_groups
+
+    if limit is not None:
+        formatted['pagination'] = {
+            'cursor': str(offset),
+            'next_cursor': next_cursor,
+            'limit': limit,
+            'total_groups': total_groups
+        }
+
+    return formatted
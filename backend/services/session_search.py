@@ -0,0 +1,150 @@
+import os
+import tempfile
+import threading
+import numpy as np
+import faiss
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from werkzeug.utils import secure_filename
+from .vector_index import get_index_config, create_index, train_and_add
+
+DEFAULT_SESSION_EMBEDDING_ROOT = os.path.join('pickperfect', 'session_embeddings')
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_SEARCH_K = 20
+MAX_SEARCH_K = 200
+
+
+def get_session_search_config() -> Dict:
+    """Session search settings from the environment (PICKPERFECT_SESSION_SEARCH*)"""
+    return {
+        'enabled': os.getenv('PICKPERFECT_SESSION_SEARCH', '1') != '0',
+        # Also embed the photos the analysis did not compare, so every photo is searchable
+        'embed_all': os.getenv('PICKPERFECT_SESSION_SEARCH_EMBED_ALL', '0') == '1',
+        'root': os.getenv('PICKPERFECT_SESSION_SEARCH_ROOT', DEFAULT_SESSION_EMBEDDING_ROOT),
+        'max_sessions': int(os.getenv('PICKPERFECT_SESSION_SEARCH_MAX_SESSIONS', DEFAULT_MAX_SESSIONS))
+    }
+
+
+class SessionEmbeddingStore:
+    def __init__(self, root: Optional[str] = None, max_sessions: Optional[int] = None, max_loaded: int = 32):
+        """CLIP image embeddings of analyzed sessions, for text search
+
+        AI analyses save the embeddings they computed, keyed by storage path, to
+        one ``.npz`` file per session; any process can search them afterwards.
+        A loaded session keeps its FAISS index in memory (up to ``max_loaded``
+        sessions) until its file changes. Files are replaced atomically, and
+        the least recently used are removed once there are more than
+        ``max_sessions``.
+        """
+        config = get_session_search_config()
+        self.root = root or config['root']
+        self.max_sessions = max_sessions or config['max_sessions']
+        self.max_loaded = max_loaded
+        self._loaded: "OrderedDict[str, Tuple[tuple, List[str], faiss.Index]]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.root, f"{secure_filename(session_id) or 'session'}.npz")
+
+    def save(self, session_id: str, paths: List[str], embeddings: np.ndarray):
+        """Store a session's embeddings, one row per entry of ``paths``"""
+        if not paths:
+            return
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, paths=np.asarray(paths, dtype=str), embeddings=np.asarray(embeddings, dtype='float32'))
+            os.replace(temp_path, self._path(session_id))
+        except Exception as e:
+            print(f"Error saving embeddings of session {session_id}: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._evict()
+
+    def remove(self, session_id: str):
+        with self._lock:
+            self._loaded.pop(session_id, None)
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _load(self, session_id: str) -> Optional[Tuple[List[str], faiss.Index]]:
+        path = self._path(session_id)
+        try:
+            # Saves replace the file, so its inode identifies the version; mtime tracks last use
+            stat = os.stat(path)
+            version = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            with self._lock:
+                self._loaded.pop(session_id, None)
+            return None
+
+        with self._lock:
+            loaded = self._loaded.get(session_id)
+            if loaded is not None and loaded[0] == version:
+                self._loaded.move_to_end(session_id)
+                self._touch(path)
+                return loaded[1], loaded[2]
+
+        with np.load(path, allow_pickle=False) as data:
+            paths = data['paths'].tolist()
+            embeddings = np.ascontiguousarray(data['embeddings'], dtype='float32')
+        index_config = get_index_config()
+        index = create_index(embeddings.shape[1], len(embeddings), index_config['index_type'], index_config['params'])
+        train_and_add(index, embeddings, index_config['params'])
+        self._touch(path)
+
+        with self._lock:
+            self._loaded[session_id] = (version, paths, index)
+            self._loaded.move_to_end(session_id)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return paths, index
+
+    def _touch(self, path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def search(self, session_id: str, query_embeddings: np.ndarray, k: int = DEFAULT_SEARCH_K) -> Optional[List[List[Dict]]]:
+        """Photos of a session ranked by similarity to each query embedding
+
+        Returns one list of {'path', 'similarity'} per query, or None if the
+        session has no stored embeddings.
+        """
+        loaded = self._load(session_id)
+        if loaded is None:
+            return None
+        paths, index = loaded
+
+        queries = np.ascontiguousarray(query_embeddings, dtype='float32').reshape(-1, index.d)
+        similarities, rows = index.search(queries, min(k, index.ntotal))
+        return [
+            [
+                {'path': paths[row], 'similarity': float(similarity)}
+                for similarity, row in zip(row_similarities, row_ids) if row != -1
+            ]
+            for row_similarities, row_ids in zip(similarities, rows)
+        ]
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.npz'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.root, name)), name))
+                except OSError:
+                    continue
+        if len(entries) <= self.max_sessions:
+            return
+        entries.sort()
+        for _, name in entries[:len(entries) - self.max_sessions]:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                pass
@@ -0,0 +1,218 @@
+import os
+import time
+import hashlib
+import numpy as np
+from typing import List, Dict, Optional, Callable, Tuple
+from .image_features import extract_image_features
+
+# Per-stage thresholds; every value can be overridden with PICKPERFECT_CASCADE_<NAME>
+DEFAULT_CASCADE_PARAMS = {
+    # Duplicate stage: a pair is a duplicate when any of these match
+    'phash_match_distance': 4,
+    'thumbnail_match': 0.96,
+    # Merge stage: group representatives with less histogram overlap are different...
+    'histogram_reject': 0.5,
+    # ...and with close hashes and overlapping histograms similar, without CLIP
+    'phash_similar_distance': 10,
+    'histogram_similar': 0.9,
+    # Ambiguous pairs are merged at this CLIP cosine similarity
+    'clip_match': 0.9
+}
+
+CASCADE_STAGES = ('content_hash', 'perceptual_hash', 'thumbnail', 'histogram', 'clip')
+
+
+def get_cascade_config() -> Dict:
+    """Cascade switch and thresholds from the environment (PICKPERFECT_CASCADE*)"""
+    params = dict(DEFAULT_CASCADE_PARAMS)
+    for name in DEFAULT_CASCADE_PARAMS:
+        value = os.getenv(f"PICKPERFECT_CASCADE_{name.upper()}")
+        if value:
+            params[name] = float(value)
+    return {'enabled': os.getenv('PICKPERFECT_CASCADE', '0') == '1', 'params': params}
+
+
+def compute_content_hash(image_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of the file contents"""
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SimilarityCascade:
+    def __init__(self, params: Optional[Dict] = None):
+        """Group similar images with cheap stages first and CLIP only for ambiguous pairs
+
+        Images are first grouped as duplicates when their file contents match,
+        their perceptual hashes are within phash_match_distance bits or their
+        thumbnails are at least thumbnail_match similar. Group representatives
+        are then compared by color histogram: clearly different pairs are
+        rejected, clearly similar ones merged, and only the remaining pairs
+        are embedded with CLIP. Every stage counts the pairs it resolved.
+        """
+        self.params = {**DEFAULT_CASCADE_PARAMS, **(params or {})}
+        self.counts = {stage: 0 for stage in CASCADE_STAGES}
+
+    def _extract(self, image_paths: List[str],
+                 features: Optional[List[Optional[Dict]]] = None) -> Tuple[np.ndarray, List[str], np.ndarray, np.ndarray, np.ndarray]:
+        num_images = len(image_paths)
+        valid = np.zeros(num_images, dtype=bool)
+        content_hashes = [''] * num_images
+        thumbnails = phashes = histograms = None
+
+        for i, image_path in enumerate(image_paths):
+            try:
+                record = features[i] if features is not None else extract_image_features(image_path, include_clip=False)
+                content_hashes[i] = compute_content_hash(image_path)
+            except Exception as e:
+                print(f"Error computing cheap features for {image_path}: {e}")
+                record = None
+
+            if thumbnails is None and record is not None:
+                thumbnails = np.zeros((num_images, record['thumbnail'].size), dtype=np.uint8)
+                phashes = np.zeros((num_images, record['phash'].size), dtype=np.uint8)
+                histograms = np.zeros((num_images, record['histogram'].size), dtype='float32')
+            if record is not None:
+                thumbnails[i] = record['thumbnail']
+                phashes[i] = record['phash']
+                histograms[i] = record['histogram']
+                valid[i] = True
+
+        return valid, content_hashes, thumbnails, phashes, histograms
+
+    def _hash_distances(self, phashes: np.ndarray, i: int, others: np.ndarray) -> np.ndarray:
+        return np.unpackbits(np.bitwise_xor(phashes[others], phashes[i]), axis=1).sum(axis=1)
+
+    def _histogram_overlap(self, histograms: np.ndarray, i: int, others: np.ndarray) -> np.ndarray:
+        return np.minimum(histograms[others], histograms[i]).sum(axis=1)
+
+    def group_duplicates(self, valid, content_hashes, thumbnails, phashes, blocker=None) -> List[List[int]]:
+        """Greedy duplicate grouping with the content hash, perceptual hash and thumbnail stages"""
+        num_images = len(valid)
+        processed = np.zeros(num_images, dtype=bool)
+        max_mse = 255 ** 2
+        groups = []
+
+        for i in range(num_images):
+            if processed[i]:
+                continue
+            current_group = [i]
+            processed[i] = True
+
+            if valid[i]:
+                candidates = np.arange(i + 1, num_images) if blocker is None else blocker.candidates_after(i)
+                candidates = candidates[valid[candidates] & ~processed[candidates]]
+
+                same_content = np.array([content_hashes[j] == content_hashes[i] for j in candidates], dtype=bool)
+                close_hash = ~same_content & (self._hash_distances(phashes, i, candidates)
+                                              <= self.params['phash_match_distance'])
+                rest = ~same_content & ~close_hash
+                similar_thumbnail = np.zeros(len(candidates), dtype=bool)
+                if rest.any():
+                    mse = np.mean((thumbnails[candidates[rest]].astype(np.float64)
+                                   - thumbnails[i].astype(np.float64)) ** 2, axis=1)
+                    similar_thumbnail[rest] = 1.0 - mse / max_mse >= self.params['thumbnail_match']
+
+                self.counts['content_hash'] += int(same_content.sum())
+                self.counts['perceptual_hash'] += int(close_hash.sum())
+                self.counts['thumbnail'] += int(similar_thumbnail.sum())
+
+                for j in candidates[same_content | close_hash | similar_thumbnail]:
+                    current_group.append(int(j))
+                    processed[j] = True
+
+            groups.append(current_group)
+        return groups
+
+    def merge_groups(self, groups: List[List[int]], image_paths: List[str], valid, phashes, histograms,
+                     quality_fn: Callable, embed_fn: Callable, blocker=None,
+                     embeddings_out: Optional[Dict[int, np.ndarray]] = None) -> List[List[int]]:
+        """Merge groups whose representatives are similar, embedding only ambiguous pairs with CLIP"""
+        if len(groups) < 2:
+            return groups
+
+        representatives = np.array([
+            group[0] if len(group) == 1
+            else max(group, key=lambda img_idx: quality_fn(image_paths[img_idx])['overall_score'])
+            for group in groups
+        ], dtype=np.int64)
+        num_groups = len(groups)
+
+        # 1 = merge, 0 = keep apart, -1 = ambiguous (decided by CLIP)
+        decisions = np.zeros((num_groups, num_groups), dtype=np.int8)
+        for a in range(num_groups - 1):
+            i = representatives[a]
+            others = np.arange(a + 1, num_groups)
+            if blocker is not None:
+                others = others[np.array([blocker.is_candidate(i, representatives[b]) for b in others], dtype=bool)]
+            others = others[valid[representatives[others]]] if valid[i] else others[:0]
+            if len(others) == 0:
+                continue
+
+            overlap = self._histogram_overlap(histograms, i, representatives[others])
+            distance = self._hash_distances(phashes, i, representatives[others])
+            rejected = overlap < self.params['histogram_reject']
+            accepted = ~rejected & (overlap >= self.params['histogram_similar']) & \
+                (distance <= self.params['phash_similar_distance'])
+            self.counts['histogram'] += int(rejected.sum())
+            self.counts['perceptual_hash'] += int(accepted.sum())
+            decisions[a, others[accepted]] = 1
+            decisions[a, others[~rejected & ~accepted]] = -1
+
+        ambiguous = np.argwhere(decisions == -1)
+        if len(ambiguous):
+            embedded_groups = np.unique(ambiguous)
+            print(f"Cascade left {len(ambiguous)} ambiguous pairs; embedding {len(embedded_groups)} images with CLIP")
+            embeddings = embed_fn([image_paths[representatives[g]] for g in embedded_groups])
+            if embeddings is None:
+                decisions[decisions == -1] = 0
+            else:
+                position = {int(g): p for p, g in enumerate(embedded_groups)}
+                for a, b in ambiguous:
+                    similarity = float(np.dot(embeddings[position[int(a)]], embeddings[position[int(b)]]))
+                    decisions[a, b] = 1 if similarity >= self.params['clip_match'] else 0
+                self.counts['clip'] += len(ambiguous)
+                if embeddings_out is not None:
+                    for g, p in position.items():
+                        embeddings_out[int(representatives[g])] = embeddings[p]
+
+        merged_groups = [list(group) for group in groups]
+        processed_groups = set()
+        for a in range(num_groups):
+            if a in processed_groups:
+                continue
+            for b in np.nonzero(decisions[a] == 1)[0]:
+                if b in processed_groups:
+                    continue
+                merged_groups[a].extend(merged_groups[b])
+                merged_groups[b] = []
+                processed_groups.add(int(b))
+
+        return [group for group in merged_groups if group]
+
+    def run(self, image_paths: List[str], quality_fn: Callable, embed_fn: Callable, blocker=None,
+            embeddings_out: Optional[Dict[int, np.ndarray]] = None,
+            timings: Optional[Dict[str, float]] = None,
+            features: Optional[List[Optional[Dict]]] = None) -> List[List[int]]:
+        """Group ``image_paths``; ``embed_fn`` maps paths to normalized CLIP embeddings
+
+        ``features`` are the images' feature records, if already extracted.
+        """
+        timings = timings if timings is not None else {}
+
+        stage_start = time.time()
+        valid, content_hashes, thumbnails, phashes, histograms = self._extract(image_paths, features)
+        if thumbnails is None:
+            return [[i] for i in range(len(image_paths))]
+        groups = self.group_duplicates(valid, content_hashes, thumbnails, phashes, blocker)
+        timings['pixel_grouping'] = time.time() - stage_start
+
+        stage_start = time.time()
+        merged = self.merge_groups(groups, image_paths, valid, phashes, histograms, quality_fn, embed_fn,
+                                   blocker, embeddings_out)
+        timings['ai_merging'] = time.time() - stage_start
+
+        print(f"Cascade resolved pairs per stage: {self.counts}")
+        return merged
@@ -0,0 +1,215 @@
+import numpy as np
+from typing import List, Dict, Optional
+
+GRAPH_VERSION = 1
+
+# Thresholds the analyzers group with
+DEFAULT_PIXEL_THRESHOLD = 0.96
+DEFAULT_AI_THRESHOLD = 0.9
+
+# Candidate edges below these scores are not kept, so re-grouping is only
+# possible at or above them
+PIXEL_EDGE_FLOOR = 0.9
+AI_EDGE_FLOOR = 0.8
+
+
+class SimilarityGraph:
+    def __init__(self, num_images: int, analysis_type: str, pixel_threshold: float = DEFAULT_PIXEL_THRESHOLD,
+                 ai_threshold: float = DEFAULT_AI_THRESHOLD):
+        """Sparse graph of the similarity scores an analysis computed
+
+        Pixel edges hold thumbnail similarities between images, AI edges CLIP
+        similarities between the images that were embedded (group best
+        images). Together with per-image quality and file size, they let a
+        finished session be re-grouped at other thresholds without decoding
+        images or running the model.
+        """
+        self.num_images = num_images
+        self.analysis_type = analysis_type
+        self.thresholds = {'pixel': pixel_threshold, 'ai': ai_threshold}
+        self.nodes: List[Dict] = [{} for _ in range(num_images)]
+        self.pixel_edges: Dict[int, Dict[int, float]] = {}
+        self.ai_edges: Dict[int, Dict[int, float]] = {}
+        self.embedded = set()
+
+    @staticmethod
+    def _add_edges(edges: Dict[int, Dict[int, float]], i: int, others, scores, floor: float):
+        for j, score in zip(others, scores):
+            if score >= floor and i != j:
+                edges.setdefault(int(i), {})[int(j)] = float(score)
+                edges.setdefault(int(j), {})[int(i)] = float(score)
+
+    def add_pixel_edges(self, i: int, others, scores):
+        self._add_edges(self.pixel_edges, i, others, scores, PIXEL_EDGE_FLOOR)
+
+    def add_ai_scores(self, image_indices: List[int], embeddings: np.ndarray):
+        """Record CLIP similarities between every pair of embedded images"""
+        similarities = embeddings @ embeddings.T
+        for position, i in enumerate(image_indices):
+            self.embedded.add(int(i))
+            self._add_edges(self.ai_edges, i, image_indices[position + 1:], similarities[position, position + 1:],
+                            AI_EDGE_FLOOR)
+
+    def set_nodes(self, analyzed_groups: List[Dict], image_paths: List[str]):
+        """Take per-image quality, size and library matches from the analyzed groups"""
+        path_to_idx = {image_path: img_idx for img_idx, image_path in enumerate(image_paths)}
+        for group in analyzed_groups:
+            for image in group['images']:
+                node = {'path': image['path'], 'quality': image['quality'], 'file_size': image['file_size']}
+                if image.get('library_matches'):
+                    node['library_matches'] = image['library_matches']
+                self.nodes[path_to_idx[image['path']]] = node
+            if group.get('library_matches'):
+                self.nodes[path_to_idx[group['best_image']['path']]]['group_library_matches'] = group['library_matches']
+
+    def to_dict(self) -> Dict:
+        """JSON-serializable form, stored with the result"""
+        def edge_list(edges):
+            return [[i, j, round(score, 6)] for i, neighbors in edges.items() for j, score in neighbors.items() if i < j]
+
+        return {
+            'version': GRAPH_VERSION,
+            'analysis_type': self.analysis_type,
+            'thresholds': dict(self.thresholds),
+            'floors': {'pixel': PIXEL_EDGE_FLOOR, 'ai': AI_EDGE_FLOOR},
+            'nodes': self.nodes,
+            'pixel_edges': edge_list(self.pixel_edges),
+            'ai_edges': edge_list(self.ai_edges),
+            'embedded': sorted(self.embedded)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SimilarityGraph':
+        graph = cls(len(data['nodes']), data['analysis_type'], data['thresholds']['pixel'], data['thresholds']['ai'])
+        graph.nodes = data['nodes']
+        for i, j, score in data['pixel_edges']:
+            graph._add_edges(graph.pixel_edges, i, [j], [score], float('-inf'))
+        for i, j, score in data['ai_edges']:
+            graph._add_edges(graph.ai_edges, i, [j], [score], float('-inf'))
+        graph.embedded = set(data['embedded'])
+        return graph
+
+    def _quality_score(self, img_idx: int) -> float:
+        return (self.nodes[img_idx].get('quality') or {}).get('overall_score', 0.0)
+
+    def _best_image(self, group: List[int], candidates=None) -> Optional[int]:
+        # First image with the highest score, like the analyzers
+        best_idx, best_score = None, -1
+        for img_idx in group:
+            if candidates is not None and img_idx not in candidates:
+                continue
+            if self._quality_score(img_idx) > best_score:
+                best_idx, best_score = img_idx, self._quality_score(img_idx)
+        return best_idx
+
+    def regroup(self, pixel_threshold: Optional[float] = None, ai_threshold: Optional[float] = None) -> List[List[int]]:
+        """Repeat the analysis grouping on the cached scores
+
+        Images are grouped greedily by pixel similarity, then (for AI analyses)
+        groups are merged when the CLIP similarity of their best images
+        reaches ``ai_threshold``. A group whose best image was not embedded is
+        represented by its best embedded image; groups without one are not merged.
+        """
+        pixel_threshold = self.thresholds['pixel'] if pixel_threshold is None else pixel_threshold
+        ai_threshold = self.thresholds['ai'] if ai_threshold is None else ai_threshold
+        if pixel_threshold < PIXEL_EDGE_FLOOR or ai_threshold < AI_EDGE_FLOOR:
+            raise ValueError(f"Thresholds must be at least {PIXEL_EDGE_FLOOR} (pixel) and {AI_EDGE_FLOOR} (ai)")
+
+        processed = set()
+        groups = []
+        for i in range(self.num_images):
+            if i in processed:
+                continue
+            group = [i]
+            processed.add(i)
+            for j in sorted(self.pixel_edges.get(i, {})):
+                if j > i and j not in processed and self.pixel_edges[i][j] >= pixel_threshold:
+                    group.append(j)
+                    processed.add(j)
+            groups.append(group)
+
+        if self.analysis_type != 'ai' or len(groups) < 2:
+            return groups
+
+        representatives = [self._best_image(group, self.embedded) for group in groups]
+        merged_groups = [list(group) for group in groups]
+        merged = set()
+        for a in range(len(groups)):
+            if a in merged or representatives[a] is None:
+                continue
+            neighbors = self.ai_edges.get(representatives[a], {})
+            for b in range(a + 1, len(groups)):
+                if b in merged or representatives[b] is None:
+                    continue
+                if neighbors.get(representatives[b], float('-inf')) >= ai_threshold:
+                    merged_groups[a].extend(merged_groups[b])
+                    merged_groups[b] = []
+                    merged.add(b)
+        return [group for group in merged_groups if group]
+
+    def build_result(self, groups: List[List[int]], pixel_threshold: float, ai_threshold: float) -> Dict:
+        """Analysis result for ``groups`` in the analyzers' output format"""
+        is_ai = self.analysis_type == 'ai'
+        group_type = 'similar' if is_ai else 'duplicate'
+
+        def image_entry(img_idx: int) -> Dict:
+            node = self.nodes[img_idx]
+            entry = {'path': node['path'], 'quality': node['quality'], 'file_size': node['file_size']}
+            if node.get('library_matches'):
+                entry['library_matches'] = node['library_matches']
+            return entry
+
+        analyzed_groups = []
+        library_duplicate_count = 0
+        for group_idx, group in enumerate(groups):
+            best_idx = self._best_image(group)
+            if len(group) == 1:
+                analyzed_group = {
+                    'id': f"unique_{group_idx}",
+                    'type': 'unique',
+                    'images': [image_entry(group[0])],
+                    'best_image': image_entry(group[0]),
+                    'count': 1,
+                    'similarity_score': 1.0
+                }
+            else:
+                analyzed_group = {
+                    'id': f"{group_type}_{group_idx}",
+                    'type': group_type,
+                    'images': [image_entry(img_idx) for img_idx in group],
+                    'best_image': image_entry(best_idx),
+                    'count': len(group),
+                    'similarity_score': 0.85 if is_ai else 0.98
+                }
+
+            group_matches = self.nodes[best_idx].get('group_library_matches')
+            if group_matches:
+                analyzed_group['library_matches'] = group_matches
+            library_duplicate_count += sum(
+                1 for img_idx in group if group_matches or self.nodes[img_idx].get('library_matches')
+            )
+            analyzed_groups.append(analyzed_group)
+
+        estimated_space_saved_bytes = sum(
+            sum(image['file_size'] for image in group['images']) - group['best_image']['file_size']
+            for group in analyzed_groups if group['type'] == group_type
+        )
+        grouped_count = sum(1 for group in analyzed_groups if group['type'] == group_type)
+        statistics = {
+            'total_images': self.num_images,
+            'total_groups': len(analyzed_groups),
+            'duplicate_count': 0 if is_ai else grouped_count,
+            'similar_count': grouped_count if is_ai else 0,
+            'unique_count': sum(1 for group in analyzed_groups if group['type'] == 'unique'),
+            'estimated_space_saved_bytes': estimated_space_saved_bytes,
+            'estimated_space_saved_mb': estimated_space_saved_bytes / (1024 * 1024)
+        }
+        if is_ai:
+            statistics['library_duplicate_count'] = library_duplicate_count
+
+        return {
+            'success': True,
+            'groups': analyzed_groups,
+            'statistics': statistics,
+            'thresholds': {'pixel': pixel_threshold, 'ai': ai_threshold}
+        }
@@ -0,0 +1,103 @@
+import threading
+import bisect
+from typing import Dict, List, Optional
+
+# Upper bounds (in seconds) of the per-stage time histogram buckets
+DEFAULT_TIME_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600]
+
+
+class StatisticsAggregator:
+    def __init__(self, time_buckets: Optional[List[float]] = None):
+        """Running aggregates of analysis activity
+
+        Counters are updated once when a job finishes or a session is cleaned up,
+        so reading them costs the same regardless of how many results are retained.
+        """
+        self.time_buckets = sorted(time_buckets or DEFAULT_TIME_BUCKETS)
+        self._lock = threading.Lock()
+
+        self.total_sessions = 0
+        self.active_sessions = 0
+        self.completed_analyses = 0
+        self.failed_analyses = 0
+        self.cache_hits = 0
+        self.total_images_analyzed = 0
+        self.estimated_space_saved_bytes = 0
+        self.stage_times: Dict[str, Dict] = {}
+
+    def record_session_stored(self, is_new_session: bool):
+        """Record that a result was stored for a session"""
+        if not is_new_session:
+            return
+        with self._lock:
+            self.total_sessions += 1
+            self.active_sessions += 1
+
+    def record_session_removed(self):
+        """Record that a session's result was cleaned up"""
+        with self._lock:
+            self.active_sessions = max(0, self.active_sessions - 1)
+
+    def record_job(self, result: Dict, timings: Optional[Dict[str, float]] = None):
+        """Fold a finished job's result and per-stage timings into the aggregates"""
+        with self._lock:
+            if result.get('success') and 'error' not in result:
+                statistics = result.get('statistics', {})
+                self.completed_analyses += 1
+                self.total_images_analyzed += statistics.get('total_images', 0)
+                self.estimated_space_saved_bytes += statistics.get('estimated_space_saved_bytes', 0)
+            else:
+                self.failed_analyses += 1
+
+            for stage, seconds in (timings or {}).items():
+                self._record_time(stage, seconds)
+
+    def record_cache_hit(self, timings: Optional[Dict[str, float]] = None):
+        """Record a result answered from the result cache, which is not counted as an analysis"""
+        with self._lock:
+            self.cache_hits += 1
+            for stage, seconds in (timings or {}).items():
+                self._record_time(stage, seconds)
+
+    def _record_time(self, stage: str, seconds: float):
+        histogram = self.stage_times.get(stage)
+        if histogram is None:
+            histogram = {
+                'count': 0,
+                'total_seconds': 0.0,
+                'max_seconds': 0.0,
+                # One extra bucket for values above the largest bound
+                'buckets': [0] * (len(self.time_buckets) + 1)
+            }
+            self.stage_times[stage] = histogram
+
+        histogram['count'] += 1
+        histogram['total_seconds'] += seconds
+        histogram['max_seconds'] = max(histogram['max_seconds'], seconds)
+        histogram['buckets'][bisect.bisect_left(self.time_buckets, seconds)] += 1
+
+    def snapshot(self) -> Dict:
+        """Return a copy of the current aggregates"""
+        with self._lock:
+            stage_times = {}
+            for stage, histogram in self.stage_times.items():
+                labels = [f"le_{bound:g}" for bound in self.time_buckets] + ['le_inf']
+                stage_times[stage] = {
+                    'count': histogram['count'],
+                    'total_seconds': histogram['total_seconds'],
+                    'mean_seconds': histogram['total_seconds'] / histogram['count'] if histogram['count'] else 0.0,
+                    'max_seconds': histogram['max_seconds'],
+                    'histogram': dict(zip(labels, histogram['buckets']))
+                }
+
+            return {
+                'total_sessions': self.total_sessions,
+                'active_sessions': self.active_sessions,
+                'completed_analyses': self.completed_analyses,
+                'failed_analyses': self.failed_analyses,
+                'cache_hits': self.cache_hits,
+                'total_images_analyzed': self.total_images_analyzed,
+                'estimated_space_saved_bytes': self.estimated_space_saved_bytes,
+                'estimated_space_saved_mb': self.estimated_space_saved_bytes / (1024 * 1024),
+                'stage_times': stage_times
+            }
@@ -0,0 +1,156 @@
+import os
+import mimetypes
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, Dict, Optional
+from werkzeug.utils import secure_filename
+from .raw_preview import RAW_MIME_TYPES, PREVIEW_EXTENSIONS
+
+STORAGE_BACKENDS = ('supabase', 'local')
+DEFAULT_LOCAL_STORAGE_ROOT = os.path.join('pickperfect', 'storage')
+
+VALID_IMAGE_TYPES = [
+    'image/jpeg', 'image/jpg', 'image/png', 'image/gif',
+    'image/webp', 'image/bmp', 'image/tiff'
+]
+
+
+class StorageBackend(ABC):
+    """Where session photos live
+
+    Files are named ``<user_id>/<session_id>_<filename>``. ``get_session_files``
+    lists a session as dicts with name, size, mime_type, etag, created_at and
+    updated_at. ``download_session_files`` returns local paths the analyzers
+    can read, which are handed back to ``cleanup_temp_files`` after the analysis.
+    """
+
+    @abstractmethod
+    def upload_file(self, file_path: str, file_data: bytes) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_session_files(self, user_id: str, session_id: str) -> List[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def download_session_files(self, user_id: str, session_id: str) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def cleanup_temp_files(self, temp_paths: List[str]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_file_url(self, file_path: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def local_path(self, file_path: str) -> Optional[str]:
+        """Path of the stored file on this host, if the backend keeps files locally"""
+        return None
+
+    @abstractmethod
+    def delete_session_files(self, user_id: str, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def is_valid_image_file(self, file_info: Dict) -> bool:
+        """Check if a file is a valid image based on its metadata"""
+        mime_type = file_info.get('mime_type', '').lower()
+        if mime_type in VALID_IMAGE_TYPES or mime_type in RAW_MIME_TYPES:
+            return True
+        # RAW files are often stored without a specific mime type
+        return os.path.splitext(file_info.get('name', '').lower())[1] in PREVIEW_EXTENSIONS
+
+
+class LocalStorageBackend(StorageBackend):
+    def __init__(self, root: Optional[str] = None):
+        """Session photos on a local or network (e.g. NFS) filesystem
+
+        ``download_session_files`` returns the stored files' own paths, so
+        analyses read the photos in place: nothing is downloaded or copied,
+        and ``cleanup_temp_files`` leaves them alone.
+        """
+        self.root = os.path.abspath(root or os.getenv('PICKPERFECT_LOCAL_STORAGE_ROOT', DEFAULT_LOCAL_STORAGE_ROOT))
+        os.makedirs(self.root, exist_ok=True)
+        print(f"Local storage backend at {self.root}")
+
+    def local_path(self, file_path: str) -> Optional[str]:
+        """Path of ``<user_id>/<name>`` in the user's directory, or None if it would leave it"""
+        user_id, _, name = file_path.partition('/')
+        user_dir = self._user_dir(user_id)
+        path = os.path.normpath(os.path.join(user_dir, name))
+        if not name or os.path.dirname(path) != user_dir:
+            return None
+        return path
+
+    def _user_dir(self, user_id: str) -> str:
+        # The one place user ids become directory names, so listing, storing and serving agree
+        return os.path.join(self.root, secure_filename(user_id) or 'anonymous')
+
+    def upload_file(self, file_path: str, file_data: bytes) -> bool:
+        path = self.local_path(file_path)
+        if path is None:
+            print(f"Invalid storage path: {file_path}")
+            return False
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(file_data)
+            os.replace(temp_path, path)
+            return True
+        except Exception as e:
+            print(f"Error storing file {file_path}: {e}")
+            return False
+
+    def get_session_files(self, user_id: str, session_id: str) -> List[Dict]:
+        user_dir = self._user_dir(user_id)
+        if not os.path.isdir(user_dir):
+            return []
+
+        session_files = []
+        with os.scandir(user_dir) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if not entry.is_file() or not entry.name.startswith(f"{session_id}_"):
+                    continue
+                stat = entry.stat()
+                session_files.append({
+                    'name': f"{os.path.basename(user_dir)}/{entry.name}",
+                    'size': stat.st_size,
+                    'mime_type': mimetypes.guess_type(entry.name)[0] or 'application/octet-stream',
+                    # Size and modification time stand in for a content hash, so listing stays a stat() per file
+                    'etag': f"{stat.st_size:x}-{stat.st_mtime_ns:x}",
+                    'created_at': datetime.fromtimestamp(stat.st_ctime).isoformat(),
+                    'updated_at': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                })
+        return session_files
+
+    def download_session_files(self, user_id: str, session_id: str) -> List[str]:
+        return [self.local_path(file_info['name']) for file_info in self.get_session_files(user_id, session_id)]
+
+    def cleanup_temp_files(self, temp_paths: List[str]):
+        # The "downloaded" paths are the stored files themselves
+        pass
+
+    def get_file_url(self, file_path: str) -> Optional[str]:
+        path = self.local_path(file_path)
+        return f"file://{path}" if path and os.path.isfile(path) else None
+
+    def delete_session_files(self, user_id: str, session_id: str) -> bool:
+        try:
+            for file_info in self.get_session_files(user_id, session_id):
+                os.remove(self.local_path(file_info['name']))
+            return True
+        except Exception as e:
+            print(f"Error deleting session files: {e}")
+            return False
+
+
+def create_storage_backend(backend: Optional[str] = None) -> StorageBackend:
+    """Storage backend selected by PICKPERFECT_STORAGE_BACKEND ('supabase' or 'local')"""
+    backend = backend or os.getenv('PICKPERFECT_STORAGE_BACKEND', 'supabase')
+    if backend == 'local':
+        return LocalStorageBackend()
+    if backend == 'supabase':
+        from .supabase_storage import SupabaseStorageService
+        return SupabaseStorageService()
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of {STORAGE_BACKENDS}")
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Optional
+from .workspace_reaper import register_workspace, unregister_workspace
+
+# Sessions with more images than this are analyzed in streaming mode
+DEFAULT_STREAMING_THRESHOLD = 500
+# Approximate working-set budget for streaming mode, in megabytes
+DEFAULT_MEMORY_BUDGET_MB = 512
+
+
+def get_streaming_threshold() -> int:
+    """Number of images above which analyzers switch to streaming mode"""
+    return int(os.getenv('PICKPERFECT_STREAMING_THRESHOLD', DEFAULT_STREAMING_THRESHOLD))
+
+
+def get_memory_budget_mb() -> int:
+    """Working-set budget for streaming mode in megabytes"""
+    return int(os.getenv('PICKPERFECT_MEMORY_BUDGET_MB', DEFAULT_MEMORY_BUDGET_MB))
+
+
+def rows_for_budget(row_bytes: int, memory_budget_mb: int, fraction: float = 0.25,
+                    min_rows: int = 1, max_rows: int = 65536) -> int:
+    """Number of rows of ``row_bytes`` each that fit in a fraction of the budget"""
+    budget_bytes = memory_budget_mb * 1024 * 1024 * fraction
+    rows = int(budget_bytes // max(1, row_bytes))
+    return max(min_rows, min(max_rows, rows))
+
+
+class SpillArray:
+    def __init__(self, dim: int, dtype=np.float32, initial_capacity: int = 1024,
+                 directory: Optional[str] = None):
+        """Append-only 2D array spilled to a memory-mapped file on disk
+
+        Rows are written straight to the page cache, so the resident size stays
+        bounded by what the OS keeps cached rather than by the number of rows.
+        """
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.capacity = max(1, initial_capacity)
+        self._dir = tempfile.mkdtemp(prefix='pickperfect_spill_', dir=directory)
+        register_workspace(self._dir)
+        self.path = os.path.join(self._dir, 'rows.dat')
+        self._data = np.memmap(self.path, dtype=self.dtype, mode='w+', shape=(self.capacity, self.dim))
+
+    def _grow(self, min_capacity: int):
+        new_capacity = max(min_capacity, self.capacity * 2)
+        self._data.flush()
+        del self._data
+        with open(self.path, 'r+b') as f:
+            f.truncate(new_capacity * self.dim * self.dtype.itemsize)
+        self._data = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(new_capacity, self.dim))
+        self.capacity = new_capacity
+
+    def append(self, rows: np.ndarray):
+        """Append one row or a 2D block of rows"""
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, self.dim)
+        end = self.length + rows.shape[0]
+        if end > self.capacity:
+            self._grow(end)
+        self._data[self.length:end] = rows
+        self.length = end
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, item):
+        return self.view()[item]
+
+    def view(self) -> np.ndarray:
+        """Memory-mapped view over the rows written so far"""
+        return self._data[:self.length]
+
+    @property
+    def shape(self):
+        return (self.length, self.dim)
+
+    def flush(self):
+        self._data.flush()
+
+    def close(self):
+        """Release the mapping and delete the backing file"""
+        try:
+            del self._data
+        except AttributeError:
+            pass
+        shutil.rmtree(self._dir, ignore_errors=True)
+        unregister_workspace(self._dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
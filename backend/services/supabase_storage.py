@@ -6,8 +6,10 @@ import json
 from urllib.parse import urlparse
 import mimetypes
 from supabase import create_client, Client
+from .storage_backends import StorageBackend
+from .workspace_reaper import register_workspace, unregister_workspace
 
-class SupabaseStorageService:
+class SupabaseStorageService(StorageBackend):
     def __init__(self, supabase_url: str = None, supabase_key: str = None):
         """Initialize Supabase Storage service"""
         self.supabase_url = supabase_url or os.getenv('SUPABASE_URL')
@@ -96,6 +98,7 @@ class SupabaseStorageService:
                         'name': f"{user_id}/{file_name}",
                         'size': file_info.get('metadata', {}).get('size', 0),
                         'mime_type': file_info.get('metadata', {}).get('mimetype', 'image/jpeg'),
+                        'etag': file_info.get('metadata', {}).get('eTag', ''),
                         'created_at': file_info.get('created_at', ''),
                         'updated_at': file_info.get('updated_at', '')
                     })
@@ -120,11 +123,14 @@ class SupabaseStorageService:
             print(f"Downloading file: {file_path}")
             
             # Download file using Supabase client
+            temp_dir = None
             try:
                 file_data = self.supabase.storage.from_(self.bucket_name).download(file_path)
                 
                 # Save to temporary location
                 temp_dir = tempfile.mkdtemp(prefix='pickperfect_')
+                # Kept from the reaper until cleanup_temp_files
+                register_workspace(temp_dir)
                 file_name = os.path.basename(file_path)
                 temp_file_path = os.path.join(temp_dir, file_name)
                 
@@ -133,6 +139,8 @@ class SupabaseStorageService:
                     
             except Exception as download_error:
                 print(f"Error downloading file: {download_error}")
+                if temp_dir:
+                    unregister_workspace(temp_dir)
                 return None
             
             print(f"Downloaded {file_path} to {temp_file_path}")
@@ -153,11 +161,16 @@ class SupabaseStorageService:
                 return []
             
             temp_file_paths = []
-            for file_info in session_files:
-                file_path = file_info['name']
-                temp_path = self.download_file_to_temp(file_path)
-                if temp_path:
-                    temp_file_paths.append(temp_path)
+            try:
+                for file_info in session_files:
+                    file_path = file_info['name']
+                    temp_path = self.download_file_to_temp(file_path)
+                    if temp_path:
+                        temp_file_paths.append(temp_path)
+            except BaseException:
+                # Don't leak the files downloaded so far
+                self.cleanup_temp_files(temp_file_paths)
+                raise
             
             print(f"Downloaded {len(temp_file_paths)} files for session {session_id}")
             return temp_file_paths
@@ -169,15 +182,17 @@ class SupabaseStorageService:
     def cleanup_temp_files(self, temp_paths: List[str]):
         """Clean up temporary downloaded files"""
         for temp_path in temp_paths:
+            temp_dir = os.path.dirname(temp_path)
             try:
                 if os.path.exists(temp_path):
                     os.remove(temp_path)
                     # Also remove the temp directory if it's empty
-                    temp_dir = os.path.dirname(temp_path)
                     if os.path.exists(temp_dir) and not os.listdir(temp_dir):
                         os.rmdir(temp_dir)
             except Exception as e:
                 print(f"Error cleaning up temp file {temp_path}: {e}")
+            finally:
+                unregister_workspace(temp_dir)
     
     def get_file_url(self, file_path: str) -> Optional[str]:
         """Get the public URL for a file"""
@@ -192,15 +207,6 @@ class SupabaseStorageService:
             print(f"Error getting file URL: {e}")
             return None
     
-    def is_valid_image_file(self, file_info: Dict) -> bool:
-        """Check if a file is a valid image based on its metadata"""
-        mime_type = file_info.get('mime_type', '').lower()
-        valid_types = [
-            'image/jpeg', 'image/jpg', 'image/png', 'image/gif', 
-            'image/webp', 'image/bmp', 'image/tiff'
-        ]
-        return mime_type in valid_types
-    
     def delete_session_files(self, user_id: str, session_id: str) -> bool:
         """Delete all files for a session from Supabase Storage"""
         try:
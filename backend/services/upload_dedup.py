@@ -0,0 +1,88 @@
+import os
+import json
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Optional, Tuple
+from werkzeug.utils import secure_filename
+
+DEFAULT_HASH_INDEX_ROOT = os.path.join('pickperfect', 'upload_hashes')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def stream_to_file(stream, file_path: str, max_size: Optional[int] = None,
+                   chunk_size: int = HASH_CHUNK_SIZE) -> Optional[Tuple[str, int]]:
+    """Copy ``stream`` to ``file_path`` while hashing it
+
+    Returns (sha256 hex digest, size), or None (and no file) if the stream is
+    larger than ``max_size``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    if max_size is not None and size > max_size:
+        os.remove(file_path)
+        return None
+    return digest.hexdigest(), size
+
+
+class UploadHashIndex:
+    def __init__(self, root: Optional[str] = None):
+        """Per-user index of the content hashes of uploaded files
+
+        One JSON file per user maps each SHA-256 digest to the stored copies
+        with that content. Copies whose files were deleted are skipped, and
+        dropped when their digest is next claimed. Writers on several processes are serialized
+        with a file lock.
+        """
+        self.root = root or os.getenv('PICKPERFECT_UPLOAD_HASH_ROOT', DEFAULT_HASH_INDEX_ROOT)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _index_path(self, user_id: str) -> str:
+        return os.path.join(self.root, f"{secure_filename(user_id) or 'anonymous'}.json")
+
+    @contextmanager
+    def _locked_entries(self, user_id: str):
+        index_path = self._index_path(user_id)
+        with open(index_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(index_path, 'r') as f:
+                        entries = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    entries = {}
+                yield entries
+                fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(temp_path, index_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def claim(self, user_id: str, digest: str, file_path: str) -> Optional[str]:
+        """Record ``file_path`` as holding ``digest``, returning an earlier copy if there is one
+
+        A copy in the same directory (session) as ``file_path`` is preferred
+        and ``file_path`` is then not recorded, since the caller drops it.
+        Lookup and insert happen under the user's lock, so of two concurrent
+        uploads with the same content only the first stores a new copy.
+        """
+        with self._locked_entries(user_id) as entries:
+            paths = [path for path in entries.get(digest, []) if os.path.exists(path) and path != file_path]
+            same_directory = [path for path in paths if os.path.dirname(path) == os.path.dirname(file_path)]
+            if same_directory:
+                entries[digest] = paths
+                return same_directory[0]
+            entries[digest] = paths + [file_path]
+            return paths[0] if paths else None
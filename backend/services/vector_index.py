@@ -0,0 +1,122 @@
+import os
+import numpy as np
+import faiss
+from typing import Dict, Optional
+
+INDEX_TYPES = ('auto', 'flat', 'hnsw', 'ivf', 'ivfpq')
+
+# Defaults for the similarity index; every value can be overridden per call
+DEFAULT_INDEX_PARAMS = {
+    # 'auto' uses an exact flat index below this many vectors and HNSW above
+    'flat_threshold': 5000,
+    'hnsw_m': 32,
+    'hnsw_ef_construction': 200,
+    'hnsw_ef_search': 128,
+    # None picks 4 * sqrt(n) inverted lists
+    'ivf_nlist': None,
+    'ivf_nprobe': 16,
+    'pq_m': 64,
+    'pq_nbits': 8,
+    # Upper bound on vectors sampled for IVF/PQ training
+    'max_train_points': 100000
+}
+
+# FAISS warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def get_index_config() -> Dict:
+    """Index type and parameters from the environment (PICKPERFECT_INDEX_*)"""
+    params = dict(DEFAULT_INDEX_PARAMS)
+    for name in DEFAULT_INDEX_PARAMS:
+        value = os.getenv(f"PICKPERFECT_INDEX_{name.upper()}")
+        if value:
+            params[name] = int(value)
+    return {'index_type': os.getenv('PICKPERFECT_INDEX_TYPE', 'auto'), 'params': params}
+
+
+def resolve_index_type(index_type: str, expected_size: int, params: Dict) -> str:
+    """Resolve 'auto' and fall back to simpler indexes when there is too little data to train"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}")
+
+    if index_type == 'auto':
+        index_type = 'flat' if expected_size < params['flat_threshold'] else 'hnsw'
+
+    if index_type == 'ivfpq' and expected_size < (2 ** params['pq_nbits']) * MIN_POINTS_PER_CENTROID:
+        index_type = 'ivf'
+    if index_type == 'ivf' and expected_size < 2 * MIN_POINTS_PER_CENTROID:
+        index_type = 'flat'
+
+    return index_type
+
+
+def default_nlist(expected_size: int, params: Optional[Dict] = None) -> int:
+    """Number of IVF lists: ivf_nlist or 4 * sqrt(n), capped so every list can be trained"""
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    nlist = params['ivf_nlist'] or int(4 * np.sqrt(max(1, expected_size)))
+    return max(1, min(nlist, expected_size // MIN_POINTS_PER_CENTROID))
+
+
+def create_index(dim: int, expected_size: int, index_type: str = 'auto',
+                 params: Optional[Dict] = None) -> faiss.Index:
+    """Create an (untrained) inner-product index for ``expected_size`` vectors
+
+    'flat' is exact brute force, 'hnsw' a graph index tuned by hnsw_m and
+    hnsw_ef_search, 'ivf' an inverted-file index tuned by ivf_nlist/ivf_nprobe,
+    and 'ivfpq' additionally compresses vectors with product quantization.
+    """
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    index_type = resolve_index_type(index_type, expected_size, params)
+
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dim)
+
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, params['hnsw_m'], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = params['hnsw_ef_construction']
+        index.hnsw.efSearch = params['hnsw_ef_search']
+        return index
+
+    nlist = default_nlist(expected_size, params)
+    quantizer = faiss.IndexFlatIP(dim)
+
+    if index_type == 'ivfpq':
+        pq_m = params['pq_m']
+        while dim % pq_m:
+            pq_m -= 1
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, params['pq_nbits'], faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+
+    index.nprobe = min(params['ivf_nprobe'], nlist)
+    return index
+
+
+def train_and_add(index: faiss.Index, vectors: np.ndarray, params: Optional[Dict] = None,
+                  block_rows: int = 65536, ids: Optional[np.ndarray] = None) -> faiss.Index:
+    """Train the index on a sample of ``vectors`` if needed, then add them block by block
+
+    ``vectors`` may be a memory-mapped array; only the training sample and one
+    block at a time are copied into memory.
+    """
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+
+    if not index.is_trained:
+        num_vectors = len(vectors)
+        sample_size = min(num_vectors, params['max_train_points'])
+        if sample_size < num_vectors:
+            rows = np.sort(np.random.default_rng(0).choice(num_vectors, sample_size, replace=False))
+            sample = np.ascontiguousarray(vectors[rows], dtype='float32')
+        else:
+            sample = np.ascontiguousarray(vectors[:], dtype='float32')
+        index.train(sample)
+
+    for start in range(0, len(vectors), block_rows):
+        block = np.ascontiguousarray(vectors[start:start + block_rows], dtype='float32')
+        if ids is not None:
+            index.add_with_ids(block, np.asarray(ids[start:start + block_rows], dtype=np.int64))
+        else:
+            index.add(block)
+    return index
+
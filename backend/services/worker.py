@@ -0,0 +1,232 @@
+"""Standalone analysis worker
+
+Pulls analysis jobs from the shared job broker and runs them outside the web
+process. Run from the backend directory:
+
+    python -m services.worker [--db pickperfect/jobs.db] [--worker-id NAME]
+
+Start as many workers as needed on the host that holds the broker database
+(a local file: SQLite cannot be shared over a network filesystem). With ``--processes N``, one command runs N worker processes
+forked from a parent that loaded CLIP first, so they share its weights
+copy-on-write. Send the parent SIGHUP to replace each process as soon as its
+current job finishes (the replacements are forked from the same parent, so
+code changes need a full restart), or SIGTERM to let them finish and exit.
+"""
+import os
+import time
+import uuid
+import socket
+import signal
+import argparse
+import threading
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+
+from .job_broker import SQLiteJobBroker, DEFAULT_LEASE_SECONDS
+from .analysis_runner import AnalysisRunner
+from .result_cache import ResultCache, get_result_cache_config
+from .session_search import SessionEmbeddingStore, get_session_search_config
+from .pixel_analyzer import PixelAnalyzer
+from .storage_backends import create_storage_backend
+from .library_index import LibraryIndexStore
+from .workspace_reaper import WorkspaceReaper
+from . import prefork
+
+
+class AnalysisWorker:
+    def __init__(self, broker: SQLiteJobBroker, runner: AnalysisRunner, worker_id: str = None,
+                 lease_seconds: int = DEFAULT_LEASE_SECONDS, poll_interval: float = 2.0):
+        """Lease jobs from the broker, run them and report results"""
+        self.broker = broker
+        self.runner = runner
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = max(1.0, lease_seconds / 3)
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+
+    def stop(self, *args):
+        """Stop after the current job finishes"""
+        print(f"Worker {self.worker_id} stopping after current job...")
+        self._stopping.set()
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        while not done.wait(self.heartbeat_interval):
+            if not self.broker.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                print(f"Warning: Worker {self.worker_id} lost the lease on job {job_id}")
+                return
+
+    def run_job(self, job):
+        payload = job['payload']
+        print(f"Worker {self.worker_id} running job {job['id']} for session {job['session_id']} "
+              f"(attempt {job['attempts']})")
+
+        done = threading.Event()
+        heartbeat_thread = threading.Thread(target=self._heartbeat, args=(job['id'], done), daemon=True)
+        heartbeat_thread.start()
+        try:
+            result, timings = self.runner.run(
+                job['user_id'],
+                job['session_id'],
+                payload.get('analysis_type', 'pixel'),
+                payload.get('valid_files', []),
+                payload.get('profile', False)
+            )
+            if not self.broker.complete(job['id'], self.worker_id, result, timings):
+                print(f"Warning: Result of job {job['id']} discarded, lease was lost")
+        except Exception as e:
+            print(f"Error running job {job['id']}: {e}")
+            self.broker.fail(job['id'], self.worker_id, str(e))
+        finally:
+            done.set()
+            heartbeat_thread.join()
+
+    def run_forever(self):
+        print(f"Worker {self.worker_id} waiting for jobs in {self.broker.db_path}")
+        while not self._stopping.is_set():
+            job = self.broker.lease(self.worker_id, self.lease_seconds)
+            if job is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+        print(f"Worker {self.worker_id} stopped")
+
+
+class WorkerPool:
+    def __init__(self, make_worker: Callable[[int], AnalysisWorker], processes: int,
+                 torch_threads: Optional[int] = None):
+        """Pre-forked analysis workers sharing the parent's preloaded model
+
+        The parent forks ``processes`` children, each running the worker
+        ``make_worker(slot)`` builds, and replaces any child that exits. A child
+        asked to stop (SIGTERM) finishes its current job first, so SIGHUP
+        drains and replaces the children while the other children keep taking
+        jobs, and SIGTERM drains them all and exits.
+        """
+        self.make_worker = make_worker
+        self.processes = processes
+        self.torch_threads = torch_threads
+        self._children: Dict[int, int] = {}
+        self._stopping = False
+
+    def _spawn(self, slot: int):
+        prefork.before_fork()
+        pid = os.fork()
+        if pid:
+            self._children[pid] = slot
+            return
+
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            prefork.after_fork(self.processes, self.torch_threads)
+            worker = self.make_worker(slot)
+            signal.signal(signal.SIGTERM, worker.stop)
+            signal.signal(signal.SIGINT, worker.stop)
+            worker.run_forever()
+        except BaseException as e:
+            print(f"Worker process {os.getpid()} failed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _signal_children(self, signum: int):
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def restart(self, *args):
+        """Replace every child once it finishes its current job"""
+        print(f"Restarting {len(self._children)} worker processes after their current jobs...")
+        self._signal_children(signal.SIGTERM)
+
+    def stop(self, *args):
+        print("Stopping worker processes after their current jobs...")
+        self._stopping = True
+        self._signal_children(signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.restart)
+        for slot in range(self.processes):
+            self._spawn(slot)
+
+        started = {slot: time.time() for slot in range(self.processes)}
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            slot = self._children.pop(pid, None)
+            if slot is None or self._stopping:
+                continue
+            if time.time() - started[slot] < 1.0:
+                # Don't spin on a child that fails at startup
+                time.sleep(1.0)
+            started[slot] = time.time()
+            self._spawn(slot)
+        print("All worker processes stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PickPerfect analysis worker')
+    parser.add_argument('--db', default=None, help='Path to the job broker database')
+    parser.add_argument('--worker-id', default=None, help='Worker name (defaults to host-pid-random)')
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                        help='Lease duration; heartbeats renew it every third of this')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between polls of an empty queue')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Worker processes to fork from one parent that preloads the CLIP model')
+    parser.add_argument('--torch-threads', type=int, default=None,
+                        help='Intra-op threads per process (defaults to PICKPERFECT_TORCH_THREADS or CPUs / processes)')
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    ai_analyzer = None
+
+    def get_ai_analyzer():
+        # Load CLIP on the first AI job only
+        nonlocal ai_analyzer
+        if ai_analyzer is None:
+            from .ai_analyzer import AIAnalyzer
+            ai_analyzer = AIAnalyzer()
+        return ai_analyzer
+
+    def make_worker(slot: Optional[int] = None) -> AnalysisWorker:
+        library_store = LibraryIndexStore() if os.getenv('PICKPERFECT_LIBRARY_INDEX', '1') != '0' else None
+        result_cache = ResultCache() if get_result_cache_config()['enabled'] else None
+        search_config = get_session_search_config()
+        session_embeddings = SessionEmbeddingStore() if search_config['enabled'] else None
+        runner = AnalysisRunner(create_storage_backend(), PixelAnalyzer(), get_ai_analyzer, library_store,
+                                result_cache, session_embeddings, search_config['embed_all'])
+        worker_id = f"{args.worker_id}-{slot}" if args.worker_id and slot is not None else args.worker_id
+        return AnalysisWorker(SQLiteJobBroker(args.db), runner, worker_id, args.lease_seconds, args.poll_interval)
+
+    if args.processes > 1:
+        # Load CLIP before forking so every process shares one copy of the weights
+        prefork.before_preload()
+        get_ai_analyzer()
+        pool = WorkerPool(make_worker, args.processes, args.torch_threads)
+        # One reaper per host, in the parent
+        WorkspaceReaper().start()
+        pool.run()
+        return
+
+    if args.torch_threads:
+        prefork.after_fork(1, args.torch_threads)
+    worker = make_worker()
+
+    # Analysis temp directories of crashed jobs would otherwise pile up on worker hosts
+    WorkspaceReaper().start()
+
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run_forever()
+
+
+if __name__ == '__main__':
+    main()
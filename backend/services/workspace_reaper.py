@@ -0,0 +1,260 @@
+"""Workspace reaper
+
+Removes expired upload sessions and orphaned ``pickperfect_*`` temp
+directories (analysis downloads and streaming spill files), and keeps what
+remains within a disk budget by evicting the least recently active entries
+first. Directories in use by a running analysis are registered with
+register_workspace and never removed. The web app and workers run it in a
+background thread; to run one pass by hand (or from cron), from the backend
+directory:
+
+    python -m services.workspace_reaper [--uploads uploads] [--budget-mb 2048]
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from typing import List, Dict, Optional, Set
+from dotenv import load_dotenv
+
+TEMP_DIR_PREFIX = 'pickperfect_'
+DEFAULT_INTERVAL_SECONDS = 600
+DEFAULT_SESSION_MAX_AGE_HOURS = 24
+DEFAULT_TEMP_MAX_AGE_HOURS = 6
+DEFAULT_GRACE_MINUTES = 30
+# How often registered workspaces are touched, so reapers in other processes see them as active
+HEARTBEAT_SECONDS = 60
+
+_live_workspaces: Dict[str, int] = {}
+_live_lock = threading.Lock()
+_heartbeat_thread: Optional[threading.Thread] = None
+
+
+def get_reaper_config() -> Dict:
+    """Reaper settings from the environment (PICKPERFECT_REAPER_*, PICKPERFECT_DISK_BUDGET_MB)"""
+    return {
+        'interval_seconds': float(os.getenv('PICKPERFECT_REAPER_INTERVAL_SECONDS', DEFAULT_INTERVAL_SECONDS)),
+        'session_max_age_hours': float(os.getenv('PICKPERFECT_REAPER_SESSION_MAX_AGE_HOURS',
+                                                 DEFAULT_SESSION_MAX_AGE_HOURS)),
+        'temp_max_age_hours': float(os.getenv('PICKPERFECT_REAPER_TEMP_MAX_AGE_HOURS', DEFAULT_TEMP_MAX_AGE_HOURS)),
+        'grace_minutes': float(os.getenv('PICKPERFECT_REAPER_GRACE_MINUTES', DEFAULT_GRACE_MINUTES)),
+        # 0 means no budget: only expired entries are removed
+        'disk_budget_mb': float(os.getenv('PICKPERFECT_DISK_BUDGET_MB', 0))
+    }
+
+
+def register_workspace(path: str):
+    """Mark a directory as in use by this process until unregister_workspace
+
+    Reapers in this process skip it, and a heartbeat thread keeps touching it
+    so reapers in other processes on the host (e.g. the worker parent) see it
+    as recently modified and leave it alone as well.
+    """
+    global _heartbeat_thread
+    path = os.path.abspath(path)
+    with _live_lock:
+        _live_workspaces[path] = _live_workspaces.get(path, 0) + 1
+        # Threads don't survive fork, so a forked child starts its own
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(target=_heartbeat, name='workspace-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+
+def unregister_workspace(path: str):
+    path = os.path.abspath(path)
+    with _live_lock:
+        if _live_workspaces.get(path, 0) > 1:
+            _live_workspaces[path] -= 1
+        else:
+            _live_workspaces.pop(path, None)
+
+
+def live_workspaces() -> Set[str]:
+    """Directories registered by this process"""
+    with _live_lock:
+        return set(_live_workspaces)
+
+
+def _heartbeat():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        for path in live_workspaces():
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+
+def directory_usage(path: str) -> Dict:
+    """Bytes allocated under ``path`` and the time anything in it was last modified"""
+    total_bytes = 0
+    last_modified = os.path.getmtime(path)
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            # Allocated blocks, so sparse files (spill arrays, partial uploads) count what they use
+            total_bytes += stat.st_blocks * 512
+            last_modified = max(last_modified, stat.st_mtime)
+        try:
+            last_modified = max(last_modified, os.path.getmtime(root))
+        except OSError:
+            continue
+    return {'bytes': total_bytes, 'last_modified': last_modified}
+
+
+class WorkspaceReaper:
+    def __init__(self, upload_folder: str = 'uploads', temp_root: Optional[str] = None,
+                 session_max_age_hours: Optional[float] = None, temp_max_age_hours: Optional[float] = None,
+                 disk_budget_mb: Optional[float] = None, grace_minutes: Optional[float] = None,
+                 interval_seconds: Optional[float] = None):
+        """Periodic cleanup of upload sessions and analysis temp directories
+
+        Each pass removes sessions and temp directories that have not been
+        modified for longer than their maximum age, then, if the remaining
+        entries exceed the disk budget, removes the least recently modified
+        ones until they fit. Directories registered with register_workspace
+        are skipped, and entries modified within the grace period (at least
+        two heartbeats, so workspaces registered by other processes count as
+        modified) are never evicted for the budget, so running analyses and
+        uploads keep their files.
+        """
+        config = get_reaper_config()
+        self.upload_folder = upload_folder
+        self.temp_root = temp_root or tempfile.gettempdir()
+        self.session_max_age = 3600 * (session_max_age_hours if session_max_age_hours is not None
+                                       else config['session_max_age_hours'])
+        self.temp_max_age = 3600 * (temp_max_age_hours if temp_max_age_hours is not None
+                                    else config['temp_max_age_hours'])
+        disk_budget_mb = disk_budget_mb if disk_budget_mb is not None else config['disk_budget_mb']
+        self.disk_budget_bytes = int(disk_budget_mb * 1024 * 1024) if disk_budget_mb > 0 else None
+        self.grace_seconds = max(2 * HEARTBEAT_SECONDS,
+                                 60 * (grace_minutes if grace_minutes is not None else config['grace_minutes']))
+        self.interval_seconds = interval_seconds if interval_seconds is not None else config['interval_seconds']
+
+        self.last_report: Optional[Dict] = None
+        self.total_bytes_reclaimed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def scan(self) -> List[Dict]:
+        """Session and temp directories not in use by this process, with their size and last modification time"""
+        entries = []
+        live = live_workspaces()
+        sources = [('session', self.upload_folder, None), ('temp', self.temp_root, TEMP_DIR_PREFIX)]
+        for kind, parent, prefix in sources:
+            if not os.path.isdir(parent):
+                continue
+            for name in os.listdir(parent):
+                path = os.path.join(parent, name)
+                if (prefix and not name.startswith(prefix)) or not os.path.isdir(path) or os.path.islink(path):
+                    continue
+                if os.path.abspath(path) in live:
+                    continue
+                try:
+                    usage = directory_usage(path)
+                except OSError:
+                    continue
+                entries.append({'kind': kind, 'path': path, **usage})
+        return entries
+
+    def _remove(self, entry: Dict) -> bool:
+        try:
+            shutil.rmtree(entry['path'])
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Error removing {entry['path']}: {e}")
+            return False
+
+    def run_once(self) -> Dict:
+        """One cleanup pass; returns what was removed and how many bytes were reclaimed"""
+        with self._lock:
+            now = time.time()
+            entries = self.scan()
+            removed = {'expired': [], 'evicted': []}
+
+            remaining = []
+            for entry in entries:
+                max_age = self.session_max_age if entry['kind'] == 'session' else self.temp_max_age
+                if now - entry['last_modified'] > max_age and self._remove(entry):
+                    removed['expired'].append(entry)
+                else:
+                    remaining.append(entry)
+
+            total_bytes = sum(entry['bytes'] for entry in remaining)
+            if self.disk_budget_bytes is not None and total_bytes > self.disk_budget_bytes:
+                for entry in sorted(remaining, key=lambda e: e['last_modified']):
+                    if total_bytes <= self.disk_budget_bytes:
+                        break
+                    if now - entry['last_modified'] < self.grace_seconds:
+                        continue
+                    if self._remove(entry):
+                        removed['evicted'].append(entry)
+                        total_bytes -= entry['bytes']
+
+            reclaimed = sum(entry['bytes'] for entry in removed['expired'] + removed['evicted'])
+            self.total_bytes_reclaimed += reclaimed
+            self.last_report = {
+                'finished_at': time.time(),
+                'duration_seconds': time.time() - now,
+                'sessions_removed': sum(1 for group in removed.values() for e in group if e['kind'] == 'session'),
+                'temp_dirs_removed': sum(1 for group in removed.values() for e in group if e['kind'] == 'temp'),
+                'expired': len(removed['expired']),
+                'evicted': len(removed['evicted']),
+                'bytes_reclaimed': reclaimed,
+                'bytes_in_use': total_bytes,
+                'disk_budget_bytes': self.disk_budget_bytes,
+                'over_budget': self.disk_budget_bytes is not None and total_bytes > self.disk_budget_bytes,
+                'total_bytes_reclaimed': self.total_bytes_reclaimed
+            }
+            if reclaimed or self.last_report['over_budget']:
+                print(f"Workspace reaper: removed {self.last_report['sessions_removed']} sessions and "
+                      f"{self.last_report['temp_dirs_removed']} temp dirs, reclaimed {reclaimed / (1024 * 1024):.1f} MB, "
+                      f"{total_bytes / (1024 * 1024):.1f} MB in use")
+            return dict(self.last_report)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error in workspace reaper: {e}")
+
+    def start(self) -> bool:
+        """Run passes every ``interval_seconds`` in a daemon thread (an interval of 0 disables it)"""
+        if self.interval_seconds <= 0 or self._thread is not None:
+            return False
+        self._thread = threading.Thread(target=self._run, name='workspace-reaper', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PickPerfect workspace reaper (one pass)')
+    parser.add_argument('--uploads', default='uploads', help='Upload folder holding the session directories')
+    parser.add_argument('--temp-root', default=None, help='Directory holding pickperfect_* temp directories')
+    parser.add_argument('--budget-mb', type=float, default=None,
+                        help='Disk budget in MB (defaults to PICKPERFECT_DISK_BUDGET_MB)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    report = WorkspaceReaper(args.uploads, args.temp_root, disk_budget_mb=args.budget_mb).run_once()
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()